@@ -0,0 +1,120 @@
+# Spectra taken back to back, with the time each one was taken, for fly scans
+# BufferedReader - the spectrometer free runs (or follows its external trigger) into its on-board buffer and a thread
+#                  polls how many spectra are waiting and reads them out in batches, so no integration waits for
+#                  a USB round trip or for Python to ask for it
+# SoftwareReader - the same for spectrometers without a buffer, getspec called back to back on a thread
+# both hand out (t_start, t_end, 2xN spectrum) with times from time.monotonic(), like flyscan.PositionPoller
+#
+# seabreeze gives no device timestamps, so a buffered spectrum ends when the poll first saw it in the buffer.
+# When a poll finds several new ones, they are spaced one integration time apart back from the poll (never
+# before the previous poll), so a timestamp is out by at most the poll interval plus the readout of a batch.
+import queue
+import threading
+import time
+
+
+class _Reader:
+    "thread feeding (t_start, t_end, spectrum) into a queue, an error on the thread is raised on the next get"
+
+    name = "spectrum-reader"
+
+    def __init__(self, spectrum):
+        self.spectrum = spectrum
+        self.inttime = spectrum.inttime / 1000.0  # [sec]
+        self.error = None
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._guarded, name=self.name, daemon=True)
+
+    def _guarded(self):
+        try:
+            self._run()
+        except BaseException as err:
+            self.error = err
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def get(self, timeout=None):
+        """
+        every spectrum taken since the last get, oldest first
+        timeout - float - longest time [sec] to wait for the first one, 0 to return straight away (maybe with nothing)
+        """
+        items = []
+        try:
+            items.append(self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait())
+            while True:
+                items.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not items and self.error is not None:
+            raise Exception("reading out the spectrometer failed") from self.error
+        return items
+
+
+class SoftwareReader(_Reader):
+    "spectrum.getspec() back to back, a spectrum ended when getspec returned and began at most one integration earlier"
+
+    def _run(self):
+        while not self._stop.is_set():
+            t_call = time.monotonic()
+            spectrometer_output = self.spectrum.getspec()
+            t_end = time.monotonic()
+            self._queue.put((max(t_call, t_end - self.inttime), t_end, spectrometer_output))
+
+
+class BufferedReader(_Reader):
+    """
+    reads the spectrometer's on-board buffer (spectrum.enable_buffer has to have succeeded), with
+    spectrum.buffer_count() and spectrum.read_buffered(n), which reads n spectra out in one go
+    poll - float - time [sec] between looks at how many spectra are waiting
+    batch - int - most spectra read out in one go
+    """
+
+    name = "buffer-reader"
+
+    def __init__(self, spectrum, poll=0.001, batch=64):
+        super().__init__(spectrum)
+        self.poll = poll
+        self.batch = batch
+
+    def _run(self):
+        t_last = time.monotonic()
+        while not self._stop.is_set():
+            waiting = self.spectrum.buffer_count()
+            t_poll = time.monotonic()
+            if waiting == 0:
+                t_last = t_poll
+                time.sleep(self.poll)
+                continue
+            spectra = self.spectrum.read_buffered(min(waiting, self.batch))
+            k = len(spectra)
+            for j, spectrometer_output in enumerate(spectra):
+                t_end = max(t_poll - (k - 1 - j) * self.inttime, t_last)
+                self._queue.put((t_end - self.inttime, t_end, spectrometer_output))
+            t_last = t_poll
+
+    def stop(self):
+        try:
+            super().stop()
+        finally:
+            self.spectrum.disable_buffer()
+
+
+def open_reader(spectrum, buffer=0, poll=0.001):
+    """
+    starts reading spectra back to back
+    buffer - int - spectra the on-board buffer should hold, 0 (or a spectrometer without one) reads in software
+    OUTPUT: the running BufferedReader or SoftwareReader, stop() it when done
+    """
+    enable = getattr(spectrum, "enable_buffer", None)
+    if buffer > 0:
+        if enable is not None and enable(buffer):
+            return BufferedReader(spectrum, poll=poll).start()
+        print("the spectrometer's on-board buffer can't be read out in bulk, reading spectra one at a time instead")
+    return SoftwareReader(spectrum).start()
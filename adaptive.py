@@ -0,0 +1,161 @@
+# Adaptive angular sampling
+# starts from a coarse grid of angles, fits the integrated intensity to a low-order Fourier series
+# in angle as points come in, and keeps adding angles where the fit and the data disagree most
+# or the response bends most (lobes and nodes), until a point budget or error tolerance is reached
+import time
+
+import numpy as np
+
+import exposure
+import planner
+import scan
+import timing
+
+
+def fourier_design(theta, harmonics, period=360.0):
+    "design matrix [1, cos(k w theta), sin(k w theta) for k = 1..harmonics] of angles theta [deg], w = 2 pi / period"
+    w = 2.0 * np.pi / period * np.asarray(theta, dtype=float)[:, None]
+    k = np.arange(1, harmonics + 1)[None, :]
+    return np.hstack([np.ones((w.shape[0], 1)), np.cos(k * w), np.sin(k * w)])
+
+
+class AdaptiveSampler:
+    """
+    picks the angles of an adaptive scan over [lo, hi] [deg]
+    step - float - coarse grid [deg] the scan starts with
+    harmonics - int - order of the Fourier series fitted to the response
+    budget - int - most points the scan may take, coarse grid included
+    tol - float - stop once no gap scores more than tol times the range of the response
+    min_gap - float - gaps [deg] narrower than this are never split
+    period - float - [deg] the response repeats over
+    """
+
+    def __init__(self, lo, hi, step, harmonics=4, budget=100, tol=0.01, min_gap=0.5, period=360.0):
+        self.lo, self.hi = min(lo, hi), max(lo, hi)
+        self.harmonics = harmonics
+        self.budget = budget
+        self.tol = tol
+        self.min_gap = min_gap
+        self.period = period
+        self.coarse = np.arange(self.lo, self.hi + step / 2.0, step)
+        self.angles = []
+        self.values = []
+        self.coefficients = None
+
+    def add(self, angle, value):
+        "records the integrated intensity value measured at angle [deg]"
+        self.angles.append(float(angle))
+        self.values.append(float(value))
+
+    def fit(self):
+        "least squares Fourier coefficients of everything so far (fewer harmonics while points are scarce)"
+        theta = np.asarray(self.angles)
+        harmonics = min(self.harmonics, (len(theta) - 1) // 2)
+        A = fourier_design(theta, harmonics, self.period)
+        self.coefficients = np.linalg.lstsq(A, np.asarray(self.values), rcond=None)[0]
+        return self.coefficients
+
+    def model(self, theta):
+        "fitted response at angles theta [deg]"
+        harmonics = (len(self.coefficients) - 1) // 2
+        return fourier_design(np.atleast_1d(theta), harmonics, self.period) @ self.coefficients
+
+    def scores(self):
+        """
+        (midpoints [deg], score) of every gap between neighbouring measured angles
+        a gap scores the fit residuals at its ends plus how far the fit bends away from a straight
+        line across it, so gaps at lobes/nodes and gaps the series can't explain get split first
+        """
+        order = np.argsort(self.angles)
+        theta = np.asarray(self.angles)[order]
+        value = np.asarray(self.values)[order]
+        self.fit()
+        residual = np.abs(value - self.model(theta))
+        mid = 0.5 * (theta[1:] + theta[:-1])
+        curvature = np.abs(self.model(mid) - 0.5 * (value[1:] + value[:-1]))
+        score = curvature + 0.5 * (residual[1:] + residual[:-1])
+        score[np.diff(theta) < 2.0 * self.min_gap] = 0.0
+        return mid, score
+
+    def propose(self, n=4):
+        "up to n new angles [deg] to measure next, empty once the budget or tolerance is reached"
+        if len(self.angles) < len(self.coarse):
+            return self.coarse[len(self.angles) : self.budget]
+        left = self.budget - len(self.angles)
+        if left <= 0:
+            return np.array([])
+        mid, score = self.scores()
+        threshold = self.tol * max(np.ptp(self.values), 1e-12)
+        best = np.argsort(score)[::-1][: min(n, left)]
+        best = best[score[best] > threshold]
+        return mid[best]
+
+
+def adaptive_scan(
+    motor,
+    spectrum,
+    sampler,
+    writer,
+    wait,
+    background,
+    tol=0.2,
+    frames=1,
+    batch=4,
+    wrap=False,
+    auto_exposure=None,
+    background_inttime=None,
+    roi=None,
+    policy="abort",
+    retries=2,
+):
+    """
+    measures the coarse grid of sampler, then batch more angles at a time where it asks for them
+    motor - utility.AptMotor
+    spectrum - oceanOpticSpectrosco.ocean
+    writer - scan.ScanWriter, points are indexed in the order they were taken, angles are not sorted
+    background - N background counts subtracted before integrating, taken over background_inttime [msec]
+                 (the integration time the scan starts with if not given)
+    auto_exposure - exposure.AutoExposure, the response is integrated in counts/ms so points taken
+                    at different integration times compare
+    roi - roi.Roi, the response is integrated over its windows only rather than the whole spectrum
+    policy, retries - correcting a stage that isn't where it was sent (utility.settle_or_correct), the point
+                      goes in at the angle the stage actually settled at, which the writer gets as actual_angle
+    every batch is visited in the order planner.plan_order finds quickest
+    the writer is always closed, so a failure on either side ends the scan with the data so far written
+    OUTPUT: number of points taken
+    """
+    background = np.asarray(background)
+    if background_inttime is None:
+        background_inttime = spectrum.inttime
+    stats = None
+    n = 0
+    try:
+        while True:
+            targets = sampler.propose(batch)
+            if len(targets) == 0:
+                break
+            here = motor.stage.to_d(motor.connection.status["position"])
+            order, positions = planner.plan_order(
+                targets, here, wrap=wrap, velocity=motor.velocity, acceleration=motor.acceleration
+            )
+            for i, target in zip(order, positions):
+                timing.point(n)
+                print("moving to", targets[i], "deg")
+                # wrapped positions are commanded past period, the settled angle goes in the frame of targets
+                actual = scan.move_and_settle(motor, target, wait, tol, policy, retries) - (target - targets[i])
+                print("collecting")
+                spectrometer_output, info, stats = scan.acquire(spectrum, frames, stats, auto_exposure)
+                rate = exposure.counts_per_ms(
+                    spectrometer_output[1], info["integration_time_ms"], background, background_inttime
+                )
+                sampler.add(actual, np.sum(rate if roi is None else roi.integrate(rate)))
+                writer.submit(n, targets[i], spectrometer_output, timestamp=time.time(), actual_angle=actual, **info)
+                n += 1
+    except BaseException:
+        try:
+            writer.close()
+        except Exception:
+            pass  # the error that stopped the scan is the one worth reporting
+        raise
+    writer.close()
+    return n
@@ -0,0 +1,228 @@
+# Batch analysis of a directory of scans
+# every .tsv (main.py) and .txt/.csv (dual-pol_specscan.py) under a directory is background subtracted, integrated over
+# the regions of interest and fitted against polarizer angle, a file per worker process at a time. All the pixels and
+# ROI signals of a scan are fitted together in one least squares solve (fit.solve).
+#
+#   python analyze.py data/ --roi 395-415 --harmonics 2,4 --workers 4
+#
+# For every scan there is <out>/<name>.fit.tsv (coefficients and rms residual of every pixel, as fit.OnlineFit.save)
+# and <out>/<name>.roi.tsv (background subtracted ROI counts at every angle), and <out>/summary.tsv has one row per
+# scan and ROI. Dual-pol grid scans (every front angle against every back angle) aren't fitted, they are reported as
+# skipped, and the all zero columns of points a dual-pol scan that ended early never took are left out.
+# <out>/analysis.index.json remembers the size and modification time of every scan (and its
+# backgrounds) and the parameters it was analyzed with, so a run only redoes the scans where either changed.
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+
+import numpy as np
+
+import backgrounds
+import exposure
+import fit
+import reader
+import roi
+
+INDEX_VERSION = 3
+EXTENSIONS = (".tsv", ".txt", ".csv")
+# other files the scan scripts leave next to their scans
+SKIP_SUFFIXES = (".fit.tsv", ".timing.csv", ".roi.tsv")
+
+
+def find_scans(directory, out):
+    "every file under directory that may be a scan, sorted, leaving out the output directory"
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != os.path.abspath(out))
+        for name in files:
+            if name.endswith(EXTENSIONS) and not name.endswith(SKIP_SUFFIXES):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+
+def stamp(path):
+    "[size, mtime_ns] of path and of its fname.backgrounds.npz (zeros when there is none)"
+    values = []
+    for p in (path, path + ".backgrounds.npz"):
+        try:
+            st = os.stat(p)
+            values += [st.st_size, st.st_mtime_ns]
+        except OSError:
+            values += [0, 0]
+    return values
+
+
+def output_name(directory, path):
+    "name of the results of path, its place under directory with the separators swapped for __"
+    return os.path.relpath(path, directory).replace(os.sep, "__")
+
+
+def subtracted(scan, path, per_ms=False):
+    """
+    angles x pixels spectra of scan (a reader) less their background
+    the backgrounds main.py refreshed during the scan (fname.backgrounds.npz) are interpolated to each point's
+    timestamp when the file has them, otherwise the one background in the file is used
+    per_ms - bool - rates in counts/ms (exposure.counts_per_ms) from each point's integration_time_ms and the
+             background's own integration time, so auto exposed points compare, when the file has them
+    OUTPUT: (spectra, how the background was taken out, their units)
+    """
+    spectra = np.asarray(scan.memmap(), dtype=float)
+    info = getattr(scan, "info", {})
+    background, method = scan.background, "file"
+    series_path = path + ".backgrounds.npz"
+    if os.path.exists(series_path) and "timestamp" in info:
+        series = backgrounds.BackgroundSeries.load(series_path)
+        if series.counts.shape[1] == spectra.shape[1]:
+            background, method = series.at(info["timestamp"]), "series"
+    if not (per_ms and "integration_time_ms" in info):
+        return spectra - background, method, "counts"
+    background_inttime = getattr(scan, "background_inttime", None)
+    if background_inttime is None:
+        raise ValueError("the file doesn't say what integration time its background was taken at, --per_ms needs it")
+    rate = exposure.counts_per_ms(spectra, info["integration_time_ms"], background, background_inttime)
+    return rate, method, "counts/ms"
+
+
+def analyze(path, directory, out, params):
+    """
+    background subtraction, ROI integration and polar fits of one scan, writes its .fit.tsv and .roi.tsv
+    params - {"roi": [(lo, hi)...] or None for the whole spectrum, "harmonics": [...], "per_ms": bool}
+    OUTPUT: summary rows, one per ROI
+    """
+    t0 = time.perf_counter()
+    name = output_name(directory, path)
+    harmonics = params["harmonics"]
+    with reader.open(path) as scan:
+        if getattr(scan, "grid", False):
+            raise ValueError("grid scan, its spectra depend on both polarizers and can't be fitted against one angle")
+        angles = np.asarray(scan.angles, dtype=float)
+        wavelengths = np.asarray(scan.wavelengths, dtype=float)
+        spectra, method, units = subtracted(scan, path, params["per_ms"])
+        # points never taken, from the file's settled positions or, for files without them, all zero spectra
+        taken = np.asarray(getattr(scan, "taken", np.ones(len(angles), dtype=bool)))
+        taken = taken & np.asarray(scan.memmap()).any(axis=1)
+    if not taken.all():
+        print(f"{name}: leaving out {np.count_nonzero(~taken)} points that were never taken")
+        angles, spectra = angles[taken], spectra[taken]
+    windows = params["roi"] or [(float(wavelengths.min()), float(wavelengths.max()))]
+    region = roi.Roi(wavelengths, windows)
+    signals = region.integrate(spectra)  # angles x windows
+    # every pixel and every ROI signal is one column of the same solve
+    coefficients, rms = fit.solve(angles, np.hstack([spectra, signals]), harmonics)
+    n_pixels = len(wavelengths)
+    names = fit.terms(harmonics)
+
+    table = np.column_stack([wavelengths, coefficients[:, :n_pixels].T, rms[:n_pixels]])
+    header = f"{units}, {path}\nfit of {len(angles)} angles at {time.asctime()}\n" + "\t".join(
+        ["wavelength_nm"] + names + ["rms_residual"]
+    )
+    np.savetxt(os.path.join(out, name + ".fit.tsv"), table, delimiter="\t", header=header)
+    header = f"{units}, background from the {method}, {path}\n" + "\t".join(["angle_deg"] + list(region.columns))
+    np.savetxt(os.path.join(out, name + ".roi.tsv"), np.column_stack([angles, signals]), delimiter="\t", header=header)
+
+    rows = []
+    for k, (lo, hi) in enumerate(windows):
+        row = {"file": name, "roi": f"{lo:g}-{hi:g}", "angles": len(angles), "background": method}
+        row.update(zip(names, coefficients[:, n_pixels + k].tolist()))
+        row["rms_residual"] = float(rms[n_pixels + k])
+        rows.append(row)
+    print(f"{name}: {len(angles)} angles x {n_pixels} pixels in {time.perf_counter() - t0:.2f} s")
+    return rows
+
+
+def _analyze(path, directory, out, params):
+    "analyze() for the pool, a scan that can't be read gives an error instead of stopping the batch"
+    try:
+        return {"rows": analyze(path, directory, out, params)}
+    except Exception as err:
+        return {"error": f"{type(err).__name__}: {err}"}
+
+
+def load_index(out):
+    try:
+        with open(os.path.join(out, "analysis.index.json")) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return index["scans"] if index.get("version") == INDEX_VERSION else {}
+
+
+def save_index(out, scans):
+    path = os.path.join(out, "analysis.index.json")
+    # written next to it and renamed over it, an interrupted run never leaves half an index
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": INDEX_VERSION, "scans": scans}, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def write_summary(path, scans, harmonics):
+    "one tab separated row per scan and ROI of everything in scans"
+    columns = ["file", "roi", "angles", "background"] + fit.terms(harmonics) + ["rms_residual"]
+    with open(path, "w") as f:
+        f.write("\t".join(columns) + "\n")
+        for scan in sorted(scans.values(), key=lambda s: s.get("rows", [{}])[0].get("file", "")):
+            for row in scan.get("rows", []):
+                f.write("\t".join(str(row[c]) for c in columns) + "\n")
+
+
+def run(directory, out=None, windows=None, harmonics=(2, 4), per_ms=False, workers=None, force=False):
+    """
+    analyzes every scan under directory that changed (or whose parameters did) since the last run into out
+    (directory/analysis by default), workers processes at a time (all cores by default, 1 runs here)
+    force - bool - redo every scan
+    OUTPUT: {path: {"stamp", "params", "rows" or "error"}} for every scan
+    """
+    out = os.path.join(directory, "analysis") if out is None else out
+    os.makedirs(out, exist_ok=True)
+    params = {"roi": [list(w) for w in windows] if windows else None, "harmonics": list(harmonics), "per_ms": per_ms}
+    done = load_index(out)
+    scans, todo = {}, []
+    for path in find_scans(directory, out):
+        entry = done.get(path)
+        if not force and entry is not None and entry["stamp"] == stamp(path) and entry["params"] == params:
+            scans[path] = entry
+        else:
+            todo.append(path)
+    print(len(todo), "scans to analyze,", len(scans), "unchanged")
+
+    def finish(path, result):
+        scans[path] = dict(result, stamp=stamp(path), params=params)
+        if "error" in result:
+            print(f"{path}: skipped, {result['error']}")
+
+    if workers == 1 or len(todo) <= 1:
+        for path in todo:
+            finish(path, _analyze(path, directory, out, params))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_analyze, path, directory, out, params): path for path in todo}
+            for future in concurrent.futures.as_completed(futures):
+                finish(futures[future], future.result())
+    save_index(out, scans)
+    write_summary(os.path.join(out, "summary.tsv"), scans, harmonics)
+    return scans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="background subtract, integrate and fit every scan in a directory")
+    parser.add_argument("directory", help="searched (with its subdirectories) for main.py and dual-pol_specscan.py data")
+    parser.add_argument("--out", help="where the results go, directory/analysis by default")
+    parser.add_argument("--roi", help="wavelength windows to integrate, e.g. 395-415,430-440 (the whole spectrum if not given)")
+    parser.add_argument("--harmonics", default="2,4", help="harmonics n of the cos(n theta), sin(n theta) fit terms")
+    parser.add_argument("--per_ms", action="store_true", help="fit counts/ms, for auto exposed scans")
+    parser.add_argument("--workers", type=int, default=None, help="processes to run, all cores by default")
+    parser.add_argument("--force", action="store_true", help="analyze every scan again, changed or not")
+    args = parser.parse_args()
+    scans = run(
+        args.directory,
+        args.out,
+        windows=roi.parse_windows(args.roi) if args.roi else None,
+        harmonics=[int(n) for n in args.harmonics.split(",")],
+        per_ms=args.per_ms,
+        workers=args.workers,
+        force=args.force,
+    )
+    failed = sum("error" in s for s in scans.values())
+    print(len(scans) - failed, "scans analyzed,", failed, "could not be read")
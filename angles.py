@@ -1,6 +1,9 @@
 from functools import partial
 
-# NOTE: MUST use some sort of iteration method if you wish to use conversion functions with numpy arrays
+import numpy as np
+
+# NOTE: every conversion takes a scalar or a numpy array (or list), counts come back rounded to the nearest count,
+# a python int for a scalar and an int64 array for an array, so whole position streams convert in one call
 
 
 # build conversions for encoder cts (what APT/motor knows) to real units
@@ -9,48 +12,84 @@ t = 2048 / (6e6)  # sampling time
 f = 1919.6418578623391  # encoder counts per degree factor [cts/deg], different for every stage
 a = 65536.0  # extra factor to when converting velocity and acceleration
 
+
+def _cts(x):
+    "rounds to the nearest count, python int for scalars and int64 for arrays"
+    x = np.rint(x)
+    if np.ndim(x) == 0:
+        return int(x)
+    return x.astype(np.int64)
+
+
+def _real(x):
+    "python float for scalars, float64 array for arrays"
+    if np.ndim(x) == 0:
+        return float(x)
+    return x
+
+
 # need functs to/from cts to angle [deg], ang velo [deg/s], ang accel [deg/s^2]
 # all factors should just be the numbers and program will handle how the factors are supposed to be
 def from_ang(angle, factor):
-    "funct takes in angle [deg] (float) and converts to angle [cts] (int) that the APT program recognizes"
-    return int(factor * angle)
+    "funct takes in angle [deg] (float or array) and converts to angle [cts] (int or int64 array) that the APT program recognizes"
+    return _cts(factor * np.asarray(angle, dtype=float))
 
 
 def from_angvel(vel, factor, T):
-    "funct takes in anglular velocity [deg/s] (float) and converts to angular velocity [cts/s] (int) that the program recognizes"
-    return int(f * T * a * vel)
+    "funct takes in anglular velocity [deg/s] (float or array) and converts to angular velocity [cts/s] (int or int64 array) that the program recognizes"
+    return _cts(factor * T * a * np.asarray(vel, dtype=float))
 
 
 def from_angacc(acc, factor, T):
-    "funct takes in angular acceleration [deg/s^2] (float) and converts to angular acceleration [cts/s^2] (int) that the program recognizes"
-    return int(f * T * T * a * acc)
+    "funct takes in angular acceleration [deg/s^2] (float or array) and converts to angular acceleration [cts/s^2] (int or int64 array) that the program recognizes"
+    return _cts(factor * T * T * a * np.asarray(acc, dtype=float))
 
 
 def to_ang(cts, factor):
-    "funct takes in angle [cts] (int) from the APT program and converts it to an angle [deg] (float)"
-    return cts / factor
+    "funct takes in angle [cts] (int or array) from the APT program and converts it to an angle [deg] (float or array)"
+    return _real(np.asarray(cts, dtype=float) / factor)
 
 
 def to_angvel(cts, factor, T):
-    "funct takes in angular velocity [cts/s] (int) from the APT program and converts it to an angular velocity [deg/s] (float)"
-    return cts / (factor * T * a)
+    "funct takes in angular velocity [cts/s] (int or array) from the APT program and converts it to an angular velocity [deg/s] (float or array)"
+    return _real(np.asarray(cts, dtype=float) / (factor * T * a))
 
 
 def to_angacc(cts, factor, T):
-    "funct takes in angular acceleration [cts/s^2] (int) from the APT program and converts it to an angular acceleration [deg/s^2] (float)"
-    return cts / (factor * T * T * a)
+    "funct takes in angular acceleration [cts/s^2] (int or array) from the APT program and converts it to an angular acceleration [deg/s^2] (float or array)"
+    return _real(np.asarray(cts, dtype=float) / (factor * T * T * a))
+
+
+class Stage:
+    """
+    the six conversions for one stage, built from its own calibration
+    factor - encoder counts per degree [cts/deg]
+    T - controller sampling time [sec]
+    """
+
+    def __init__(self, factor=f, T=t):
+        self.factor = factor
+        self.T = T
+        self.from_d = partial(from_ang, factor=factor)
+        self.from_dps = partial(from_angvel, factor=factor, T=T)
+        self.from_dpss = partial(from_angacc, factor=factor, T=T)
+        self.to_d = partial(to_ang, factor=factor)
+        self.to_dps = partial(to_angvel, factor=factor, T=T)
+        self.to_dpss = partial(to_angacc, factor=factor, T=T)
+
 
+PRM1Z8 = Stage(f, t)
 
 # now have partial functs to finish conversion
-from_d = partial(from_ang, factor=f)
+from_d = PRM1Z8.from_d
 from_d.__doc__ = "partial funct takes in angle [deg] and converts to angle [cts]"
-from_dps = partial(from_angvel, factor=f, T=t)
+from_dps = PRM1Z8.from_dps
 from_dps.__doc__ = "partial funct takes in angle velocity [deg/s] and converts to angle velocity [cts/s]"
-from_dpss = partial(from_angacc, factor=f, T=t)
+from_dpss = PRM1Z8.from_dpss
 from_dpss.__doc__ = "partial funct takes in angle acceleration [deg/s^2] and converts to angle acceleration [cts/s^2]"
-to_d = partial(to_ang, factor=f)
+to_d = PRM1Z8.to_d
 to_d.__doc__ = "partial funct takes in angle [cts] and converts to angle [deg]"
-to_dps = partial(to_angvel, factor=f, T=t)
+to_dps = PRM1Z8.to_dps
 to_dps.__doc__ = "partial funct takes in angle velocity [cts/s] and converts to angle velocity [deg/s]"
-to_dpss = partial(to_angacc, factor=f, T=t)
+to_dpss = PRM1Z8.to_dpss
 to_dpss.__doc__ = "partial funct takes in angle acceleration [cts/s^2] and converts to angle acceleration [deg/s^2]"
@@ -0,0 +1,62 @@
+# Multi-frame averaging
+# keeps a running per-pixel mean and variance (Welford's algorithm) in buffers allocated once,
+# so averaging N frames never holds more than one extra spectrum in memory and
+# the standard error of every pixel comes out alongside the mean
+import numpy as np
+
+
+class RunningStats:
+    "running per-pixel mean and variance of spectra added one at a time"
+
+    def __init__(self, n_pixels):
+        self.n = 0
+        self.mean = np.zeros(n_pixels)
+        self._m2 = np.zeros(n_pixels)  # sum of squared deviations from the mean
+        self._delta = np.empty(n_pixels)  # scratch, so add() allocates nothing
+
+    def reset(self):
+        self.n = 0
+        self.mean.fill(0.0)
+        self._m2.fill(0.0)
+
+    def add(self, x):
+        "adds one frame (N intensities) in place"
+        self.n += 1
+        np.subtract(x, self.mean, out=self._delta)
+        self.mean += self._delta / self.n
+        # m2 += (x - old mean) * (x - new mean)
+        self._m2 += self._delta * (x - self.mean)
+
+    def variance(self):
+        "per-pixel sample variance, zeros until there are two frames"
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        return self._m2 / (self.n - 1)
+
+    def stderr(self):
+        "per-pixel standard error of the mean"
+        if self.n < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self.variance() / self.n)
+
+
+def acquire(spectrum, frames, stats=None):
+    """
+    grabs frames spectra back to back and averages them
+    spectrum - oceanOpticSpectrosco.ocean (anything with getspec)
+    stats - RunningStats to reuse between points, made (and sized from the first frame) if not given
+    OUTPUT: (2xN array of wavelengths and mean intensities, N standard errors, stats)
+            the returned arrays are copies, safe to hand to the writer while stats is reused
+    """
+    first = spectrum.getspec()
+    wavelengths = first[0]
+    if stats is None:
+        stats = RunningStats(len(wavelengths))
+    stats.reset()
+    stats.add(first[1])
+    for _ in range(frames - 1):
+        frame = spectrum.getspec()
+        if not np.array_equal(frame[0], wavelengths):
+            raise Exception("spectrograph changed its spectral range while averaging, ending collection")
+        stats.add(frame[1])
+    return np.array([wavelengths, stats.mean]), stats.stderr(), stats
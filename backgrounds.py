@@ -0,0 +1,224 @@
+# Background library and backgrounds refreshed during a scan
+# BackgroundLibrary - averaged backgrounds kept on disk, one .npz per spectrometer serial, integration time,
+#                     ROI and temperature (when the spectrometer reports one), so a run with the same settings
+#                     soon after the last one can use its background again instead of asking for a new one.
+#                     Entries older than max_age are dropped and the least recently used go once there are too many.
+# BackgroundSeries - the backgrounds taken through one long scan, the background at any moment is interpolated
+#                    between the ones taken before and after it, for a whole block of spectra at once.
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import averaging
+
+DEFAULT_LIBRARY = os.path.join(os.path.expanduser("~"), ".cache", "pol_dep_scan", "backgrounds")
+
+
+def temperature(spectrum):
+    "the spectrometer's temperature [C] if it can tell, else None"
+    read = getattr(spectrum, "temperature", None)
+    try:
+        return None if read is None else read()
+    except Exception:
+        return None
+
+
+def key(serial, inttime, roi=None, temperature=None):
+    "the settings a background depends on, the temperature is only kept to the nearest degree"
+    return {
+        "serial": str(serial),
+        "integration_time_ms": float(inttime),
+        "roi": roi or "",
+        "temperature_c": None if temperature is None else int(round(float(temperature))),
+    }
+
+
+def take(spectrum, frames=1, inttime=None):
+    """
+    takes a background, averaging frames spectra (averaging.acquire), at inttime [msec] if given
+    (the integration time the spectrometer was at is put back afterwards)
+    OUTPUT: (2xN background, per-pixel standard error or None for one frame)
+    """
+    previous = spectrum.inttime
+    if inttime is not None and inttime != previous:
+        spectrum.setinttime(inttime)
+    try:
+        if frames > 1:
+            background, stderr, _ = averaging.acquire(spectrum, frames)
+            return background, stderr
+        return np.asarray(spectrum.getspec(), dtype=float), None
+    finally:
+        if inttime is not None and inttime != previous:
+            spectrum.setinttime(previous)
+
+
+class BackgroundLibrary:
+    """
+    directory - where the backgrounds are kept, made if needed
+    max_age - float - [sec] a background older than this is never used
+    max_entries - int - the least recently used backgrounds beyond this many are removed
+    """
+
+    def __init__(self, directory=DEFAULT_LIBRARY, max_age=3600.0, max_entries=32):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_entries = max_entries
+
+    def _path(self, key):
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, digest + ".npz")
+
+    def get(self, key, now=None):
+        "{wavelengths, counts, stderr (or None), frames, taken} of a fresh enough background for key, else None"
+        now = time.time() if now is None else now
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = dict(data)
+        except (OSError, ValueError):
+            return None
+        if json.loads(str(entry["key"])) != key:
+            return None
+        if now - float(entry["taken"]) > self.max_age:
+            self._remove(path)
+            return None
+        os.utime(path)  # the modification time is when it was last used, for the eviction
+        return {
+            "wavelengths": entry["wavelengths"],
+            "counts": entry["counts"],
+            "stderr": entry["stderr"] if entry["stderr"].size else None,
+            "frames": int(entry["frames"]),
+            "taken": float(entry["taken"]),
+        }
+
+    def find(self, key, ignore=("temperature_c",), now=None):
+        """
+        taken time [s, time.time()] of the newest background still fresh enough whose key matches key
+        leaving out the fields in ignore (e.g. the temperature, when the spectrometer can't be asked just now),
+        None if there isn't one, the library is left as it was
+        """
+        now = time.time() if now is None else now
+        want = {k: v for k, v in key.items() if k not in ignore}
+        newest = None
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return None
+        for name in names:
+            if not name.endswith(".npz"):
+                continue
+            try:
+                with np.load(os.path.join(self.directory, name)) as data:
+                    entry_key, taken = json.loads(str(data["key"])), float(data["taken"])
+            except (OSError, ValueError, KeyError):
+                continue
+            if now - taken > self.max_age or {k: v for k, v in entry_key.items() if k not in ignore} != want:
+                continue
+            newest = taken if newest is None else max(newest, taken)
+        return newest
+
+    def put(self, key, wavelengths, counts, stderr=None, frames=1, taken=None):
+        "keeps a background for key (replacing the one there was), then evicts what is stale or least used"
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        # written next to it and renamed over it, a reader never sees half a file
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                key=json.dumps(key, sort_keys=True),
+                wavelengths=np.asarray(wavelengths, dtype=float),
+                counts=np.asarray(counts, dtype=float),
+                stderr=np.asarray([] if stderr is None else stderr, dtype=float),
+                frames=frames,
+                taken=time.time() if taken is None else taken,
+            )
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def evict(self, now=None):
+        "removes backgrounds older than max_age and the least recently used beyond max_entries"
+        now = time.time() if now is None else now
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                used = os.path.getmtime(path)
+            except OSError:
+                continue
+            entries.append((used, path))
+        entries.sort(reverse=True)
+        for n, (used, path) in enumerate(entries):
+            # last used longer ago than max_age means taken even longer ago, so it is stale too
+            if n >= self.max_entries or now - used > self.max_age:
+                self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class BackgroundSeries:
+    """
+    backgrounds taken at times [s, time.time()] during a scan
+    interval - float - [sec] between refreshes, due() turns True once the last one is that old
+    before the first background the first is used, after the last the last
+    """
+
+    def __init__(self, t, counts, interval=None):
+        self.interval = interval
+        # replaced together as one tuple, so the writer thread always sees a matching pair
+        self._data = (np.array([float(t)]), np.asarray(counts, dtype=float)[None, :])
+
+    @property
+    def times(self):
+        return self._data[0]
+
+    @property
+    def counts(self):
+        return self._data[1]
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, t, counts):
+        times, stack = self._data
+        self._data = (np.append(times, float(t)), np.vstack([stack, np.asarray(counts, dtype=float)[None, :]]))
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        return self.interval is not None and now - self.times[-1] >= self.interval
+
+    def at(self, t):
+        "background counts at time t (N), or at every time of an array of M times (M x N)"
+        times, stack = self._data
+        ts = np.atleast_1d(np.asarray(t, dtype=float))
+        if len(times) == 1:
+            out = np.broadcast_to(stack[0], (len(ts), stack.shape[1]))
+        else:
+            j = np.clip(np.searchsorted(times, ts, side="right"), 1, len(times) - 1)
+            t0, t1 = times[j - 1], times[j]
+            w = np.clip((ts - t0) / np.maximum(t1 - t0, 1e-9), 0.0, 1.0)[:, None]
+            out = (1.0 - w) * stack[j - 1] + w * stack[j]
+        return out[0] if np.ndim(t) == 0 else out
+
+    def subtract(self, spectra, t):
+        "spectra (N, or M x N) less the background at their time(s) t"
+        return np.asarray(spectra, dtype=float) - self.at(t)
+
+    def save(self, path):
+        times, stack = self._data
+        np.savez(path, times=times, counts=stack)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            series = cls(data["times"][0], data["counts"][0])
+            series._data = (data["times"], data["counts"])
+        return series
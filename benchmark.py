@@ -0,0 +1,242 @@
+# Scan throughput benchmark on the simulated hardware (simulate.py)
+# runs representative scans through the same scan engine main.py uses and reports
+# points/minute, where the time per point goes and how much memory the scan needed
+#
+# python benchmark.py                 all scenarios
+# python benchmark.py quick coarse    just those
+# python benchmark.py --json out.json also save the numbers
+# python benchmark.py --imports       check the scripts still start fast, exits 1 if one is over its budget
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+try:
+    import resource  # unix only, just for the max resident memory line
+except ImportError:
+    resource = None
+
+import drivers
+import scan
+import scanfile
+import simulate
+import utility
+
+# name: (initial [deg], final [deg], step [deg], integration time [ms], output format)
+SCENARIOS = {
+    "quick": (0.0, 90.0, 10.0, 10.0, "tsv"),
+    "coarse": (0.0, 360.0, 10.0, 100.0, "tsv"),
+    "fine-tsv": (0.0, 360.0, 2.0, 20.0, "tsv"),
+    "fine-scan": (0.0, 360.0, 2.0, 20.0, "scan"),
+}
+
+# module: longest import [s] allowed, in a fresh interpreter (numpy alone is ~0.1 s)
+IMPORT_BUDGETS = {
+    "main": 0.5,
+    "daemon": 0.5,
+    "client": 0.5,
+    "reader": 0.3,
+    "scanfile": 0.3,
+    "live": 0.3,
+    "fit": 0.3,
+    "analyze": 0.5,
+}
+# vendor stacks that only a scan on that hardware should import (drivers.py)
+VENDOR_MODULES = ("thorlabs_apt_device", "pylablib", "seabreeze", "serial")
+
+_IMPORT_PROBE = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t0)
+print(" ".join(m for m in {vendor!r} if m in sys.modules))
+"""
+
+
+def check_imports(budgets=IMPORT_BUDGETS, repeats=3):
+    "{module: (best import time [s], budget [s], vendor modules it pulled in)} each timed in fresh interpreters"
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module, budget in budgets.items():
+        best, vendor = float("inf"), []
+        for _ in range(repeats):
+            probe = _IMPORT_PROBE.format(module=module, vendor=VENDOR_MODULES)
+            out = subprocess.run(
+                [sys.executable, "-c", probe], cwd=here, capture_output=True, text=True, check=True
+            ).stdout.splitlines()
+            best = min(best, float(out[0]))
+            vendor = out[1].split() if len(out) > 1 else []
+        results[module] = (best, budget, vendor)
+    return results
+
+
+def print_imports(results):
+    "prints the import check, returns True if every module is within budget and imports no vendor stack"
+    ok = True
+    print(f"  {'module':<12}{'import [ms]':>14}{'budget [ms]':>14}")
+    for module, (best, budget, vendor) in results.items():
+        good = best <= budget and not vendor
+        ok &= good
+        note = "" if good else "  <- " + ("imports " + ", ".join(vendor) if vendor else "over budget")
+        print(f"  {module:<12}{best * 1e3:>14.0f}{budget * 1e3:>14.0f}{note}")
+    return ok
+
+
+class PhaseTimes:
+    "collects durations [s] per phase, safe to add to from the writer thread"
+
+    def __init__(self):
+        self.times = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase, duration):
+        with self._lock:
+            self.times.setdefault(phase, []).append(duration)
+
+    def wrap(self, obj, method, phase):
+        "replaces obj.method with a version that times itself into phase"
+        original = getattr(obj, method)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - t0)
+
+        setattr(obj, method, timed)
+
+    def summary(self):
+        return {
+            phase: {
+                "count": len(t),
+                "total_s": float(np.sum(t)),
+                "mean_ms": float(np.mean(t) * 1e3),
+                "max_ms": float(np.max(t) * 1e3),
+            }
+            for phase, t in self.times.items()
+        }
+
+
+def connect():
+    "connects the simulated motor and spectrometer, returns (motor, spectrum, seconds it took)"
+    t0 = time.perf_counter()
+    motor = utility.AptMotor(port="simulated", connection_class=drivers.load("motor", "simulated"))
+    spectrum = simulate.SimOcean(
+        angle_source=lambda: motor.stage.to_d(motor.connection.status["position"]), seed=0
+    )
+    return motor, spectrum, time.perf_counter() - t0
+
+
+def run(name, motor, spectrum, directory):
+    "runs one scenario and returns its report dict"
+    initial, final, step, inttime, fmt = SCENARIOS[name]
+    pol_pos_d = np.arange(initial, final + step, step)
+    spectrum.setinttime(inttime)
+    # start every scenario from the same place
+    motor.connection.move_absolute(motor.stage.from_d(initial))
+    motor.wait_until_settled(initial, timeout=60.0)
+    background = spectrum.getspec()
+
+    path = os.path.join(directory, name + "." + fmt)
+    if fmt == "tsv":
+        f = open(path, "x")
+        sink = scan.TsvSink(f)
+    else:
+        sink = scan.ScanFileSink(
+            scanfile.ScanFile.create(path, background[0], background=background[1], angles=pol_pos_d)
+        )
+    sink.open(pol_pos_d, background[0], background[1])
+
+    phases = PhaseTimes()
+    phases.wrap(motor.connection, "move_absolute", "move")
+    phases.wrap(motor, "wait_until_settled", "settle")
+    phases.wrap(spectrum, "getspec", "acquire")
+    phases.wrap(sink, "write_point", "write (writer thread)")
+    writer = scan.ScanWriter([sink], background[0])
+    phases.wrap(writer, "submit", "submit")
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        scan.run_scan(motor, spectrum, pol_pos_d, writer, wait=60.0)
+    finally:
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # undo the wrapping so the next scenario starts clean
+        for obj, method in ((motor.connection, "move_absolute"), (motor, "wait_until_settled"), (spectrum, "getspec")):
+            delattr(obj, method)
+        if fmt == "tsv":
+            f.close()
+
+    summary = phases.summary()
+    accounted = sum(v["total_s"] for k, v in summary.items() if "writer" not in k)
+    summary["other (loop overhead)"] = {
+        "count": len(pol_pos_d),
+        "total_s": elapsed - accounted,
+        "mean_ms": (elapsed - accounted) / len(pol_pos_d) * 1e3,
+        "max_ms": float("nan"),
+    }
+    return {
+        "scenario": name,
+        "points": len(pol_pos_d),
+        "integration_time_ms": inttime,
+        "format": fmt,
+        "elapsed_s": elapsed,
+        "points_per_minute": len(pol_pos_d) / elapsed * 60.0,
+        "peak_python_memory_mb": peak / 2**20,
+        "file_size_mb": os.path.getsize(path) / 2**20,
+        "phases": summary,
+    }
+
+
+def print_report(report):
+    print(
+        f"\n{report['scenario']}: {report['points']} points, {report['integration_time_ms']} ms, {report['format']}"
+    )
+    print(
+        f"  {report['points_per_minute']:.1f} points/min ({report['elapsed_s']:.1f} s), "
+        f"peak python memory {report['peak_python_memory_mb']:.1f} MB, file {report['file_size_mb']:.2f} MB"
+    )
+    print(f"  {'phase':<24}{'mean [ms]':>12}{'max [ms]':>12}{'total [s]':>12}")
+    for phase, v in report["phases"].items():
+        print(f"  {phase:<24}{v['mean_ms']:>12.2f}{v['max_ms']:>12.2f}{v['total_s']:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="scan throughput benchmark on simulated hardware")
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)}, all of them by default")
+    parser.add_argument("--json", help="also write the reports to this file")
+    parser.add_argument("--imports", action="store_true", help="only check the import time of the scripts")
+    args = parser.parse_args()
+    if args.imports:
+        sys.exit(0 if print_imports(check_imports()) else 1)
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    motor, spectrum, connect_s = connect()
+    print(f"connect + home: {connect_s:.1f} s")
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.scenarios:
+            reports.append(run(name, motor, spectrum, directory))
+            print_report(reports[-1])
+    max_rss = None
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"\nmax resident memory {max_rss:.0f} MB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"connect_s": connect_s, "max_rss_mb": max_rss, "scenarios": reports}, f, indent=2)
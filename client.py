@@ -0,0 +1,63 @@
+# Thin client for daemon.py
+# python client.py submit --config-file config.txt --fname run2.tsv   queue a scan (same options as main.py)
+# python client.py status                                           jobs and devices
+# python client.py wait 3                                           block until job 3 is finished
+# python client.py cancel 3                                         drop a job that hasn't started
+# python client.py shutdown                                         stop the daemon after the running job
+import argparse
+import json
+import sys
+import time
+
+import daemon
+
+
+def expand_config(argv):
+    "replaces --config-file FILE with the options in FILE, options given after it still win like they do in main.py"
+    out = []
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--config-file":
+            with open(argv[i + 1]) as f:
+                out = f.read().split() + out
+            i += 2
+        else:
+            out.append(argv[i])
+            i += 1
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="send scan jobs to daemon.py")
+    parser.add_argument("--address", default=daemon.DEFAULT_ADDRESS, help="where the daemon listens")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("submit", help="queue a scan, any main.py options")
+    sub.add_parser("status", help="list jobs and devices")
+    for name in ("wait", "cancel"):
+        sub.add_parser(name).add_argument("id", type=int)
+    sub.add_parser("shutdown", help="stop the daemon once the running job is done")
+    # everything submit doesn't know is a main.py option for the job
+    args, options = parser.parse_known_args(argv)
+    if options and args.cmd != "submit":
+        parser.error("unrecognized arguments: " + " ".join(options))
+
+    if args.cmd == "submit":
+        reply = daemon.request({"cmd": "submit", "argv": expand_config(options)}, args.address)
+    elif args.cmd == "cancel":
+        reply = daemon.request({"cmd": "cancel", "id": args.id}, args.address)
+    elif args.cmd == "wait":
+        while True:
+            reply = daemon.request({"cmd": "status"}, args.address)
+            job = next((j for j in reply["jobs"] if j["id"] == args.id), None)
+            if job is None or job["state"] not in ("queued", "running"):
+                reply = {"ok": job is not None and job["state"] == "done", "job": job}
+                break
+            time.sleep(1.0)
+    else:
+        reply = daemon.request({"cmd": args.cmd}, args.address)
+    print(json.dumps(reply, indent=2))
+    return 0 if reply.get("ok") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+# Device daemon
+# keeps the motor (homed), the spectrometer and optionally the back (Kinesis) motor connected between scans
+# and runs scan jobs from a FIFO queue back to back, so connecting and homing is paid once a day instead of
+# once a scan. Jobs take the same options as main.py / config.txt and are sent with client.py.
+# Nobody is there to block the beam for a job, so a job never takes a background itself: it needs
+# --reuse_background and a background for its settings already in the library (take one with main.py).
+#
+# python daemon.py --motor_serial 83000000 --spectrometer_serial HR4000 [--kinesis_serial 27263055] [--simulate]
+#
+# protocol: one JSON request per connection, one JSON reply, on a local TCP or Unix socket (see live.parse_address)
+#   {"cmd": "submit", "argv": [...main.py options...]} -> {"ok": true, "job": {...}}
+#   {"cmd": "status"}                                 -> {"ok": true, "jobs": [...], "devices": {...}}
+#   {"cmd": "cancel", "id": n}                        -> {"ok": true, "job": {...}} (only jobs still queued)
+#   {"cmd": "shutdown"}                               -> {"ok": true}, stops after the running job
+import argparse
+import contextlib
+import io
+import json
+import os
+import queue
+import socket
+import threading
+import time
+
+import backgrounds
+import drivers
+import live
+import main
+import utility
+
+DEFAULT_ADDRESS = "tcp://127.0.0.1:5560"
+
+
+class Job:
+    "one queued scan, argv are main.py options"
+
+    def __init__(self, id, argv, args):
+        self.id = id
+        self.argv = list(argv)
+        self.args = args
+        self.state = "queued"  # queued, running, done, failed, cancelled
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "output": self.args.path + self.args.fname,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class Daemon:
+    """
+    connects the devices once and runs jobs on a worker thread
+    settings - namespace with motor_serial, spectrometer_serial, kinesis_serial (or None), simulate,
+    motor_driver and spectrometer_driver
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.motor = main.connect_motor(settings)
+        self.spectrum = main.connect_spectrometer(settings, self.motor)
+        self.back = None
+        if settings.kinesis_serial:
+            # held open (and homed) for the scans that need it
+            self.back = utility.KinesisMotor(
+                settings.kinesis_serial,
+                connection_class=drivers.load("kinesis", "simulated" if settings.simulate else "kdc101"),
+            )
+        self.jobs = {}
+        self._ids = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._work, name="daemon-jobs", daemon=True)
+        self._worker.start()
+
+    def submit(self, argv):
+        "parses argv like main.py would and queues the job, raises ValueError if the options are no good"
+        errors = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(errors):
+                args = main.parser.parse_args(argv)
+        except SystemExit:
+            raise ValueError(errors.getvalue().strip() or "invalid scan options")
+        # jobs run on the devices this daemon holds
+        for key in ("motor_serial", "spectrometer_serial", "motor_driver", "spectrometer_driver"):
+            mine = getattr(self.settings, key)
+            if getattr(args, key) not in (None, main.parser.get_default(key), mine):
+                raise ValueError(f"{key} {getattr(args, key)} is not the one this daemon is connected to ({mine})")
+            setattr(args, key, mine)
+        args.simulate = self.settings.simulate
+        reason = main.conflicts(args, interactive=False)
+        if reason is not None:
+            raise ValueError(reason)
+        # nobody blocks the beam for a queued job, so its background has to be in the library already,
+        # the temperature is checked when the job runs since the spectrometer may be busy with another one now
+        library = backgrounds.BackgroundLibrary(args.background_library, max_age=args.background_max_age)
+        if library.find(main.background_key(args, None)) is None:
+            raise ValueError(
+                "there is no background for this spectrometer, integration time and ROI in "
+                f"{args.background_library}, take one with main.py --reuse_background first"
+            )
+        with self._lock:
+            self._ids += 1
+            job = Job(self._ids, argv, args)
+            self.jobs[job.id] = job
+        self._queue.put(job)
+        return job
+
+    def cancel(self, id):
+        with self._lock:
+            if id not in self.jobs:
+                raise ValueError(f"there is no job {id}")
+            job = self.jobs[id]
+            if job.state != "queued":
+                raise ValueError(f"job {id} is {job.state}, only queued jobs can be cancelled")
+            job.state = "cancelled"
+        return job
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.state == "cancelled":
+                    continue
+                job.state = "running"
+                job.started = time.time()
+            print(f"job {job.id}: {job.args.path + job.args.fname}")
+            try:
+                main.run(job.args, self.motor, self.spectrum, interactive=False)
+                job.state = "done"
+            except BaseException as err:  # parser.error() raises SystemExit, a job must never end the daemon
+                job.state = "failed"
+                job.error = f"{type(err).__name__}: {err}"
+                print(f"job {job.id} failed: {job.error}")
+            job.finished = time.time()
+
+    def status(self):
+        with self._lock:
+            jobs = [job.summary() for job in self.jobs.values()]
+        return {
+            "jobs": jobs,
+            "devices": {
+                "motor_serial": self.settings.motor_serial,
+                "motor_position": self.motor.position(),
+                "spectrometer_serial": self.settings.spectrometer_serial,
+                "integration_time_ms": self.spectrum.inttime,
+                "kinesis_serial": self.settings.kinesis_serial,
+            },
+        }
+
+    def handle(self, request):
+        "reply dict to one request dict"
+        cmd = request.get("cmd")
+        try:
+            if cmd == "submit":
+                return {"ok": True, "job": self.submit(request["argv"]).summary()}
+            if cmd == "status":
+                return dict(ok=True, **self.status())
+            if cmd == "cancel":
+                return {"ok": True, "job": self.cancel(int(request["id"])).summary()}
+            if cmd == "shutdown":
+                self._stop.set()
+                self._queue.put(None)
+                return {"ok": True}
+        except (ValueError, KeyError) as err:
+            return {"ok": False, "error": str(err)}
+        return {"ok": False, "error": f"unknown command {cmd}"}
+
+    def serve(self, address=DEFAULT_ADDRESS):
+        "answers requests on address until shut down, then waits for the running job and closes the devices"
+        family, where = live.parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(where):
+            os.remove(where)
+        server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(where)
+        server.listen()
+        server.settimeout(0.5)  # so a shutdown is noticed
+        print("daemon listening on", address)
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                with conn:
+                    conn.settimeout(10.0)
+                    try:
+                        request = json.loads(_read_line(conn))
+                        reply = self.handle(request)
+                    except (ValueError, OSError) as err:
+                        reply = {"ok": False, "error": f"bad request: {err}"}
+                    try:
+                        conn.sendall(json.dumps(reply).encode() + b"\n")
+                    except OSError:
+                        pass
+        finally:
+            server.close()
+            if family == socket.AF_UNIX and os.path.exists(where):
+                os.remove(where)
+            self._worker.join()
+            self.close()
+
+    def close(self):
+        self.motor.close()
+        self.spectrum.close()
+        if self.back is not None:
+            self.back.close()
+
+
+def _read_line(conn):
+    buf = bytearray()
+    while not buf.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        buf += chunk
+    return buf.decode()
+
+
+def request(message, address=DEFAULT_ADDRESS, timeout=10.0):
+    "sends one request to the daemon at address and returns its reply"
+    family, where = live.parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(where)
+        conn.sendall(json.dumps(message).encode() + b"\n")
+        return json.loads(_read_line(conn))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="keep the scan hardware connected and run queued scan jobs")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="tcp://host:port or Unix socket path to listen on")
+    parser.add_argument("--motor_serial", type=str, required=True, help="TDC001 serial number")
+    parser.add_argument("--spectrometer_serial", type=str, required=True, help="spectrograph serial number")
+    parser.add_argument("--kinesis_serial", type=str, default=None, help="KDC101 serial number, to keep it connected too")
+    parser.add_argument("--simulate", action="store_true", help="run against the simulated hardware (simulate.py)")
+    parser.add_argument("--motor_driver", default="tdc001", choices=drivers.names("motor"), help="see drivers.py")
+    parser.add_argument(
+        "--spectrometer_driver", default="ocean", choices=drivers.names("spectrometer"), help="see drivers.py"
+    )
+    settings = parser.parse_args()
+    Daemon(settings).serve(settings.address)
@@ -0,0 +1,58 @@
+# Device driver registry
+# motor controller and spectrometer backends are registered by name as "module:attribute" strings and only
+# imported when something asks for them, so starting main.py (or --help, or the readers) doesn't pay for
+# thorlabs_apt_device, pylablib and seabreeze unless the scan actually uses that hardware.
+#
+#   drivers.load("spectrometer", "ocean")   -> oceanOpticSpectrosco.ocean, importing it now
+#   drivers.names("motor")                  -> ["simulated", "tdc001"], imports nothing
+#   drivers.register("spectrometer", "mine", "my_module:MySpectrometer")
+import importlib
+
+# kind: {name: "module:attribute"}
+# motor - connection classes for utility.AptMotor
+# kinesis - connection classes for utility.KinesisMotor
+# spectrometer - classes with setinttime(msec) and getspec() (see simulate.SimOcean)
+_REGISTRY = {
+    "motor": {
+        "tdc001": "tdc001:TDC001",
+        "simulated": "simulate:SimTDC001",
+    },
+    "kinesis": {
+        "kdc101": "pylablib.devices.Thorlabs:KinesisMotor",
+        "simulated": "simulate:SimKinesisMotor",
+    },
+    "spectrometer": {
+        "ocean": "oceanOpticSpectrosco:ocean",
+        "simulated": "simulate:SimOcean",
+    },
+}
+_loaded = {}
+
+
+def register(kind, name, target):
+    "adds (or replaces) backend name of kind, target is 'module:attribute' and isn't imported until load()"
+    _REGISTRY.setdefault(kind, {})[name] = target
+    _loaded.pop((kind, name), None)
+
+
+def names(kind):
+    "registered backend names of kind"
+    return sorted(_REGISTRY[kind])
+
+
+def load(kind, name):
+    "imports and returns backend name of kind, raises ValueError for unknown names and ImportError if its package is missing"
+    if (kind, name) in _loaded:
+        return _loaded[kind, name]
+    try:
+        target = _REGISTRY[kind][name]
+    except KeyError:
+        known = ", ".join(_REGISTRY.get(kind, {}))
+        raise ValueError(f"no {kind} driver called {name}, the registered ones are: {known}")
+    module, attribute = target.split(":")
+    try:
+        backend = getattr(importlib.import_module(module), attribute)
+    except ImportError as err:
+        raise ImportError(f"the {name} {kind} driver needs {err.name or module}, which isn't installed") from err
+    _loaded[kind, name] = backend
+    return backend
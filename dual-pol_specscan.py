@@ -5,67 +5,22 @@
 # By Adam Fisher
 # further documentation is in README
 
+import os
 import time
-from functools import partial
 
 # double check you have these packages
 import numpy as np
 import thorlabs_apt_device as apt
 
+import angles
+import journal
+import motion
 import oceanOpticSpectrosco as spectro
+import planner
+import scanfile
+import utility
 
-# apt conversion for TDC001 + PRM1Z8
-# build conversions for encoder cts (what APT/motor knows) to real units
-# TDC001 + PRM1-Z8 factor (f) and time step (t)
-t = 2048 / (6e6)  # sampling time
-f = 1919.6418578623391  # encoder counts per degree factor [cts/deg], different for every stage
-a = 65536.0  # extra factor to when converting velocity and acceleration
-
-# need functs to/from cts to angle [deg], ang velo [deg/s], ang accel [deg/s^2]
-# all factors should just be the numbers and program will handle how the factors are supposed to be
-def from_ang(angle, factor):
-    "funct takes in angle [deg] (float) and converts to angle [cts] (int) that the APT program recognizes"
-    return int(factor * angle)
-
-
-def from_angvel(vel, factor, T):
-    "funct takes in anglular velocity [deg/s] (float) and converts to angular velocity [cts/s] (int) that the program recognizes"
-    return int(f * T * a * vel)
-
-
-def from_angacc(acc, factor, T):
-    "funct takes in angular acceleration [deg/s^2] (float) and converts to angular acceleration [cts/s^2] (int) that the program recognizes"
-    return int(f * T * T * a * acc)
-
-
-def to_ang(cts, factor):
-    "funct takes in angle [cts] (int) from the APT program and converts it to an angle [deg] (float)"
-    return cts / factor
-
-
-def to_angvel(cts, factor, T):
-    "funct takes in angular velocity [cts/s] (int) from the APT program and converts it to an angular velocity [deg/s] (float)"
-    return cts / (factor * T * a)
-
-
-def to_angacc(cts, factor, T):
-    "funct takes in angular acceleration [cts/s^2] (int) from the APT program and converts it to an angular acceleration [deg/s^2] (float)"
-    return cts / (factor * T * T * a)
-
-
-# now have partial functs to finish conversion
-from_d = partial(from_ang, factor=f)
-from_d.__doc__ = "partial funct takes in angle [deg] and converts to angle [cts]"
-from_dps = partial(from_angvel, factor=f, T=t)
-from_dps.__doc__ = "partial funct takes in angle velocity [deg/s] and converts to angle velocity [cts/s]"
-from_dpss = partial(from_angacc, factor=f, T=t)
-from_dpss.__doc__ = "partial funct takes in angle acceleration [deg/s^2] and converts to angle acceleration [cts/s^2]"
-to_d = partial(to_ang, factor=f)
-to_d.__doc__ = "partial funct takes in angle [cts] and converts to angle [deg]"
-to_dps = partial(to_angvel, factor=f, T=t)
-to_dps.__doc__ = "partial funct takes in angle velocity [cts/s] and converts to angle velocity [deg/s]"
-to_dpss = partial(to_angacc, factor=f, T=t)
-to_dpss.__doc__ = "partial funct takes in angle acceleration [cts/s^2] and converts to angle acceleration [deg/s^2]"
+front_stage = angles.PRM1Z8  # calibration of the stage on the TDC001 (angles.Stage)
 
 # apt helper functions
 def is_mtr_connected(motor):
@@ -81,7 +36,7 @@ def error_callback(source, code, note):
 # printing device list and input's dict keys
 print("here is some device info for you")
 print(apt.devices.aptdevice.list_devices())
-print(tl.list_kinesis_devices())
+print(utility.tl.list_kinesis_devices())
 
 # NOTE: going to decide front/back by com port
 # NOTE: need to know which motor is which for connection purposes
@@ -97,11 +52,18 @@ inputs = {
     "final_position": "input",  #  front waveplates final position [deg] (float)
     "offset": "input",  # orientation of back pol w.r.t front pol [deg] (float)
     "step": "input",  # angular distance traveled between each spectrograph measurement [deg] (float)
-    "wait": "input",  # wait time [sec] before pol moves again (float or int)
+    "wait": "input",  # longest time [sec] to wait for the pols to settle after each move (float or int)
     "specSN": "input",  # spectrograph serial # (str)
     "spec_int_time": "input",  # spectrograph integration time [msec] (int?)
     "fname": "input",  # file name that data will saved under (str), MUST BE A .txt file
     "path": "input",  # relative path to directory you would like the file saved to (str)
+    "wrap": False,  # True if the mounts can turn past 360, so the scan planner may go either way round (bool)
+    "format": "csv",  # "csv" saved once at the end, or "scan" for a binary scan file written as data comes in (see scanfile.py)
+    "grid": False,  # True to scan every front position against every back position instead of a fixed offset (bool)
+    "back_intial_pos": None,  # back waveplates inital position [deg] (float), only used with grid
+    "back_final_position": None,  # back waveplates final position [deg] (float), only used with grid
+    "back_step": None,  # back waveplate step [deg] (float), only used with grid
+    "position_policy": "retry",  # a pol that doesn't settle where it was sent: "retry" corrective moves, "accept" wherever it ends up after them, or "abort" (see utility.settle_or_correct)
 }
 
 print("checking that the input dictionary has been filled out correctly")
@@ -131,59 +93,33 @@ assert isinstance(
 ), "spec_int_time input must be float or int"
 assert isinstance(inputs["fname"], str), "fname input must be str"
 assert isinstance(inputs["path"], str), "path input must be str"
+assert inputs["format"] in ("csv", "scan"), 'format input must be "csv" or "scan"'
+if inputs["grid"]:
+    for key in ("back_intial_pos", "back_final_position", "back_step"):
+        assert isinstance(inputs[key], (float, int)), key + " input must be float or int for a grid scan"
+# every point goes into a journal next to the data as it is taken, one left behind holds a scan that never got saved
+journal_file = journal.journal_path(inputs["path"] + inputs["fname"])
+if os.path.exists(journal_file):
+    raise Exception(journal_file + " is left from a scan that never saved, its points are in there, move it before starting")
 
 # now connect to machines
+# both wait on the controllers reporting homed/enabled rather than a flat minute
 # front pol
-print("connecting to front motor, one minute please")
-try:
-    frnt = apt.devices.tdc001(serial_port=inputs["front_port"])
-except:
-    frnt.close()
-    raise Exception("an error occured while trying to connect to TDC001")
-else:
-    time.sleep(60.0)
-# check connection status of front motor
-frnt_connection = is_mtr_connected(frnt)
-if frnt_connection == False:
-    print("checking front motor connection")
-    frnt.move_relative(from_d(5.0))
-    time.sleep(5.0)
-    frnt.move_absolute(from_d(0.0))
-    time.sleep(5.0)
-frnt_connection = is_mtr_connected(frnt)
-if frnt_connection:
-    print("front motor connection established!")
-else:
-    frnt.close()
-    raise Exception("could not establish connection to front motor, debugging required")
-frnt.register_error_callback(error_callback)
-
+print("connecting to front motor")
+front = utility.AptMotor(port=inputs["front_port"], stage=front_stage)
+frnt = front.connection
+print("front motor connection established!")
 
-print("connecting to back motor, one minute please")
-try:
-    bck = tl.KinesisMotor("27263055", scale="stage")
-    bck.home()
-except:
-    bck.close()
-    raise Exception("an error occured while trying to connect to KDC101")
-else:
-    time.sleep(60.0)
-# check connection status of back motor
-bck_connection = is_pll_connected(bck)
-if bck_connection:
-    print("back motor connection established!")
-else:
-    bck.close()
-    raise Exception(
-        "could not establish connection with back motor, debugging required"
-    )
+print("connecting to back motor")
+back = utility.KinesisMotor(inputs["KDC_SN"])
+bck = back.connection
 
 print("connecting to spectrograph")
 try:
     spectrum = spectro.ocean(inputs["specSN"])
 except:
-    frnt.close()
-    bck.close()
+    front.close()
+    back.close()
     raise Exception("cannot connect to spectrograph, program ending")
 # this is what original dscan does, idk why tho
 try:
@@ -194,21 +130,37 @@ except:
 time.sleep(2.0)
 
 # moving pols to their starting pos and taking background
+# both pols are driven by the motion coordinator, one worker per controller, so they move and settle together
+pols = motion.MotionCoordinator([front, back])
 pol_pos_d = np.arange(
     inputs["intial_pos"],
     (inputs["final_position"] + inputs["step"]),
     inputs["step"],
     dtype=float,
-)  # desired polarizer positions [deg]
-pol_pos_cts = np.array(
-    [pol_pos_d[i] for i in range(len(pol_pos_d))]
-)  # desired polarizer pos [cts]
-pol_pos_bck = pol_pos_d + inputs["offset"]
+)  # desired front polarizer positions [deg]
+here = pols.positions()
+# visit the points in the order with the least travel from where the pols are now, data still goes in in angle order
+if inputs["grid"]:
+    # every front position against every back position, point i * len(pol_pos_bck) + j is (front i, back j)
+    pol_pos_bck = np.arange(
+        inputs["back_intial_pos"],
+        (inputs["back_final_position"] + inputs["back_step"]),
+        inputs["back_step"],
+        dtype=float,
+    )  # desired back polarizer positions [deg]
+    pairs, positions = planner.plan_grid(pol_pos_d, pol_pos_bck, current=here, wrap=inputs["wrap"])
+    order = [i * len(pol_pos_bck) + j for i, j in pairs]
+    point_angles = np.array([(a, b) for a in pol_pos_d for b in pol_pos_bck])
+else:
+    # the back pol keeps its offset so it moves the same way
+    pol_pos_bck = pol_pos_d + inputs["offset"]
+    order, pos_frnt = planner.plan_order(pol_pos_d, here[0], wrap=inputs["wrap"])
+    positions = np.column_stack([pos_frnt, pos_frnt + inputs["offset"]])  # commanded positions [deg], in visiting order
+    point_angles = np.column_stack([pol_pos_d, pol_pos_bck])
 
 print("time to collect background")
-frnt.move_absolute(pol_pos_cts[0])
-bck.move_to(pol_pos_bck[0])
-time.sleep(5.0)
+# "wait" is for the steps between points, the first move can be half way round
+pols.move_to(positions[0], timeout=planner.move_timeout(np.asarray(positions[0]) - here, wait=inputs["wait"]))
 
 input("press enter to collect background")
 bkg = spectrum.getspec()
@@ -216,77 +168,130 @@ bkg = spectrum.getspec()
 # create array to save all data, assuming spectrograph collects the same wavelength every time spectrum.getspec() is ran
 # format: Nx(M+2) array, [[wvl],[bkg],[I(1st pol pos)],...,[I(ith pol pos)],...,[I(Nth pol pos)]]
 # where wvl,bkg,I(pos) Nx1 col arrays
-data = np.zeros((len(bkg[0]), (len(pol_pos_d) + 2)), dtype=float)
+data = np.zeros((len(bkg[0]), (len(point_angles) + 2)), dtype=float)
 # now place the background and wvl in the first two columns
 data[:, 0] = bkg[0]
 data[:, 1] = bkg[1]
+# a scan file is preallocated now and filled one spectrum at a time
+if inputs["format"] == "scan":
+    scan_file = scanfile.ScanFile.create(
+        inputs["path"] + inputs["fname"],
+        bkg[0],
+        background=bkg[1],
+        angles=point_angles[:, 0],
+        columns=("angle", "back_angle", "timestamp", "actual_angle", "actual_back_angle"),
+        metadata={
+            "offset": None if inputs["grid"] else inputs["offset"],
+            "grid": inputs["grid"],
+            "integration_time_ms": inputs["spec_int_time"],
+        },
+    )
+
+
+def save_csv(did_break):
+    "saves data with np.savetxt, asks for another name rather than overwrite a file"
+    # using np.savetxt, set up headers
+    cmt = (
+        "file was created at: "
+        + time.asctime()
+        + "\n"
+        + "back polarizer was offset by: "
+        + str(inputs["offset"])
+        + "\n"
+        + "front polarizer positions [deg]:\n"
+        + str(pol_pos_d)
+    )
+    if inputs["grid"]:
+        cmt += "\nback polarizer positions [deg] (columns go through every back position for each front one):\n" + str(pol_pos_bck)
+    cmt += "\nsettled (front, back) positions [deg] of every column, nan if not taken:\n"
+    cmt += np.array2string(settled, threshold=settled.size + 1)
+    if did_break:
+        cmt += "\ncollection ended early, columns of points that were not taken are all zeros"
+    # open file, will not overwrite
+    try:
+        with open(inputs["path"] + inputs["fname"], "x", encoding="utf-8") as f:
+            np.savetxt(f, data, delimiter=",", header=cmt, encoding="utf-8")
+    except FileExistsError:
+        print("this file already exists, i wont let you overwrite your data!")
+        new_fname = input("please put unused file name here:")
+        if new_fname[-4:] != ".txt":
+            new_fname += ".txt"
+        with open(inputs["path"] + new_fname, "x", encoding="utf-8") as g:
+            np.savetxt(g, data, delimiter=",", header=cmt, encoding="utf-8")
+
+
+# the journal has the plan and the background, then every point once it is taken (journal.Journal.open reads it back)
+scan_journal = journal.Journal.create(
+    journal_file,
+    bkg[0],
+    bkg[1],
+    inputs=inputs,
+    point_angles=point_angles,
+    order=order,
+    positions=positions,
+)
 # now to collect the rest of the data
 input("press enter to begin collecting data")
-# if checks are failed, have a vari that if we had to break the loop it will just end the program after the loop
-did_break = False
-for i in range(len(pol_pos_cts)):
-    # check connections every time
-    frnt_connection = is_mtr_connected(frnt)
-    bck_connection = is_pll_connected(bck)
-    if frnt_connection and bck_connection:
-        print("moving to ", pol_pos_d[i], " and ", pol_pos_bck[i], " deg")
-        frnt.move_absolute(pol_pos_cts[i])
-        bck.move_to(pol_pos_bck[i])
-        time.sleep(inputs["wait"])
-        # check pol drift
-        df = np.isclose(pol_pos_d[i], to_d(frnt.status["position"]), atol=0.2)
-        db = np.isclose(pol_pos_bck[i], bck.get_position(), atol=0.2)
-        if (df == False) or (db == False):
-            print("a polarizer has drifted from desired values, ending collection")
-            did_break = True
+# anything that ends the loop early (a failed check, an error, ctrl-c) leaves this set, only finishing clears it
+did_break = True
+# where the pols actually settled for every point [deg], NaN for points not taken
+settled = np.full((len(point_angles), 2), np.nan)
+try:
+    for k in range(len(order)):
+        i = order[k]  # index of this point in angle order
+        # check connections every time, both pols are read at once
+        if all(pols.connected()):
+            print("moving to ", point_angles[i, 0], " and ", point_angles[i, 1], " deg")
+            # check pol drift, returns as soon as the slower pol has settled
+            try:
+                settled[i] = pols.move_to(
+                    positions[k], tol=0.2, timeout=inputs["wait"], policy=inputs["position_policy"]
+                )
+            except TimeoutError:
+                print("a polarizer has drifted from desired values, ending collection")
+                break
+        else:
+            print("connection a polarizer was lost, ending collection")
             break
+        print("collecting")
+        x = spectrum.getspec()
+        # check its collecting the same spectrum
+        if np.allclose(x[0], data[:, 0]) == False:
+            print("spectrograph has collected different spectral range, ending collection")
+            break
+        info = dict(
+            back_angle=point_angles[i, 1],
+            timestamp=time.time(),
+            actual_angle=settled[i, 0],
+            actual_back_angle=settled[i, 1],
+        )
+        # on disk in the journal before it goes anywhere else
+        scan_journal.record(i, point_angles[i, 0], x[1], **info)
+        # put new data into array
+        data[:, (2 + i)] = x[1]
+        if inputs["format"] == "scan":
+            scan_file.write(i, x[1], **info)
+    else:
+        did_break = False
+finally:
+    # whatever ended collection (an error or ctrl-c too), what was collected is saved before anything is closed
+    if did_break:
+        print("an error occured during collection, saving the points collected so far, closing connections")
     else:
-        print("connection a polarizer was lost, ending collection")
-        did_break = True
-        break
-    print("collecting")
-    x = spectrum.getspec()
-    # check its collecting the same spectrum
-    if np.allclose(x[0], data[:, 0]) == False:
-        print("spectrograph has collected different spectral range, ending collection")
-        did_break = True
-        break
-    # put new data into array
-    data[:, (2 + i)] = x[1]
-# check if loop was exited early
+        print("collection finished, saving data, closing connections")
+    scan_journal.close()
+    try:
+        if inputs["format"] == "scan":
+            scan_file.close()
+        else:
+            save_csv(did_break)
+        # everything in the journal is in the data file now
+        os.remove(journal_file)
+    finally:
+        pols.close()
+        front.close()
+        back.close()
+        spectrum.close()
 if did_break:
-    print(
-        "an error occured during collection, nothing has been saved, closing connections"
-    )
-    frnt.close()
-    bck.close()
-    spectrum.close()
     raise Exception("see above for specific issue, ending program")
-else:
-    print("collection finished, saving data, closing connections")
-    frnt.close()
-    bck.close()
-    spectrum.close()
-# using np.savetxt, set up headers
-cmt = (
-    "file was created at: "
-    + time.asctime()
-    + "\n"
-    + "back polarizer was offset by: "
-    + str(inputs["offset"])
-    + "\n"
-    + "front polarizer positions [deg]:\n"
-    + str(pol_pos_d)
-)
-# open file, will not overwrite
-try:
-    with open(inputs["path"] + inputs["fname"], "x", encoding="utf-8") as f:
-        np.savetxt(f, data, delimiter=",", header=cmt, encoding="utf-8")
-except FileExistsError:
-    print("this file already exists, i wont let you overwrite your data!")
-    new_fname = input("please put unused file name here:")
-    if new_fname[-4:] != ".txt":
-        new_fname += ".txt"
-    with open(inputs["path"] + new_fname, "x", encoding="utf-8") as g:
-        np.savetxt(g, data, delimiter=",", header=cmt, encoding="utf-8")
 print("saving completed, have a nice day :)")
@@ -0,0 +1,103 @@
+# Auto-exposure
+# SHG intensity swings by orders of magnitude with polarizer angle, so one integration time
+# either saturates the lobes or wastes time at the nodes. AutoExposure picks the integration time
+# from a probe acquisition and then follows the signal from angle to angle, retaking a spectrum
+# when it clipped or came out far too dim. Every spectrum is stored with its integration time,
+# counts_per_ms puts spectra taken at different integration times on the same scale.
+import numpy as np
+
+
+def counts_per_ms(counts, inttime, background=None, background_inttime=None):
+    """
+    counts [counts] taken over inttime [msec] as a rate [counts/ms], works on a row of spectra with a column of inttimes
+    background - counts taken over background_inttime [msec] (inttime if not given), subtracted as a rate
+    """
+    inttime = np.asarray(inttime, dtype=float)
+    if np.ndim(counts) == 2 and inttime.ndim == 1:
+        inttime = inttime[:, None]
+    rate = np.asarray(counts, dtype=float) / inttime
+    if background is not None:
+        if background_inttime is None:
+            background_inttime = inttime
+        rate = rate - np.asarray(background, dtype=float) / background_inttime
+    return rate
+
+
+class AutoExposure:
+    """
+    integration time control for an oceanOpticSpectrosco.ocean
+    target - fraction of full scale the brightest pixel should reach
+    bounds - (shortest, longest) integration time [msec] allowed, the spectrometer's own limits are respected too
+    saturation - fraction of full scale above which a spectrum counts as clipped
+    too_dim - a spectrum whose peak is below this fraction of target is retaken at a longer integration time
+    tolerance - integration time is only changed when it should move by more than this fraction
+    retries - most retakes for one point
+    """
+
+    def __init__(
+        self,
+        spectrum,
+        target=0.7,
+        bounds=(1.0, 10000.0),
+        saturation=0.98,
+        too_dim=0.25,
+        tolerance=0.1,
+        retries=3,
+    ):
+        self.spectrum = spectrum
+        self.target = target
+        lo, hi = bounds
+        limits = getattr(spectrum, "inttime_limits", None)
+        if limits is not None:
+            lo, hi = max(lo, limits[0]), min(hi, limits[1])
+        self.bounds = (lo, hi)
+        self.full_scale = float(getattr(spectrum, "max_intensity", 65535.0))
+        self.saturation = saturation
+        self.too_dim = too_dim
+        self.tolerance = tolerance
+        self.retries = retries
+        self._retakes = 0
+
+    def ideal(self, counts, inttime):
+        "integration time [msec] that brings the peak of counts (taken over inttime) to target, within bounds"
+        peak = max(float(np.max(counts)), 1.0)
+        if peak >= self.saturation * self.full_scale:
+            # the real peak is somewhere above full scale, at least halve rather than trust the ratio
+            wanted = min(inttime * self.target * self.full_scale / peak, inttime / 2.0)
+        else:
+            wanted = inttime * self.target * self.full_scale / peak
+        return float(np.clip(wanted, *self.bounds))
+
+    def _set(self, inttime):
+        "changes the integration time if it moved by more than tolerance, returns True if it did"
+        current = self.spectrum.inttime
+        if abs(inttime - current) <= self.tolerance * current:
+            return False
+        self.spectrum.setinttime(inttime)
+        return True
+
+    def probe(self, attempts=6):
+        """
+        takes quick probe spectra, changing the integration time after each, until the peak sits near target unclipped
+        OUTPUT: the integration time [msec] settled on
+        """
+        for _ in range(attempts):
+            counts = self.spectrum.getspec()[1]
+            if not self._set(self.ideal(counts, self.spectrum.inttime)):
+                break
+        return self.spectrum.inttime
+
+    def update(self, counts):
+        """
+        looks at the counts of a spectrum just taken at spectrum.inttime and sets the integration time for the next one
+        OUTPUT: True to keep the spectrum, False if it clipped or was too dim and should be retaken
+        """
+        inttime = self.spectrum.inttime
+        peak = float(np.max(counts))
+        changed = self._set(self.ideal(counts, inttime))
+        bad = peak >= self.saturation * self.full_scale or peak < self.too_dim * self.target * self.full_scale
+        if changed and bad and self._retakes < self.retries:
+            self._retakes += 1
+            return False
+        self._retakes = 0
+        return True
@@ -0,0 +1,144 @@
+# Online polarization fit
+# fits I(theta) = c0 + sum over harmonics n of (a_n cos(n theta) + b_n sin(n theta)) at every pixel while the scan runs.
+# The normal equations are accumulated as points come in, A^T A (terms x terms), A^T y (terms x pixels) and y^T y,
+# so adding an angle is O(pixels) and the coefficients and residuals can be read at any time by solving a tiny system.
+# solve() fits a whole finished scan the same way in one least squares solve, every pixel a column of the right hand side.
+import time
+
+import numpy as np
+
+
+def terms(harmonics=(2, 4)):
+    "names of the fit terms, c0 then cos/sin of every harmonic"
+    return ["c0"] + [f"{f}{n}" for n in harmonics for f in ("cos", "sin")]
+
+
+def design(angles, harmonics=(2, 4)):
+    "angles x terms design matrix at angles [deg], every row is OnlineFit.basis of that angle"
+    theta = np.deg2rad(np.asarray(angles, dtype=float))
+    columns = [np.ones_like(theta)]
+    for n in harmonics:
+        columns += [np.cos(n * theta), np.sin(n * theta)]
+    return np.column_stack(columns)
+
+
+def solve(angles, intensities, harmonics=(2, 4)):
+    """
+    fits every column of intensities (angles x pixels) against angles [deg] in one np.linalg.lstsq
+    OUTPUT: (terms x pixels coefficients, rms residual of every pixel, NaN unless there are more angles than terms)
+    """
+    a = design(angles, harmonics)
+    y = np.asarray(intensities, dtype=float)
+    coefficients, rss, rank, _ = np.linalg.lstsq(a, y, rcond=None)
+    dof = len(a) - a.shape[1]
+    if dof <= 0 or rank < a.shape[1]:
+        return coefficients, np.full(y.shape[1:], np.nan)
+    return coefficients, np.sqrt(rss / dof)
+
+
+class OnlineFit:
+    """
+    least squares fit of every pixel's intensity against polarizer angle
+    harmonics - the n of the cos(n theta), sin(n theta) terms, (2, 4) for SHG
+    """
+
+    def __init__(self, n_pixels, harmonics=(2, 4)):
+        self.harmonics = tuple(harmonics)
+        self.terms = terms(self.harmonics)
+        p = len(self.terms)
+        self.n = 0
+        self.ata = np.zeros((p, p))
+        self.aty = np.zeros((p, n_pixels))
+        self.yty = np.zeros(n_pixels)
+        self._previous = None
+        self.change = np.inf  # relative change of the coefficients at the last update
+
+    def basis(self, angle):
+        "row of the design matrix at angle [deg]"
+        theta = np.deg2rad(angle)
+        row = [1.0]
+        for n in self.harmonics:
+            row += [np.cos(n * theta), np.sin(n * theta)]
+        return np.array(row)
+
+    def add(self, angle, intensity):
+        "adds one spectrum taken at angle [deg]"
+        a = self.basis(angle)
+        y = np.asarray(intensity, dtype=float)
+        self.ata += np.outer(a, a)
+        self.aty += a[:, None] * y[None, :]
+        self.yty += y * y
+        self.n += 1
+
+    def ready(self):
+        "enough angles to pin every coefficient down"
+        return self.n >= len(self.terms)
+
+    def coefficients(self):
+        "terms x pixels coefficients of the fit so far (in the order of self.terms)"
+        return np.linalg.lstsq(self.ata, self.aty, rcond=None)[0]
+
+    def residuals(self, coefficients=None):
+        "rms residual of every pixel, from the accumulated sums (NaN until there are more angles than terms)"
+        if coefficients is None:
+            coefficients = self.coefficients()
+        dof = self.n - len(self.terms)
+        if dof <= 0:
+            return np.full(self.yty.shape, np.nan)
+        # at the least squares solution the residual sum of squares is y^T y - c^T A^T y
+        rss = self.yty - np.sum(coefficients * self.aty, axis=0)
+        return np.sqrt(np.maximum(rss, 0.0) / dof)
+
+    def update_change(self):
+        "works out how much the coefficients moved since the last call, relative to their size (over all pixels)"
+        coefficients = self.coefficients()
+        if self._previous is not None:
+            scale = max(np.linalg.norm(coefficients), 1e-12)
+            self.change = float(np.linalg.norm(coefficients - self._previous) / scale)
+        self._previous = coefficients
+        return self.change
+
+    def save(self, path, wavelengths, header=""):
+        "writes wavelengths, the coefficients and the rms residual of every pixel as a tab separated file"
+        coefficients = self.coefficients()
+        table = np.column_stack([wavelengths, coefficients.T, self.residuals(coefficients)])
+        columns = "\t".join(["wavelength_nm"] + self.terms + ["rms_residual"])
+        header = (header + "\n" if header else "") + f"fit of {self.n} angles at " + time.asctime() + "\n" + columns
+        np.savetxt(path, table, delimiter="\t", header=header)
+
+
+class FitSink:
+    """
+    scan sink that keeps an OnlineFit of the scan up to date and saves it to path when the scan ends
+    per_ms - bool - fit counts/ms (intensity / integration_time_ms), for scans where the integration time changes
+    tol, patience - converged() once the coefficients moved by less than tol (relative) patience points in a row
+    """
+
+    def __init__(self, path, harmonics=(2, 4), per_ms=False, tol=None, patience=3):
+        self.path = path
+        self.harmonics = harmonics
+        self.per_ms = per_ms
+        self.tol = tol
+        self.patience = patience
+        self.fit = None
+        self.wavelengths = None
+        self._steady = 0
+
+    def open(self, pol_pos_d, wavelengths, background):
+        self.wavelengths = np.asarray(wavelengths)
+        self.fit = OnlineFit(len(self.wavelengths), self.harmonics)
+
+    def write_point(self, index, angle, intensity, **info):
+        if self.per_ms and "integration_time_ms" in info:
+            intensity = np.asarray(intensity) / info["integration_time_ms"]
+        self.fit.add(angle, intensity)
+        if self.tol is not None and self.fit.ready():
+            self._steady = self._steady + 1 if self.fit.update_change() < self.tol else 0
+
+    def converged(self):
+        "True once the fit has stopped changing, for run_scan(stop=...)"
+        return self.tol is not None and self._steady >= self.patience
+
+    def close(self):
+        if self.fit is not None and self.fit.ready():
+            self.fit.save(self.path, self.wavelengths, "counts/ms" if self.per_ms else "counts")
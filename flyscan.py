@@ -0,0 +1,153 @@
+# Continuous rotation ("fly") scan
+# the waveplate turns at a constant velocity while the spectrometer acquires back to back,
+# a poller thread records the encoder position with timestamps, and the angle of each spectrum
+# is found afterwards by interpolating those positions over its integration window
+import threading
+import time
+
+import numpy as np
+
+import acquisition
+import angles
+import utility
+
+
+class PositionPoller:
+    "thread that reads motor.status['position'] every poll seconds into a growing (time, cts) record, converted in one go when read"
+
+    def __init__(self, connection, poll=0.005, capacity=4096, stage=angles.PRM1Z8):
+        self.connection = connection
+        self.stage = stage
+        self.poll = poll
+        self.times = np.empty(capacity)
+        self.counts = np.empty(capacity)
+        self.n = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="position-poller", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            t = time.monotonic()
+            cts = self.connection.status["position"]
+            with self._lock:
+                if self.n == len(self.times):
+                    # double the buffers rather than append one sample at a time
+                    self.times = np.concatenate([self.times, np.empty(len(self.times))])
+                    self.counts = np.concatenate([self.counts, np.empty(len(self.counts))])
+                self.times[self.n] = t
+                self.counts[self.n] = cts
+                self.n += 1
+            time.sleep(self.poll)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def latest(self):
+        "(time, angle [deg]) of the newest sample"
+        with self._lock:
+            return self.times[self.n - 1], self.stage.to_d(self.counts[self.n - 1])
+
+    def angle_at(self, t):
+        "angle [deg] at time(s) t, linearly interpolated between polled positions"
+        with self._lock:
+            times = self.times[: self.n].copy()
+            degs = self.stage.to_d(self.counts[: self.n])
+        return np.interp(t, times, degs)
+
+
+def fly_scan(motor, spectrum, start, stop, velocity, writer, acceleration=None, poll=0.005, timeout=60.0, buffer=0):
+    """
+    rotates from start to stop [deg] at velocity [deg/s] while acquiring spectra back to back
+    motor - utility.AptMotor
+    spectrum - oceanOpticSpectrosco.ocean, its inttime has to be set
+    writer - scan.ScanWriter, gets every spectrum with angle = middle of its window and
+             t_start, t_end, angle_start, angle_end, window (angular integration window [deg]) as info
+    acceleration - float - [deg/s^2], the motor's own if not given
+    poll - float - time [sec] between encoder position reads
+    timeout - float - longest time [sec] to wait for the stage to reach the run up position
+    buffer - int - spectra to hold in the spectrometer's on-board buffer, the spectra are then read out in batches
+                   and timed by acquisition.BufferedReader, 0 (or no buffer on the device) reads them one at a time
+    the stage starts far enough before start to be at full speed by then, only spectra whose whole
+    window lies between start and stop are kept
+    OUTPUT: number of spectra written
+    """
+    if acceleration is None:
+        acceleration = motor.acceleration
+    old_velocity, old_acceleration = motor.velocity, motor.acceleration
+    direction = 1.0 if stop >= start else -1.0
+    # distance needed to get up to (and down from) full speed, plus a little
+    run_up = velocity**2 / (2.0 * acceleration) * 1.2 + 0.1
+
+    try:
+        print("moving to run up position")
+        motor.connection.move_absolute(motor.stage.from_d(start - direction * run_up))
+        motor.wait_until_settled(start - direction * run_up, timeout=timeout)
+        motor.set_velocity(velocity, acceleration)
+
+        poller = PositionPoller(motor.connection, poll=poll, stage=motor.stage).start()
+        time.sleep(2 * poll)  # have a position on record before anything else happens
+        print("flying from", start, "to", stop, "deg at", velocity, "deg/s")
+        reader = None
+        pending = []
+        n = 0
+        try:
+            reader = acquisition.open_reader(spectrum, buffer)
+            motor.connection.move_absolute(motor.stage.from_d(stop + direction * run_up))
+            t_move = time.monotonic()
+            while True:
+                pending.extend(reader.get(timeout=1.0))
+                # hand on every spectrum the poller has seen past the end of
+                t_poll, angle_now = poller.latest()
+                while pending and pending[0][1] <= t_poll:
+                    n += _submit(writer, poller, start, stop, n, *pending.pop(0))
+                if direction * (angle_now - stop) >= 0.0:
+                    break
+                if time.monotonic() - t_move > 1.0 and not utility.is_mtr_moving(motor.connection):
+                    raise Exception("polarizer stopped before reaching the end of the fly scan")
+            reader.stop()
+            pending.extend(reader.get(timeout=0))
+            time.sleep(2 * poll)
+            for item in pending:
+                n += _submit(writer, poller, start, stop, n, *item)
+        finally:
+            if reader is not None:
+                reader.stop()
+            poller.stop()
+    finally:
+        motor.set_velocity(old_velocity, old_acceleration)
+    return n
+
+
+def expected_points(start, stop, velocity, inttime, readout=0.005):
+    """
+    about how many spectra a fly scan from start to stop [deg] at velocity [deg/s] with inttime [msec] gives,
+    rounded up with a few percent to spare, readout=0 for the on-board buffer (no gap between spectra)
+    """
+    n = int(np.ceil(abs(stop - start) / velocity / (inttime / 1000.0 + readout)))
+    return n + n // 20 + 2
+
+
+def _submit(writer, poller, start, stop, index, t_start, t_end, spectrometer_output):
+    "works out the angles of one spectrum and hands it to the writer, returns 1 if it was kept"
+    angle_start, angle_end = poller.angle_at([t_start, t_end])
+    lo, hi = min(start, stop), max(start, stop)
+    if not (lo <= angle_start <= hi and lo <= angle_end <= hi):
+        return 0
+    writer.submit(
+        index,
+        0.5 * (angle_start + angle_end),
+        spectrometer_output,
+        timestamp=time.time() - (time.monotonic() - t_end),
+        t_start=t_start,
+        t_end=t_end,
+        angle_start=angle_start,
+        angle_end=angle_end,
+        window=abs(angle_end - angle_start),
+    )
+    return 1
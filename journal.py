@@ -0,0 +1,141 @@
+# Scan journal
+# an append-only record of a step scan that survives the program (or the computer) dying:
+# a header with the scan plan, the settings and the device state, then one record per finished point,
+# each flushed and fsync'd before the scan moves on. A scan that stopped early is continued with
+# main.py --resume, which replays the journal into a fresh output file and takes only the missing points.
+#
+# one JSON object per line, numpy arrays go in as base64 float64 so spectra round trip exactly;
+# a last line cut short by a crash is ignored when reading
+import base64
+import json
+import os
+
+import numpy as np
+
+
+def journal_path(path):
+    "journal that goes with the output file at path"
+    return path + ".journal"
+
+
+def _encode(value):
+    if isinstance(value, np.ndarray) or isinstance(value, (list, tuple)) and np.ndim(value) > 0:
+        a = np.ascontiguousarray(value, dtype="<f8")
+        return {"__array__": base64.b64encode(a.tobytes()).decode("ascii"), "shape": list(a.shape)}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and "__array__" in value:
+        return np.frombuffer(base64.b64decode(value["__array__"]), dtype="<f8").reshape(value["shape"])
+    return value
+
+
+class Journal:
+    """
+    header - dict with the scan plan and settings, anything JSON can hold plus numpy arrays
+    points - {index: (angle, counts, info)} of every point recorded so far
+    """
+
+    def __init__(self, path, header, points, f=None):
+        self.path = path
+        self.header = header
+        self.points = points
+        self._f = f
+
+    @classmethod
+    def create(cls, path, wavelengths, background, overwrite=False, **header):
+        """
+        starts a new journal at path with the wavelengths [nm] and background [counts] the scan was taken against
+        header keywords (plan, settings, device state...) are stored as they are, arrays included
+        """
+        header = dict(header, wavelengths=wavelengths, background=background)
+        f = open(path, "w" if overwrite else "x")
+        journal = cls(path, header, {}, f)
+        journal._append({k: _encode(v) for k, v in header.items()})
+        return journal
+
+    @classmethod
+    def open(cls, path):
+        "reads a journal and reopens it to append more points"
+        with open(path) as f:
+            lines = f.read().splitlines()
+        header = {k: _decode(v) for k, v in json.loads(lines[0]).items()}
+        points = {}
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # cut short by a crash, everything before it is good
+            info = {k: _decode(v) for k, v in record["info"].items()}
+            points[record["index"]] = (record["angle"], _decode(record["counts"]), info)
+        # drop a partial last line so new records start on a line of their own
+        with open(path, "r+") as f:
+            good = sum(len(line) + 1 for line in lines[: 1 + len(points)])
+            f.truncate(good)
+        return cls(path, header, points, open(path, "a"))
+
+    def _append(self, record):
+        self._f.write(json.dumps(record) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def record(self, index, angle, counts, **info):
+        "durably appends one finished point, returns once it is on disk"
+        self._append(
+            {
+                "index": int(index),
+                "angle": float(angle),
+                "counts": _encode(np.asarray(counts)),
+                "info": {k: _encode(v) for k, v in info.items()},
+            }
+        )
+        self.points[int(index)] = (float(angle), np.asarray(counts), info)
+
+    def missing(self, n):
+        "indices below n not recorded yet, in order"
+        return [i for i in range(n) if i not in self.points]
+
+    def replay(self, sink):
+        "writes every recorded point into sink (a scan sink), in index order"
+        for index in sorted(self.points):
+            angle, counts, info = self.points[index]
+            sink.write_point(index, angle, counts, **info)
+
+    def close(self):
+        if self._f is not None and not self._f.closed:
+            self._f.close()
+
+
+class JournalSink:
+    "scan sink that records every point in a Journal, put it on the ScanWriter next to the output sink"
+
+    def __init__(self, journal):
+        self.journal = journal
+
+    def open(self, pol_pos_d, wavelengths, background):
+        pass  # the journal header went in when it was created
+
+    def write_point(self, index, angle, intensity, **info):
+        self.journal.record(index, angle, intensity, **info)
+
+    def close(self):
+        self.journal.close()
+
+
+def background_compatible(old, new, old_inttime, new_inttime, tol=0.1):
+    """
+    True if a background new (taken over new_inttime [msec]) matches the old one (old_inttime) well enough
+    to keep using data taken against old: same length and median dark rates within tol (fraction) of each other,
+    allowing for shot noise
+    """
+    old = np.asarray(old, dtype=float)
+    new = np.asarray(new, dtype=float)
+    if old.shape != new.shape:
+        return False
+    old_rate = np.median(old) / old_inttime
+    new_rate = np.median(new) / new_inttime
+    noise = np.sqrt(max(np.median(old), 1.0)) / old_inttime
+    return abs(new_rate - old_rate) <= tol * abs(old_rate) + 3.0 * noise
@@ -1,53 +1,148 @@
 # Class for listing serial ports and selecting serial connections
 # Modified by Liam Clink, 2023
 # Taken from: https://stackoverflow.com/questions/12090503/listing-available-com-ports-with-python
+#
+# The ports are enumerated once and kept in dictionaries by serial number, device and description, so
+# finding a controller is a lookup. The registry enumerates again only when a lookup misses or the ports
+# changed: on posix a device plugged in or out changes the mtime of /dev, anywhere else call notify_hotplug()
+# (from a udev/WM_DEVICECHANGE hook, say). A re-enumeration only re-indexes the ports that came, went or changed.
+#
+#   ports = SerialPorts.shared()
+#   ports.find(serial_number="83000000").device
+#   ports.resolve(["83000000", "27263055"])   every controller in one pass
+
+import os
 
 import serial.tools.list_ports
 
+# changes when a device node is added or removed, where there is such a thing
+_HOTPLUG_DIR = "/dev" if os.name == "posix" else None
+
+
+def _hotplug_stamp():
+    if _HOTPLUG_DIR is None:
+        return None
+    try:
+        return os.stat(_HOTPLUG_DIR).st_mtime_ns
+    except OSError:
+        return None
+
 
 class SerialPorts:
-    def __init__(self, ports_list: list = []):
-        self.ports_list = ports_list
+    """
+    registry of the connected serial ports
+    ports_list - list of Object, by_serial_number / by_device - {key: Object}, by_description - {description: [Object]}
+    comports - function listing the ports, serial.tools.list_ports.comports by default
+    """
 
-    # @classmethod
-    def get_serial_ports(self):  # cls):
-        data = []
-        ports = list(serial.tools.list_ports.comports())
+    _shared = None
 
-        for port_ in ports:
+    def __init__(self, ports_list: list = None, comports=None):
+        self.comports = comports if comports is not None else serial.tools.list_ports.comports
+        self.ports_list = []
+        self.by_serial_number = {}
+        self.by_device = {}
+        self.by_description = {}
+        self.enumerations = 0  # how many times the ports were listed, for checking the cache works
+        self._stamp = None
+        self._stale = True
+        for port_ in ports_list or []:
+            self._add(port_)
+
+    @classmethod
+    def shared(cls):
+        "the registry shared by everything in this process, enumerated on first use"
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def get_serial_ports(self):
+        "lists the ports again and updates the dictionaries for the ones that changed, returns self"
+        self._stamp = _hotplug_stamp()
+        self._stale = False
+        self.enumerations += 1
+        current = {}
+        for port_ in self.comports():
             obj = Object(
                 data=dict(
                     {
                         "device": port_.device,
-                        "description": port_.description.split("(")[0].strip(),
+                        "description": (port_.description or "").split("(")[0].strip(),
                         # These next two only are present for USB
                         "manufacturer": port_.manufacturer,
                         "serial_number": port_.serial_number,
                     }
                 )
             )
-            data.append(obj)
+            current[obj.device] = obj
+        for device in list(self.by_device):
+            if device not in current or current[device].data != self.by_device[device].data:
+                self._remove(self.by_device[device])
+        for device, obj in current.items():
+            if device not in self.by_device:
+                self._add(obj)
+        return self
+
+    def notify_hotplug(self):
+        "something was plugged in or out, the next lookup lists the ports again"
+        self._stale = True
 
-        self.ports_list = data
-        # return cls(ports_list=data)
+    def changed(self):
+        "True if the ports may have changed since they were listed"
+        return self._stale or self._stamp != _hotplug_stamp()
 
-    @staticmethod
-    def get_description_by_device(device: str):
-        for port_ in SerialPorts.get_serial_ports().ports_list:
-            if port_.device == device:
-                return port_.description
+    def _add(self, obj):
+        self.ports_list.append(obj)
+        self.by_device[obj.device] = obj
+        if obj.serial_number:
+            self.by_serial_number[obj.serial_number] = obj
+        self.by_description.setdefault(obj.description, []).append(obj)
 
-    @staticmethod
-    def get_device_by_description(description: str):
-        for port_ in SerialPorts.get_serial_ports().ports_list:
-            if port_.description == description:
-                return port_.device
+    def _remove(self, obj):
+        self.ports_list.remove(obj)
+        del self.by_device[obj.device]
+        if self.by_serial_number.get(obj.serial_number) is obj:
+            del self.by_serial_number[obj.serial_number]
+        same = self.by_description[obj.description]
+        same.remove(obj)
+        if not same:
+            del self.by_description[obj.description]
 
-    @staticmethod
-    def get_device_by_serial_number(serial_number: str):
-        for port_ in SerialPorts.get_serial_ports().ports_list:
-            if port_.serial_number == serial_number:
-                return port_.device
+    def _lookup(self, serial_number=None, device=None, description=None):
+        if serial_number is not None:
+            return self.by_serial_number.get(serial_number)
+        if device is not None:
+            return self.by_device.get(device)
+        return (self.by_description.get(description) or [None])[0]
+
+    def find(self, serial_number: str = None, device: str = None, description: str = None):
+        "Object of the port with that serial number (or device, or description), None if it isn't connected"
+        listed = self.changed()
+        if listed:
+            self.get_serial_ports()
+        found = self._lookup(serial_number, device, description)
+        if found is None and not listed:
+            # it may have been plugged in since the last listing without a hot-plug signal
+            found = self.get_serial_ports()._lookup(serial_number, device, description)
+        return found
+
+    def resolve(self, serial_numbers):
+        "{serial number: device} of every serial number given, None for the ones not connected, with one listing at most"
+        if self.changed() or any(sn not in self.by_serial_number for sn in serial_numbers):
+            self.get_serial_ports()
+        return {sn: getattr(self.by_serial_number.get(sn), "device", None) for sn in serial_numbers}
+
+    @classmethod
+    def get_description_by_device(cls, device: str):
+        return getattr(cls.shared().find(device=device), "description", None)
+
+    @classmethod
+    def get_device_by_description(cls, description: str):
+        return getattr(cls.shared().find(description=description), "device", None)
+
+    @classmethod
+    def get_device_by_serial_number(cls, serial_number: str):
+        return getattr(cls.shared().find(serial_number=serial_number), "device", None)
 
 
 class Object:
@@ -58,9 +153,12 @@ class Object:
         self.manufacturer = data.get("manufacturer")
         self.serial_number = data.get("serial_number")
 
+    def __repr__(self):
+        return f"{self.device} ({self.description}, serial {self.serial_number})"
+
 
 if __name__ == "__main__":
-    for port in SerialPorts.get_serial_ports().ports_list:
+    for port in SerialPorts.shared().get_serial_ports().ports_list:
         print(port.device)
         print(port.description)
 
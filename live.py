@@ -0,0 +1,272 @@
+# Live data feed
+# a running scan publishes every spectrum (with its angle, timestamp and the motor status) on a local
+# TCP or Unix socket, anyone can subscribe to watch it. Publishing never waits on a subscriber: each one
+# has a small queue and a sender thread of its own, when a subscriber falls behind its queue fills and
+# new messages are dropped for it (and counted) while the scan carries on.
+#
+# address - "tcp://host:port" or a path for a Unix socket
+#
+# message: header struct MAGIC, kind, json length, payload length, then the JSON, then the payload bytes,
+#          the payload is one numpy array whose dtype and shape are in the JSON
+# kinds: START (wavelengths, background, planned angles), POINT (one spectrum), END
+#
+#   sub = live.Subscriber("tcp://127.0.0.1:5555")
+#   cube = live.ScanCube()
+#   for kind, meta, array in sub:
+#       cube.update(kind, meta, array)
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b"PDLV"
+HEADER = struct.Struct("<4sBII")
+START, POINT, END = 0, 1, 2
+
+
+def parse_address(address):
+    "(family, bind/connect address) of a 'tcp://host:port' or Unix socket path address"
+    if address.startswith("tcp://"):
+        host, port = address[len("tcp://") :].rsplit(":", 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+def encode(kind, meta, array=None):
+    "one message as bytes"
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        meta = dict(meta, dtype=array.dtype.str, shape=list(array.shape))
+        payload = array.tobytes()
+    else:
+        payload = b""
+    text = json.dumps(meta).encode()
+    return HEADER.pack(MAGIC, kind, len(text), len(payload)) + text + payload
+
+
+def _read_exactly(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise EOFError("publisher closed the connection")
+        buf += chunk
+    return bytes(buf)
+
+
+def read_message(sock):
+    "(kind, meta, array or None) of the next message on sock"
+    magic, kind, n_text, n_payload = HEADER.unpack(_read_exactly(sock, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("not a live scan feed")
+    meta = json.loads(_read_exactly(sock, n_text))
+    array = None
+    if n_payload:
+        array = np.frombuffer(_read_exactly(sock, n_payload), dtype=meta["dtype"]).reshape(meta["shape"])
+    return kind, meta, array
+
+
+class _Client:
+    "one subscriber, its own bounded queue and sender thread"
+
+    def __init__(self, sock, maxsize):
+        self.sock = sock
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.alive = True
+        self._thread = threading.Thread(target=self._run, name="live-sender", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            try:
+                self.sock.sendall(message)
+            except OSError:
+                break
+        self.alive = False
+        self.sock.close()
+
+    def offer(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # make room for the stop so closing never blocks either
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                break
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class Publisher:
+    """
+    serves the feed on address, publish() hands a message to every subscriber without blocking
+    maxsize - messages queued per subscriber before new ones are dropped for it
+    """
+
+    def __init__(self, address, maxsize=32):
+        self.address = address
+        self.maxsize = maxsize
+        self._clients = []
+        self._start = None  # START message, sent to subscribers that join late
+        self._lock = threading.Lock()
+        family, where = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(where):
+            os.remove(where)
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(where)
+        self._server.listen()
+        self._thread = threading.Thread(target=self._accept, name="live-accept", daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return  # server socket closed
+            client = _Client(sock, self.maxsize)
+            with self._lock:
+                if self._start is not None:
+                    client.offer(self._start)
+                self._clients.append(client)
+
+    @property
+    def dropped(self):
+        "messages dropped for each current subscriber"
+        with self._lock:
+            return [client.dropped for client in self._clients]
+
+    def publish(self, kind, meta, array=None):
+        "queues a message for every subscriber, returns straight away"
+        message = encode(kind, meta, array)
+        with self._lock:
+            if kind == START:
+                self._start = message
+            self._clients = [client for client in self._clients if client.alive]
+            for client in self._clients:
+                client.offer(message)
+
+    def close(self):
+        self.publish(END, {})
+        self._server.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+        if self._server.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class PublisherSink:
+    """
+    scan sink that publishes every point, put it on the ScanWriter next to the output sink
+    status - funct returning a dict of device status (position, flags...) to send with every point, optional
+    """
+
+    def __init__(self, publisher, status=None):
+        self.publisher = publisher
+        self.status = status
+
+    def open(self, pol_pos_d, wavelengths, background):
+        self.publisher.publish(
+            START,
+            {"angles": np.asarray(pol_pos_d, dtype=float).tolist()},
+            np.array([wavelengths, background], dtype="<f8"),
+        )
+
+    def write_point(self, index, angle, intensity, **info):
+        meta = {"index": int(index), "angle": float(angle)}
+        meta.update({k: float(v) for k, v in info.items() if np.ndim(v) == 0})
+        if self.status is not None:
+            meta["status"] = {k: v.item() if isinstance(v, np.generic) else v for k, v in self.status().items()}
+        self.publisher.publish(POINT, meta, np.asarray(intensity, dtype="<f4"))
+
+    def close(self):
+        self.publisher.close()
+
+
+class Subscriber:
+    "connects to a feed, iterate over it for (kind, meta, array) until the scan ends"
+
+    def __init__(self, address, timeout=None):
+        family, where = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(where)
+
+    def __iter__(self):
+        while True:
+            try:
+                kind, meta, array = read_message(self.sock)
+            except EOFError:
+                return
+            yield kind, meta, array
+            if kind == END:
+                return
+
+    def close(self):
+        self.sock.close()
+
+
+class ScanCube:
+    """
+    rebuilds the scan on the receiving side: wavelengths, background, and an angles x pixels cube
+    with NaN rows for points not received (yet, or dropped), growing for scans without planned angles
+    """
+
+    def __init__(self):
+        self.wavelengths = None
+        self.background = None
+        self.angles = np.array([])
+        self.cube = None
+        self.points = {}  # index -> meta of every point received
+        self.finished = False
+
+    def update(self, kind, meta, array):
+        if kind == START:
+            self.wavelengths, self.background = np.array(array[0]), np.array(array[1])
+            self.angles = np.array(meta["angles"])
+            self.cube = np.full((len(self.angles), len(self.wavelengths)), np.nan, dtype=np.float32)
+        elif kind == POINT and self.cube is not None:
+            index = meta["index"]
+            if index >= len(self.cube):
+                # double rather than grow one row at a time
+                grown = np.full((max(2 * len(self.cube), index + 1), self.cube.shape[1]), np.nan, dtype=np.float32)
+                grown[: len(self.cube)] = self.cube
+                self.cube = grown
+                self.angles = np.concatenate([self.angles, np.full(len(grown) - len(self.angles), np.nan)])
+            self.cube[index] = array
+            self.angles[index] = meta["angle"]
+            self.points[index] = meta
+        elif kind == END:
+            self.finished = True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="watch a running scan's live feed")
+    parser.add_argument("address", help="tcp://host:port or Unix socket path the scan publishes on (main.py --publish)")
+    args = parser.parse_args()
+    cube = ScanCube()
+    for kind, meta, array in Subscriber(args.address):
+        cube.update(kind, meta, array)
+        if kind == POINT:
+            print(f"point {meta['index']}: {meta['angle']:.2f} deg, peak {np.max(array):.0f} counts")
+    print(len(cube.points), "points received")
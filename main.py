@@ -3,18 +3,28 @@
 # moving motorized thorlabs waveplate while also collecting spectra
 import argparse
 import atexit
+import cProfile
 import logging
 import os
 import time
 from types import NoneType
 
 import numpy as np
-import thorlabs_apt_device as apt
-from pylablib.devices import Thorlabs as tl
 
-import angles
-import list_serial
-import oceanOpticSpectrosco as spectro
+import adaptive
+import backgrounds
+import drivers
+import exposure
+import fit
+import flyscan
+import journal
+import live
+import planner
+import readiness
+import roi
+import scan
+import scanfile
+import timing
 import utility
 
 # Set the logging level to DEBUG, comment out if you want to suppress console spam
@@ -31,7 +41,7 @@ class LoadFromFile(argparse.Action):
         # print(vars(data).items())
         for k, v in vars(data).items():
             # set arguments in the target namespace if they haven’t been set yet
-            if getattr(namespace, k, None) is None:
+            if getattr(namespace, k, None) in (None, parser.get_default(k)):
                 setattr(namespace, k, v)
 
 
@@ -47,7 +57,7 @@ parser.add_argument(
 parser.add_argument(
     "--initial_angle",
     type=float,
-    help="inital motor angle (degrees), background data taken at this position, must be in [0,360]",
+    help="inital motor angle (degrees), must be in [0,360]",
 )
 parser.add_argument(
     "--final_angle",
@@ -60,7 +70,9 @@ parser.add_argument(
     help="angular distance traveled between each spectrograph measurement (degrees)",
 )
 parser.add_argument(
-    "--wait", type=float, help="dwell time between polarization changes"
+    "--wait",
+    type=float,
+    help="longest time (sec) to wait for the polarizer to settle after each move",
 )
 parser.add_argument(
     "--spectrometer_serial",
@@ -82,107 +94,694 @@ parser.add_argument(
     type=str,
     help="file name that data will saved under",
 )
+parser.add_argument(
+    "--format",
+    choices=["tsv", "scan"],
+    default="tsv",
+    help="tsv text file, or binary scan file (see scanfile.py)",
+)
+parser.add_argument(
+    "--dtype",
+    choices=scanfile.DTYPES,
+    default="float32",
+    help="how spectra are stored in a scan file, uint16 for raw counts",
+)
+parser.add_argument(
+    "--compression",
+    choices=["zlib"],
+    default=None,
+    help="lossless compression of every spectrum in a scan file",
+)
+parser.add_argument(
+    "--order",
+    choices=["shortest", "sequential"],
+    default="shortest",
+    help="visit the angles in the order that takes the least travel from where the stage is, or strictly in sequence",
+)
+parser.add_argument(
+    "--wrap",
+    action="store_true",
+    help="the mount can turn past 360, so angles may be reached going either way round",
+)
+parser.add_argument(
+    "--fly",
+    action="store_true",
+    help="fly scan: rotate continuously from initial to final angle at --velocity while acquiring back to back",
+)
+parser.add_argument(
+    "--velocity",
+    type=float,
+    default=2.0,
+    help="rotation speed (deg/s) of a fly scan",
+)
+parser.add_argument(
+    "--buffer",
+    type=int,
+    default=0,
+    help="spectra to hold in the spectrometer's on-board buffer during a fly scan, read out in batches "
+    "(0 reads them one at a time, as does a spectrometer whose buffer can't be read in bulk, e.g. over seabreeze)",
+)
+parser.add_argument(
+    "--trigger",
+    type=str,
+    default=None,
+    help="spectrometer trigger mode: normal, software, level, sync, edge or the device's own number for it "
+    "(oceanOpticSpectrosco.TRIGGER_MODES), left as it is if not given or if the spectrometer lacks it",
+)
+parser.add_argument(
+    "--adaptive",
+    action="store_true",
+    help="adaptive scan: start on the --step grid and add angles where the polar response needs them",
+)
+parser.add_argument(
+    "--budget",
+    type=int,
+    default=100,
+    help="most angles an adaptive scan may take, the coarse grid included",
+)
+parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=0.01,
+    help="an adaptive scan stops once the fit error left is below this fraction of the response's range",
+)
+parser.add_argument(
+    "--harmonics",
+    type=int,
+    default=4,
+    help="order of the Fourier series an adaptive scan fits to the integrated intensity",
+)
+parser.add_argument(
+    "--frames",
+    type=int,
+    default=1,
+    help="spectra averaged at every angle, the standard error of every pixel is saved with the mean",
+)
+parser.add_argument(
+    "--device_average",
+    type=int,
+    default=1,
+    help="spectra the spectrometer averages itself per readout, where it can (scans_to_average)",
+)
+parser.add_argument(
+    "--auto_exposure",
+    action="store_true",
+    help="pick the integration time from a probe and adjust it at every angle, --spectrometer_integration_time is the starting point",
+)
+parser.add_argument(
+    "--target_fraction",
+    type=float,
+    default=0.7,
+    help="fraction of full scale auto exposure aims the brightest pixel at",
+)
+parser.add_argument(
+    "--min_integration_time",
+    type=float,
+    default=1.0,
+    help="shortest integration time (msec) auto exposure may use",
+)
+parser.add_argument(
+    "--max_integration_time",
+    type=float,
+    default=10000.0,
+    help="longest integration time (msec) auto exposure may use",
+)
+parser.add_argument(
+    "--roi",
+    type=str,
+    default=None,
+    help="wavelength windows (nm) to keep, e.g. 395-415 or 395-415,430-440, each gets an integrated intensity per point",
+)
+parser.add_argument(
+    "--binning",
+    type=int,
+    default=1,
+    help="pixels summed into one bin within the --roi windows",
+)
+parser.add_argument(
+    "--store",
+    choices=["reduced", "full"],
+    default="reduced",
+    help="with --roi, save only the binned windows or still the full spectra",
+)
+parser.add_argument(
+    "--fit",
+    action="store_true",
+    help="keep a cos/sin fit of every pixel against angle up to date during the scan, saved as fname.fit.tsv",
+)
+parser.add_argument(
+    "--fit_harmonics",
+    type=str,
+    default="2,4",
+    help="the n of the cos(n theta), sin(n theta) terms of --fit",
+)
+parser.add_argument(
+    "--fit_tolerance",
+    type=float,
+    default=None,
+    help="end a step scan early once the --fit coefficients change by less than this (relative) a few points in a row",
+)
+parser.add_argument(
+    "--publish",
+    type=str,
+    default=None,
+    help="serve a live feed of the scan on this tcp://host:port or Unix socket path, watch it with python live.py ADDRESS",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="continue a step scan that stopped early from its journal (fname.journal), the scan settings come from the journal",
+)
+parser.add_argument(
+    "--simulate",
+    action="store_true",
+    help="run against simulated motor and spectrometer (simulate.py), no hardware needed",
+)
+parser.add_argument(
+    "--position_policy",
+    choices=utility.POSITION_POLICIES,
+    default="retry",
+    help="when the stage doesn't settle where it was sent: ask for a fresh status and move again (retry, then give up), "
+    "do that and keep the point wherever it ends up (accept), or end the scan at once (abort)",
+)
+parser.add_argument(
+    "--position_retries",
+    type=int,
+    default=2,
+    help="corrective moves --position_policy retry/accept may make at one point",
+)
+parser.add_argument(
+    "--background_frames",
+    type=int,
+    default=1,
+    help="spectra averaged into the background",
+)
+parser.add_argument(
+    "--reuse_background",
+    action="store_true",
+    help="use a background taken with the same spectrometer, integration time, ROI and temperature within --background_max_age instead of taking one",
+)
+parser.add_argument(
+    "--background_library",
+    type=str,
+    default=backgrounds.DEFAULT_LIBRARY,
+    help="directory the backgrounds for --reuse_background are kept in",
+)
+parser.add_argument(
+    "--background_max_age",
+    type=float,
+    default=3600.0,
+    help="oldest background (sec) --reuse_background will use",
+)
+parser.add_argument(
+    "--background_refresh",
+    type=float,
+    default=None,
+    help="take a new background every this many seconds of a step scan (asks for the beam to be blocked), "
+    "the ROI signals use the background interpolated to each point's time, all of them go to fname.backgrounds.npz",
+)
+parser.add_argument(
+    "--timing",
+    action="store_true",
+    help="time every phase (move, settle, acquire, write...) of every point, report in fname.timing.json and .csv",
+)
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="run the scan under cProfile and save the stats to fname.prof",
+)
+parser.add_argument(
+    "--motor_driver",
+    default="tdc001",
+    choices=drivers.names("motor"),
+    help="motor controller backend (drivers.py), only its package gets imported",
+)
+parser.add_argument(
+    "--spectrometer_driver",
+    default="ocean",
+    choices=drivers.names("spectrometer"),
+    help="spectrometer backend (drivers.py), only its package gets imported",
+)
+
+
+def connect_motor(args):
+    "finds the motor's serial port (unless simulating) and connects to it, homing it if it needs homing"
+    # currently this only works for TDC001 connected to a PRM1Z8 any other devices will have to be added in future
+    driver = "simulated" if args.simulate else args.motor_driver
+    if driver == "simulated":
+        connection_class = drivers.load("motor", driver)
+        return utility.AptMotor(port="simulated", connection_class=connection_class, serial=args.motor_serial)
+    # the hardware packages are only imported when there is hardware to talk to
+    import list_serial
+
+    try:
+        ports = list_serial.SerialPorts.shared()
+        port = ports.find(serial_number=args.motor_serial)
+        print("Connected serial devices: ")
+        print(ports.ports_list)
+    except:
+        raise Exception("Can't list devices")
+    if port is None:
+        raise Exception("No motor is connected")
+    motor_port = port.device
+    print(motor_port)
+    return utility.AptMotor(
+        port=motor_port, connection_class=drivers.load("motor", driver), serial=args.motor_serial
+    )
+
+
+def connect_spectrometer(args, motor):
+    "connects to the spectrometer (a simulated one seeing motor's angle with --simulate)"
+    driver = "simulated" if args.simulate else args.spectrometer_driver
+    try:
+        spectrometer_class = drivers.load("spectrometer", driver)
+        if driver == "simulated":
+            return spectrometer_class(
+                args.spectrometer_serial,
+                angle_source=lambda: motor.stage.to_d(motor.connection.status["position"]),
+            )
+        return spectrometer_class(args.spectrometer_serial)
+    except:
+        raise Exception("cannot make connection to spectrograph, program ending")
+
 
-args = parser.parse_args()
-for arg in vars(args):
-    if type(arg) == NoneType:
-        raise Exception("The inputs for the program are not all specified.")
-
-# open the output file, will not overwrite!
-try:
-    os.makedirs(os.path.dirname(args.path + args.fname), exist_ok=True)
-    f = open(args.path + args.fname, "w")
-    atexit.register(f.close)
-except FileExistsError:
-    raise Exception("The selected file name already exists!")
-
-f.write("File was created at:" + time.asctime() + "\n")
-f.write("Polarizer angles [deg]:\n")
-
-# desired polarizer positions [degrees]
-pol_pos_d = np.arange(args.initial_angle, (args.final_angle + args.step), args.step)
-
-# currently this only works for TDC001 connected to a PRM1Z8 any other devices will have to be added in future
-
-try:
-    print("Connected serial devices: ")
-    ports = list_serial.SerialPorts()
-    ports.get_serial_ports()
-    print(ports.ports_list)
-    for port in ports.ports_list:
-
-        if port.serial_number == args.motor_serial:
-            motor_port: str = port.device
-            print(motor_port)
-except:
-    raise Exception("Can't list devices")
-
-# Check if motor_port is defined
-try:
-    motor_port
-except:
-    raise Exception("No motor is connected")
-
-# now connect to the machines
-# connect to motor first as 'intial_pos' will be the polarization taken for background data
-motor = utility.AptMotor(port=motor_port)
-
-print("time to collect background!")
-# now move motor to initial angle and generate background
-# once background is generated, create array so the rest of the data can be easily stored
-motor.connection.move_absolute(angles.from_d(pol_pos_d[0]))
-time.sleep(3)
-# connect to spectrograph and set integration time
-try:
-    spectrum = spectro.ocean(args.spectrometer_serial)
-    atexit.register(spectrum.close)
-except:
-    raise Exception("cannot make connection to spectrograph, program ending")
-# this is just what the original dscan does, not sure why tho
-try:
-    spectrum.setinttime(args.spectrometer_integration_time)
-except:
-    print("except")
-    spectrum.setinttime(args.spectrometer_integration_time)
-time.sleep(2.0)
-
-input("press enter to capture background")
-# spectrum.getspec() - 2xN list, float - 1st row is N wavelengths [nm], 2nd is intensity [counts]
-background = spectrum.getspec()
-
-f.write("Wavelengths (nm)\n")
-wavelengths = background[0]
-np.savetxt(f, wavelengths)
-f.write("Background (counts)\n")
-np.savetxt(f, background[1])
-
-# now to collect the rest of the data
-input("Press enter to begin collecting data...")
-for i in range(len(pol_pos_d)):
-    # check connection every time
-    mtr_connection = utility.is_mtr_connected(motor)
-    if mtr_connection:
-        motor.move_absolute(pol_pos_d[i])
-        print("moving to", pol_pos_d[i], "deg")
-        time.sleep(5.0)
-        # check that polarizer angle isn't drifting
-        drift = not np.isclose(
-            pol_pos_d[i], utility.to_d(motor.status["position"]), atol=0.2
+def conflicts(args, interactive=True):
+    "the first reason the options in args can't run together (None if they can), interactive as for run"
+    if args.fly and args.adaptive:
+        return "--fly and --adaptive are different kinds of scan, pick one"
+    if args.resume and (args.fly or args.adaptive):
+        return "only step scans can be resumed"
+    if args.fly and args.auto_exposure:
+        return "a fly scan keeps one integration time, --auto_exposure only works for step scans"
+    if args.background_refresh and (args.fly or args.adaptive):
+        return "--background_refresh only works for step scans"
+    if not interactive and args.background_refresh:
+        return "--background_refresh needs someone to block the beam, it can't run unattended"
+    if not interactive and not args.reuse_background:
+        return "nobody is there to block the beam for a background, an unattended scan needs --reuse_background"
+    return None
+
+
+def background_key(args, spectrum, temperature=None):
+    "backgrounds.key of the background a scan with args on spectrum uses"
+    return backgrounds.key(
+        args.spectrometer_serial,
+        args.spectrometer_integration_time if spectrum is None else spectrum.inttime,
+        f"{args.roi}/{args.binning}" if args.roi else None,
+        temperature,
+    )
+
+
+def run(args, motor=None, spectrum=None, interactive=True):
+    """
+    runs one scan with the settings in args (from parser)
+    motor, spectrum - already connected utility.AptMotor and spectrometer to use, connected here if not given
+    interactive - wait for enter before the background and before the scan, off for queued jobs (daemon.py),
+                  which never take a background themselves and so need one in the background library
+    with --timing the time of every phase of every point goes to fname.timing.json/.csv (timing.py),
+    with --profile the scan (this thread) runs under cProfile and the stats go to fname.prof
+    """
+    output = args.path + args.fname
+    profiler = None
+    if args.timing:
+        recorder = timing.enable()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        _run(args, motor, spectrum, interactive)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(output + ".prof")
+            print("profile written to", output + ".prof", "(python -m pstats to read it)")
+        if args.timing:
+            timing.disable()
+            timing.print_summary(recorder.save(output + ".timing"))
+
+
+def _run(args, motor, spectrum, interactive):
+    # a step scan keeps a journal next to its output so it can be resumed if anything stops it
+    journal_file = journal.journal_path(args.path + args.fname)
+    if args.resume:
+        try:
+            scan_journal = journal.Journal.open(journal_file)
+        except FileNotFoundError:
+            raise Exception("There is no journal to resume from at " + journal_file)
+        # everything that defines the scan comes from the journal, only how to run it can change
+        for k, v in scan_journal.header["args"].items():
+            if k not in (
+                "resume",
+                "simulate",
+                "wait",
+                "timing",
+                "profile",
+                "reuse_background",
+                "background_refresh",
+            ):
+                setattr(args, k, v)
+        print(len(scan_journal.points), "points already in the journal")
+    reason = conflicts(args, interactive)
+    if reason is not None:
+        parser.error(reason)
+    for arg in vars(args):
+        if type(arg) == NoneType:
+            raise Exception("The inputs for the program are not all specified.")
+
+    # open the output file, will not overwrite!
+    # (unless resuming, then it is written again from the journal, but only once the journal is known to fit
+    # this spectrometer, a refused resume leaves the data it was meant to continue as it was)
+    # a scan file needs the wavelengths so it is only created once the background is in
+    try:
+        os.makedirs(os.path.dirname(args.path + args.fname), exist_ok=True)
+        if args.resume:
+            pass
+        elif args.format == "tsv":
+            f = open(args.path + args.fname, "x")
+            atexit.register(f.close)
+        elif os.path.exists(args.path + args.fname):
+            raise FileExistsError
+    except FileExistsError:
+        raise Exception("The selected file name already exists!")
+
+    # desired polarizer positions [degrees]
+    pol_pos_d = np.arange(args.initial_angle, (args.final_angle + args.step), args.step)
+
+    if args.resume:
+        # where the stage was left, so if the controller still holds its home and position re-homing is skipped
+        pol_pos_d = scan_journal.header["pol_pos_d"]
+        done = [k for k, i in enumerate(scan_journal.header["order"]) if int(i) in scan_journal.points]
+        if done:
+            readiness.remember(args.motor_serial, True, scan_journal.header["positions"][max(done)])
+        todo = np.array(scan_journal.missing(len(pol_pos_d)), dtype=int)
+    else:
+        todo = np.arange(len(pol_pos_d))
+
+    # now connect to the machines
+    # connect to motor first as 'intial_pos' will be the polarization taken for background data
+    if motor is None:
+        motor = connect_motor(args)
+
+    # plan the order to visit the angles (still to take) in from wherever the stage is now
+    # data is still written in angle order
+    here = motor.stage.to_d(motor.connection.status["position"])
+    if len(todo) == 0:
+        order, positions = todo, pol_pos_d[:1]
+    elif args.order == "shortest":
+        sub_order, positions = planner.plan_order(
+            pol_pos_d[todo], here, wrap=args.wrap, velocity=motor.velocity, acceleration=motor.acceleration
         )
-        if drift:
-            raise Exception(
-                "polarizer has drifted from desired values, ending collection"
+        order = todo[sub_order]
+    else:
+        order, positions = todo, pol_pos_d[todo]
+    if args.fly:
+        positions = [args.initial_angle]
+
+    print("time to collect background!")
+    # now move motor to the first angle of the scan and generate background
+    # once background is generated, create array so the rest of the data can be easily stored
+    motor.connection.move_absolute(motor.stage.from_d(positions[0]))
+    # --wait is for the short steps between points, the first move can be half way round
+    motor.wait_until_settled(
+        positions[0],
+        timeout=planner.move_timeout(positions[0] - here, motor.velocity, motor.acceleration, wait=args.wait),
+    )
+    # connect to spectrograph and set integration time
+    if spectrum is None:
+        spectrum = connect_spectrometer(args, motor)
+        atexit.register(spectrum.close)
+    # the first command after connecting sometimes fails, so this tries once more (as the original dscan does)
+    try:
+        spectrum.setinttime(args.spectrometer_integration_time)
+    except:
+        print("setting the integration time failed, trying again")
+        spectrum.setinttime(args.spectrometer_integration_time)
+    if args.trigger is not None and not spectrum.set_trigger_mode(args.trigger):
+        print("keeping the spectrometer's own trigger mode")
+    if args.device_average > 1 and not spectrum.set_scans_to_average(args.device_average):
+        print("spectrometer can't average on the device, averaging", args.device_average, "more frames here instead")
+        args.frames *= args.device_average
+        args.device_average = 1
+    time.sleep(2.0)
+
+    # a background taken with the same settings not long ago is used again rather than asking for a new one
+    library = cached = None
+    if args.reuse_background:
+        library = backgrounds.BackgroundLibrary(args.background_library, max_age=args.background_max_age)
+        key = background_key(args, spectrum, backgrounds.temperature(spectrum))
+        cached = library.get(key)
+    if cached is None and not interactive:
+        # the beam is lit, a background taken now would be the signal
+        raise Exception("there is no cached background for these settings and nobody to block the beam for one")
+    if cached is not None:
+        print("using the background taken", round(time.time() - cached["taken"]), "s ago")
+        background = np.array([cached["wavelengths"], cached["counts"]])
+    else:
+        if interactive:
+            input("press enter to capture background")
+        # spectrum.getspec() - 2xN list, float - 1st row is N wavelengths [nm], 2nd is intensity [counts]
+        t0 = timing.clock()
+        background, background_stderr = backgrounds.take(spectrum, args.background_frames)
+        timing.record("background", t0)
+        if library is not None:
+            library.put(key, background[0], background[1], background_stderr, args.background_frames)
+
+    wavelengths = background[0]
+    if args.resume:
+        # the points already taken are only good if the spectrometer and the background are the same as before
+        if len(wavelengths) != len(scan_journal.header["wavelengths"]) or not np.allclose(
+            wavelengths, scan_journal.header["wavelengths"]
+        ):
+            raise Exception("spectrograph wavelength axis differs from the journal's, can't resume")
+        if not journal.background_compatible(
+            scan_journal.header["background"],
+            background[1],
+            scan_journal.header["device"]["integration_time_ms"],
+            spectrum.inttime,
+        ):
+            raise Exception("background differs from the journal's, can't resume")
+        # the output keeps the background the journaled points were taken against
+        background = np.array([wavelengths, scan_journal.header["background"]])
+    elif not args.fly and not args.adaptive:
+        scan_journal = journal.Journal.create(
+            journal_file,
+            wavelengths,
+            background[1],
+            args={k: v for k, v in vars(args).items() if k != "config_file"},
+            pol_pos_d=pol_pos_d,
+            order=order,
+            positions=positions,
+            device={
+                "motor_serial": args.motor_serial,
+                "motor_position": here,
+                "velocity": motor.velocity,
+                "acceleration": motor.acceleration,
+                "spectrometer_serial": args.spectrometer_serial,
+                "integration_time_ms": spectrum.inttime,
+                "scans_to_average": getattr(spectrum, "scans_to_average", 1),
+                "time": time.time(),
+            },
+        )
+    # a fly or adaptive scan does not know its angles until the scan has run
+    if args.fly:
+        # spectra from the on-board buffer come back to back, with no readout gap between them
+        n_rows = flyscan.expected_points(
+            args.initial_angle,
+            args.final_angle,
+            args.velocity,
+            args.spectrometer_integration_time,
+            readout=0.0 if args.buffer > 0 else 0.005,
+        )
+        planned = np.array([])
+        columns = ("angle", "timestamp", "t_start", "t_end", "angle_start", "angle_end", "window")
+    elif args.adaptive:
+        n_rows = max(args.budget, len(pol_pos_d))
+        planned = np.array([])
+        columns = ("angle", "timestamp", "actual_angle")
+    else:
+        n_rows = len(pol_pos_d)
+        planned = pol_pos_d
+        columns = ("angle", "timestamp", "actual_angle")
+    if args.auto_exposure:
+        columns = columns + ("integration_time_ms",)
+    # regions of interest are cut out (and integrated) on the writer thread as every spectrum comes in
+    region = None
+    stored_wavelengths, stored_background = wavelengths, background[1]
+    if args.roi:
+        region = roi.Roi(
+            wavelengths,
+            roi.parse_windows(args.roi),
+            args.binning,
+            background=background[1],
+            background_inttime=args.spectrometer_integration_time,
+            keep_full=args.store == "full",
+        )
+        columns = columns + region.columns
+        if args.store == "reduced":
+            stored_wavelengths, stored_background = region.wavelengths, region.reduce(background[1])
+    datasets = ("counts", "stderr") if args.frames > 1 and not args.fly else ("counts",)
+    if args.format == "tsv":
+        if args.resume:
+            # the journal matched, the .tsv is rewritten from it
+            f = open(args.path + args.fname, "w")
+            atexit.register(f.close)
+        # every point carries the angle the stage actually settled at, so the '# point' lines always go in
+        sink = scan.TsvSink(f, point_info=True, background_inttime=args.spectrometer_integration_time)
+    else:
+        sink = scan.ScanFileSink(
+            scanfile.ScanFile.create(
+                args.path + args.fname,
+                stored_wavelengths,
+                n_rows=n_rows,
+                background=stored_background,
+                angles=planned if len(planned) else None,
+                dtype=args.dtype,
+                compression=args.compression,
+                columns=columns,
+                datasets=datasets,
+                metadata={
+                    "integration_time_ms": args.spectrometer_integration_time,
+                    "background_integration_time_ms": args.spectrometer_integration_time,
+                    "auto_exposure_target": args.target_fraction if args.auto_exposure else None,
+                    "motor_serial": args.motor_serial,
+                    "spectrometer_serial": args.spectrometer_serial,
+                    "fly_velocity": args.velocity if args.fly else None,
+                    "trigger_mode": spectrum.trigger,
+                    "adaptive_budget": args.budget if args.adaptive else None,
+                    "frames": args.frames,
+                    "device_average": args.device_average,
+                    "roi": region.windows if region is not None else None,
+                    "binning": args.binning if region is not None else None,
+                    "stored": args.store if region is not None else "full",
+                },
+                overwrite=args.resume,
+            )
+        )
+    sink.open(planned, stored_wavelengths, stored_background)
+    if args.resume:
+        scan_journal.replay(sink)
+    publisher = None
+    if args.publish:
+        # the motor status that goes out with every point, read on the writer thread
+        def motor_status():
+            status = motor.connection.status
+            return {
+                "position": motor.stage.to_d(status["position"]),
+                "homed": bool(status["homed"]),
+                "moving": bool(utility.is_mtr_moving(motor.connection)),
+                "integration_time_ms": spectrum.inttime,
+            }
+
+        publisher = live.PublisherSink(live.Publisher(args.publish), status=motor_status)
+        publisher.open(planned, stored_wavelengths, stored_background)
+        print("publishing the scan on", args.publish)
+
+    # now to collect the rest of the data
+    # checking and writing each spectrum happens on a background thread while the next move runs
+    if interactive:
+        input("Press enter to begin collecting data...")
+    auto_exposure = None
+    if args.auto_exposure:
+        auto_exposure = exposure.AutoExposure(
+            spectrum,
+            target=args.target_fraction,
+            bounds=(args.min_integration_time, args.max_integration_time),
+        )
+        print("auto exposure starting at", auto_exposure.probe(), "ms")
+    sinks = [sink]
+    fit_sink = None
+    if args.fit:
+        fit_sink = fit.FitSink(
+            args.path + args.fname + ".fit.tsv",
+            harmonics=[int(n) for n in args.fit_harmonics.split(",")],
+            per_ms=args.auto_exposure,
+            tol=args.fit_tolerance,
+        )
+        fit_sink.open(planned, stored_wavelengths, stored_background)
+        if args.resume:
+            scan_journal.replay(fit_sink)
+        sinks.append(fit_sink)
+    if not args.fly and not args.adaptive:
+        # the journal goes first, a point is on disk there before it is anywhere else
+        sinks.insert(0, journal.JournalSink(scan_journal))
+    if publisher is not None:
+        sinks.append(publisher)
+    # fresh backgrounds through a long step scan, the ROI signals use the one interpolated to each point's time
+    series = refresh = None
+    if args.background_refresh:
+        series = backgrounds.BackgroundSeries(time.time(), background[1], interval=args.background_refresh)
+        if region is not None:
+            region.series = series
+
+        def refresh():
+            if not series.due():
+                return
+            input("block the beam and press enter to take a new background")
+            t0 = timing.clock()
+            fresh, _ = backgrounds.take(spectrum, args.background_frames, inttime=args.spectrometer_integration_time)
+            timing.record("background", t0)
+            series.add(time.time(), fresh[1])
+            input("unblock the beam and press enter to carry on")
+
+    writer = scan.ScanWriter(sinks, wavelengths, reduce=region.ingest if region is not None else None)
+    if args.fly:
+        try:
+            n = flyscan.fly_scan(
+                motor, spectrum, args.initial_angle, args.final_angle, args.velocity, writer, buffer=args.buffer
             )
+        finally:
+            writer.close()
+        print(n, "spectra collected")
+    elif args.adaptive:
+        sampler = adaptive.AdaptiveSampler(
+            args.initial_angle,
+            args.final_angle,
+            args.step,
+            harmonics=args.harmonics,
+            budget=args.budget,
+            tol=args.tolerance,
+        )
+        n = adaptive.adaptive_scan(
+            motor,
+            spectrum,
+            sampler,
+            writer,
+            args.wait,
+            background[1],
+            frames=args.frames,
+            wrap=args.wrap,
+            auto_exposure=auto_exposure,
+            background_inttime=args.spectrometer_integration_time,
+            roi=region,
+            policy=args.position_policy,
+            retries=args.position_retries,
+        )
+        print(n, "angles collected")
     else:
-        raise Exception("Polarizer connection lost, ending collection")
-    print("collecting")
-    spectrometer_output = spectrum.getspec()
-    # check that wavelengths havent changed
-    if np.allclose(spectrometer_output[0], wavelengths) == False:
-        raise Exception(
-            "spectrograph is has collected different spectral range, ending collection"
+        scan.run_scan(
+            motor,
+            spectrum,
+            pol_pos_d,
+            writer,
+            args.wait,
+            order=order,
+            positions=positions,
+            frames=args.frames,
+            exposure=auto_exposure,
+            stop=fit_sink.converged if fit_sink is not None and args.fit_tolerance else None,
+            between=refresh,
+            policy=args.position_policy,
+            retries=args.position_retries,
         )
-    np.savetxt(f, spectrometer_output[1])
+        # the output has every point now, the journal is not needed anymore
+        os.remove(journal_file)
+        if series is not None:
+            series.save(args.path + args.fname + ".backgrounds.npz")
+
+    if args.format == "tsv":
+        f.close()
+    print("Data collection finished")
 
 
-print("Data collection finished")
+if __name__ == "__main__":
+    run(parser.parse_args())
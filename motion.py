@@ -0,0 +1,77 @@
+# Multi-axis motion coordinator
+# drives any number of polarizers at once: every controller gets its own worker thread, so moves
+# are commanded on all axes together, each axis waits for its own settle in parallel and the
+# coordinator returns once the slowest one is there. Status reads (connection, position) fan out
+# the same way. Calls to one controller always go through its own worker, one at a time.
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import utility
+
+
+class MotionCoordinator:
+    """
+    axes - list of motors with move_to(deg), wait_until_settled(deg, tol, timeout), position() and
+           is_connected(), e.g. utility.AptMotor and utility.KinesisMotor
+    """
+
+    def __init__(self, axes):
+        self.axes = list(axes)
+        self._workers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"axis-{n}") for n in range(len(self.axes))
+        ]
+
+    def __len__(self):
+        return len(self.axes)
+
+    def _all(self, call):
+        "runs call(axis) for every axis on its worker, returns the results in axis order, raises the first error"
+        return self._results([worker.submit(call, axis) for worker, axis in zip(self._workers, self.axes)])
+
+    def connected(self):
+        "is_connected() of every axis, read in parallel"
+        return self._all(lambda axis: axis.is_connected())
+
+    def positions(self):
+        "position [deg] of every axis, read in parallel"
+        return np.array(self._all(lambda axis: axis.position()))
+
+    def move_to(self, targets, tol=0.2, timeout=10.0, policy="abort", retries=2):
+        """
+        moves every axis to its target [deg] at the same time and waits for all of them to settle
+        raises TimeoutError if any axis doesn't settle within timeout [sec]
+        policy, retries - how an axis that isn't where it was sent is corrected (utility.settle_or_correct)
+        OUTPUT: settled positions [deg] of every axis
+        """
+        if len(targets) != len(self.axes):
+            raise ValueError(f"{len(targets)} targets for {len(self.axes)} axes")
+        futures = [
+            worker.submit(_move, axis, target, tol, timeout, policy, retries)
+            for worker, axis, target in zip(self._workers, self.axes, targets)
+        ]
+        return np.array(self._results(futures))
+
+    def _results(self, futures):
+        "results of futures in order, raises the first error only once all of them are done so no axis is left moving"
+        results, error = [], None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BaseException as err:
+                results.append(None)
+                if error is None:
+                    error = err
+        if error is not None:
+            raise error
+        return results
+
+    def close(self):
+        "stops the workers, the axes themselves are left to their owners to close"
+        for worker in self._workers:
+            worker.shutdown(wait=True)
+
+
+def _move(axis, target, tol, timeout, policy, retries):
+    axis.move_to(target)
+    return utility.settle_or_correct(axis, target, tol, timeout, policy, retries)
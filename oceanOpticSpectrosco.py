@@ -19,6 +19,12 @@ import time
 import seabreeze.spectrometers as sb  # library for OceanOptics
 import serial as s
 
+import timing
+
+# trigger modes by name, numbered as on the USB2000+/USB4000/Flame (HR4000 and others number them
+# differently, their own number can be given to ocean.set_trigger_mode instead)
+TRIGGER_MODES = {"normal": 0, "software": 1, "level": 2, "sync": 3, "edge": 4}
+
 
 class mono:  # create a monochromator class
     def comset(self, num):
@@ -169,23 +175,115 @@ class ocean:
 
         self.sernum = sernum
 
+        self.inttime = None  # [msec], set by setinttime
+
+        self.scans_to_average = 1  # spectra averaged on the device per getspec
+
+        t0 = timing.clock()
+
         self.spec = sb.Spectrometer.from_serial_number(sernum)
-        # self.spec.trigger_mode(0)
+
+        timing.record("connect", t0)
+
+        self.max_intensity = self.spec.max_intensity  # [counts], full scale
+
+        lo, hi = self.spec.integration_time_micros_limits
+
+        self.inttime_limits = (lo / 1000, hi / 1000)  # [msec]
+        self.trigger = None  # name of the trigger mode set by set_trigger_mode, None for the device default
+
+        self.buffered = False  # spectra never go through the on-board data buffer, see enable_buffer
         # sb.seabreeze.pyseabreeze.SeaBreezeThermoElectricFeature.enable_tec(True)
 
     def setinttime(self, num):
 
+        self.inttime = num  # [msec], kept so callers know how long each spectrum integrates
+
         num = num * 1000
 
+        t0 = timing.clock()
+
         self.spec.integration_time_micros(num)
 
+        timing.record("set_inttime", t0)
+
         return
 
+    def set_scans_to_average(self, num):
+
+        # only some spectrometers (and seabreeze backends) average on the device,
+        # returns False when this one can't so the caller averages itself
+        processing = getattr(self.spec.f, "spectrum_processing", None)
+
+        if processing is None:
+
+            return False
+
+        processing.set_scans_to_average(int(num))
+
+        self.scans_to_average = int(num)
+
+        return True
+
+    def set_trigger_mode(self, mode):
+
+        # mode is a name from TRIGGER_MODES or the device's own number for it,
+
+        # returns False (and leaves the trigger as it was) when the spectrometer doesn't have that mode
+
+        number = TRIGGER_MODES.get(mode, mode)
+
+        try:
+
+            self.spec.trigger_mode(int(number))
+
+        except Exception as err:
+
+            print("trigger mode", mode, "not available on", self.sernum, "-", err)
+
+            return False
+
+        self.trigger = mode
+
+        return True
+
+    def enable_buffer(self, capacity=1000):
+
+        # always False, so acquisition.open_reader falls back to reading spectra one at a time (SoftwareReader)
+
+        # seabreeze's data_buffer feature only sizes, counts and clears the on-board buffer, it has no bulk read,
+
+        # so the spectra in it could only come out one intensities() call (one USB transfer) each, which is no
+
+        # better than getspec back to back and leaves the buffer's own count and the reads to disagree
+
+        return False
+
+    def disable_buffer(self):
+
+        pass  # never enabled, see enable_buffer
+
     def getspec(self):
 
+        t0 = timing.clock()
+
         spectrum = self.spec.spectrum()
 
+        timing.record("readout", t0)
+
         return spectrum
 
+    def temperature(self):
+
+        # detector temperature [C] from the TEC, None for spectrometers without one
+
+        tec = getattr(self.spec.f, "thermo_electric", None)
+
+        if tec is None:
+
+            return None
+
+        return tec.read_temperature_degrees_celsius()
+
     def close(self):
         self.spec.close()
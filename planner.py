@@ -0,0 +1,160 @@
+# Scan planner
+# orders the points of a scan so the stage spends as little time travelling as possible,
+# starting from wherever the stage is now. For a rotation mount that can turn past 360 (wrap=True)
+# a point can be reached going either way round, 0 and 360 being the same place.
+# The plan only changes the order points are visited in, they are still indexed (and written)
+# in their canonical order.
+import numpy as np
+
+# PRM1Z8 defaults, same as utility.AptMotor [deg/s], [deg/s^2]
+VELOCITY = 10.0
+ACCELERATION = 10.0
+
+
+def move_time(distance, velocity=VELOCITY, acceleration=ACCELERATION, overhead=0.0):
+    """
+    time [sec] a trapezoidal move of distance [deg] takes, works on arrays too
+    overhead - float - extra time [sec] every move costs (settling, status checks)
+    """
+    d = np.abs(np.asarray(distance, dtype=float))
+    # distance covered speeding up to full velocity and back down again
+    d_ramp = velocity**2 / acceleration
+    t = np.where(
+        d < d_ramp,
+        2.0 * np.sqrt(d / acceleration),
+        2.0 * velocity / acceleration + (d - d_ramp) / velocity,
+    )
+    return t + np.where(d > 0.0, overhead, 0.0)
+
+
+def move_timeout(distance, velocity=VELOCITY, acceleration=ACCELERATION, wait=0.0, margin=2.0):
+    """
+    time [sec] to allow a move of distance [deg] before giving up on it,
+    margin times how long the move should take plus wait [sec] for it to settle
+    """
+    return float(margin * np.max(move_time(distance, velocity, acceleration)) + wait)
+
+
+def path_time(positions, current, velocity=VELOCITY, acceleration=ACCELERATION, overhead=0.0):
+    "total travel time [sec] visiting positions [deg] in order from current [deg]"
+    steps = np.diff(np.concatenate([[current], positions]))
+    return float(np.sum(move_time(steps, velocity, acceleration, overhead)))
+
+
+def _linear_plan(targets, current, cost):
+    "best of sweeping up from the bottom or down from the top, for stages that can't go round"
+    up = np.argsort(targets, kind="stable")
+    down = up[::-1]
+    best = min((up, down), key=lambda order: cost(targets[order]))
+    return best, targets[best]
+
+
+def plan_order(
+    targets,
+    current,
+    wrap=False,
+    period=360.0,
+    limits=None,
+    velocity=VELOCITY,
+    acceleration=ACCELERATION,
+    overhead=0.0,
+):
+    """
+    order to visit targets [deg] in, starting from current [deg], that takes the least travel time
+    wrap - bool - the stage can turn past period, so targets can be reached going either way round
+    period - float - [deg] after which positions repeat
+    limits - (lo, hi) [deg] commanded positions have to stay within, only used with wrap
+    velocity, acceleration, overhead - motion profile, see move_time
+    OUTPUT: (order, positions) - order is the indices into targets in visiting order,
+            positions the absolute positions [deg] to command for them (outside [0, period) when wrapping)
+    """
+    targets = np.asarray(targets, dtype=float)
+    if len(targets) == 0:
+        return np.array([], dtype=int), np.array([])
+
+    def cost(positions):
+        return path_time(positions, current, velocity, acceleration, overhead)
+
+    if not wrap:
+        return _linear_plan(targets, current, cost)
+
+    # how far round each target is going forward from current
+    ahead = np.mod(targets - current, period)
+    ccw = np.argsort(ahead, kind="stable")
+    ahead = ahead[ccw]
+    n = len(targets)
+    best = None
+    # the best tour goes one way to cover the first k targets, then turns round for the rest
+    for k in range(n + 1):
+        fwd_order, bck_order = ccw[:k], ccw[k:][::-1]
+        fwd_pos = current + ahead[:k]
+        bck_pos = current - (period - ahead[k:][::-1])
+        # a target exactly at current counts as reached going forward
+        bck_pos = np.where(ahead[k:][::-1] == 0.0, current, bck_pos)
+        for order, positions in (
+            (np.concatenate([fwd_order, bck_order]), np.concatenate([fwd_pos, bck_pos])),
+            (np.concatenate([bck_order[::-1], fwd_order[::-1]]), np.concatenate([bck_pos[::-1], fwd_pos[::-1]])),
+        ):
+            if limits is not None and (positions.min() < limits[0] or positions.max() > limits[1]):
+                continue
+            t = cost(positions)
+            if best is None or t < best[0]:
+                best = (t, order, positions)
+    if best is None:
+        # nothing fits in the limits going round, fall back to staying on this side
+        return _linear_plan(targets, current, cost)
+    return best[1], best[2]
+
+
+def serpentine(n_outer, n_inner, reverse_first=False):
+    """
+    boustrophedon order over an n_outer x n_inner grid, the inner axis changes direction every row
+    OUTPUT: list of (i_outer, j_inner) index pairs
+    """
+    pairs = []
+    for i in range(n_outer):
+        inner = range(n_inner)
+        if (i % 2 == 1) != reverse_first:
+            inner = reversed(inner)
+        pairs.extend((i, j) for j in inner)
+    return pairs
+
+
+def plan_grid(
+    outer,
+    inner,
+    current=(0.0, 0.0),
+    wrap=False,
+    period=360.0,
+    velocity=VELOCITY,
+    acceleration=ACCELERATION,
+    overhead=0.0,
+):
+    """
+    plan for a 2D grid of outer x inner targets [deg] on two axes that move at the same time
+    the outer axis is ordered with plan_order from where it is, the inner axis runs serpentine,
+    starting from whichever end of the inner targets is quicker to get to
+    OUTPUT: (pairs, positions) - pairs are (i_outer, j_inner) index pairs in visiting order,
+            positions an N x 2 array of the absolute positions [deg] to command for them
+    """
+    outer = np.asarray(outer, dtype=float)
+    inner = np.asarray(inner, dtype=float)
+    kw = dict(velocity=velocity, acceleration=acceleration, overhead=overhead)
+    outer_order, outer_pos = plan_order(outer, current[0], wrap=wrap, period=period, **kw)
+    inner_up = np.argsort(inner, kind="stable")
+    inner_pos = inner[inner_up]
+    reverse_first = move_time(inner_pos[-1] - current[1], velocity, acceleration) < move_time(
+        inner_pos[0] - current[1], velocity, acceleration
+    )
+    pairs = []
+    positions = []
+    for i, j in serpentine(len(outer), len(inner), reverse_first):
+        pairs.append((int(outer_order[i]), int(inner_up[j])))
+        positions.append((outer_pos[i], inner_pos[j]))
+    return pairs, np.array(positions)
+
+
+def grid_time(positions, current, velocity=VELOCITY, acceleration=ACCELERATION, overhead=0.0):
+    "total time [sec] for axes moving together through positions (N x axes), each step takes as long as its slowest axis"
+    steps = np.diff(np.vstack([np.asarray(current, dtype=float)[None, :], positions]), axis=0)
+    return float(np.sum(np.max(move_time(steps, velocity, acceleration, overhead), axis=1)))
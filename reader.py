@@ -0,0 +1,313 @@
+# Fast reader for the text files the scan scripts write
+# TsvReader - the .tsv main.py writes: creation time, angles, wavelengths, background, then one block per angle
+#             (a second column of standard errors when frames were averaged, '# point' lines with per-point info)
+# CsvReader - the .csv/.txt dual-pol_specscan.py writes: wavelengths, background and one column per angle
+#
+# The first read finds where every line starts with one vectorized pass over the memory-mapped file and caches
+# that byte-offset index (plus the small header arrays) next to the file as <file>.index.npz, so later opens are
+# instant and one angle or one wavelength slice is read by parsing just those bytes.
+# memmap() converts the spectra once, block by block, to an angles x pixels .npy that is opened memory-mapped,
+# for random access to files bigger than RAM.
+#
+#   r = reader.open("scan.tsv")
+#   r.angles, r.wavelengths, r.background
+#   r.read(10)             spectrum of the 11th angle
+#   r.pixels(400.0, 410.0) every angle, just the pixels between 400 and 410 nm
+#   r.memmap()[:, 512]     one pixel through the whole scan
+import builtins
+import mmap
+import os
+
+import numpy as np
+
+INDEX_VERSION = 3
+
+
+def _parse(chunk, n_columns=1):
+    "whitespace separated numbers in bytes -> rows x n_columns (or a flat array for one column)"
+    values = np.fromstring(chunk.decode("ascii"), sep=" ")
+    return values if n_columns == 1 else values.reshape(-1, n_columns)
+
+
+def _lines(buf):
+    "(starts, ends) byte offsets of every complete line of buf (a uint8 array), ends exclude the newline"
+    ends = np.flatnonzero(buf == ord("\n"))
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    return starts, ends.astype(np.int64)
+
+
+class _Reader:
+    "byte-offset index handling shared by the readers"
+
+    def __init__(self, path, cache=True):
+        self.path = path
+        self.index_path = path + ".index.npz"
+        stat = os.stat(path)
+        self._stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        self._f = builtins.open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        index = self._load_index() if cache else None
+        if index is None:
+            index = self._build_index()
+            if cache:
+                self._save_index(index)
+        self.index = index
+        self._setup(index)
+
+    def _load_index(self):
+        try:
+            with np.load(self.index_path) as data:
+                index = dict(data)
+        except (OSError, ValueError):
+            return None
+        if index.get("version") != INDEX_VERSION or not np.array_equal(index.get("stamp"), self._stamp):
+            return None  # the file changed (or grew) since the index was made
+        return index
+
+    def _save_index(self, index):
+        try:
+            np.savez(self.index_path, version=INDEX_VERSION, stamp=self._stamp, **index)
+        except OSError:
+            pass  # read only directory, the index just isn't cached
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.angles)
+
+    def memmap(self, path=None, dtype="float32"):
+        """
+        angles x pixels array of every spectrum, backed by a .npy file (path, <file>.npy by default)
+        made once, one angle at a time, so it never needs the whole scan in memory
+        """
+        if path is None:
+            path = self.path + ".npy"
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.path):
+            return np.load(path, mmap_mode="r")
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(len(self), len(self.wavelengths)))
+        for i in range(len(self)):
+            out[i] = self.read(i)
+        out.flush()
+        del out
+        return np.load(path, mmap_mode="r")
+
+
+class TsvReader(_Reader):
+    """
+    indexed reader for main.py's .tsv
+    angles [deg], wavelengths [nm], background [counts], created (str)
+    background_inttime - [msec] the background was taken over, None for files that don't say
+    info - {name: array} of the '# point' values (timestamp etc), empty if the file has none
+    has_stderr - the blocks have a second column with the standard error of every pixel
+    """
+
+    def _build_index(self):
+        buf = np.frombuffer(self._mm, dtype=np.uint8)
+        starts, ends = _lines(buf)
+
+        def line_of(text):
+            offset = self._mm.find(text)
+            if offset < 0:
+                raise ValueError(f"{self.path} is not a scan .tsv, it has no '{text.decode().strip()}' line")
+            return int(np.searchsorted(starts, offset))
+
+        i_ang = line_of(b"Polarizer angles [deg]:\n")
+        i_wvl = line_of(b"Wavelengths (nm)\n")
+        i_bkg = line_of(b"Background (counts)\n")
+        n_pixels = i_bkg - i_wvl - 1
+        created = bytes(self._mm[: ends[0]]).decode().split(":", 1)[1].strip()
+        # files from before the background integration time was written don't have the line
+        background_inttime = np.nan
+        k = self._mm.find(b"# background integration time [ms]:", 0, starts[i_ang])
+        if k >= 0:
+            background_inttime = float(bytes(self._mm[k : ends[np.searchsorted(starts, k)]]).decode().split(":")[1])
+        header_angles = _parse(self._mm[starts[i_ang + 1] : starts[i_wvl]]) if i_wvl > i_ang + 1 else np.array([])
+        wavelengths = _parse(self._mm[starts[i_wvl + 1] : starts[i_bkg]])
+        first = i_bkg + 1 + n_pixels
+        background = _parse(self._mm[starts[i_bkg + 1] : starts[first] if first < len(starts) else len(self._mm)])
+
+        body = np.arange(first, len(starts))
+        comment = buf[starts[body]] == ord("#")
+        data = body[~comment & (ends[body] > starts[body])]
+        n_blocks = len(data) // n_pixels
+        data = data[: n_blocks * n_pixels]
+        n_columns = len(bytes(self._mm[starts[data[0]] : ends[data[0]]]).split()) if n_blocks else 1
+
+        # '# point i: key=value ...' lines, in block order
+        points = [bytes(self._mm[starts[k] : ends[k]]).decode() for k in body[comment]]
+        points = [line for line in points if line.startswith("# point")][:n_blocks]
+        info = {}
+        for n, line in enumerate(points):
+            for field in line.split(":", 1)[1].split():
+                key, value = field.split("=")
+                info.setdefault(key, np.full(n_blocks, np.nan))[n] = float(value)
+        if "angle" in info:
+            angles = info.pop("angle")
+        elif len(header_angles) >= n_blocks:
+            angles = header_angles[:n_blocks]
+        else:
+            angles = np.concatenate([header_angles, np.full(n_blocks - len(header_angles), np.nan)])
+
+        index = {
+            "created": np.array(created),
+            "angles": angles,
+            "wavelengths": wavelengths,
+            "background": background,
+            "background_inttime": np.array(background_inttime),
+            "n_columns": np.array(n_columns),
+            "line_starts": starts[data],
+            "line_ends": ends[data],
+            "info_keys": np.array(sorted(info), dtype=str),
+        }
+        for key, values in info.items():
+            index["info_" + key] = values
+        return index
+
+    def _setup(self, index):
+        self.created = str(index["created"])
+        self.angles = index["angles"]
+        self.wavelengths = index["wavelengths"]
+        self.background = index["background"]
+        inttime = float(index["background_inttime"])
+        self.background_inttime = None if np.isnan(inttime) else inttime
+        self.has_stderr = int(index["n_columns"]) > 1
+        self.info = {str(k): index["info_" + str(k)] for k in index["info_keys"]}
+        n_pixels = len(self.wavelengths)
+        self._starts = index["line_starts"].reshape(-1, n_pixels)
+        self._ends = index["line_ends"].reshape(-1, n_pixels)
+
+    def _block(self, i, j0=0, j1=None):
+        "rows x columns numbers of pixels j0:j1 of block i"
+        j1 = len(self.wavelengths) if j1 is None else j1
+        chunk = self._mm[self._starts[i, j0] : self._ends[i, j1 - 1] + 1]
+        return _parse(chunk, 2 if self.has_stderr else 1)
+
+    def read(self, i, stderr=False):
+        "intensities of angle i, (intensities, standard errors) with stderr=True"
+        block = self._block(i)
+        if not self.has_stderr:
+            return (block, None) if stderr else block
+        return (block[:, 0], block[:, 1]) if stderr else block[:, 0]
+
+    def pixel_range(self, lo, hi):
+        "(j0, j1) pixel slice of wavelengths between lo and hi [nm]"
+        return int(np.searchsorted(self.wavelengths, lo)), int(np.searchsorted(self.wavelengths, hi, side="right"))
+
+    def pixels(self, lo, hi, rows=None):
+        "angles (or rows) x pixels intensities between lo and hi [nm], only those bytes are parsed"
+        j0, j1 = self.pixel_range(lo, hi)
+        rows = range(len(self)) if rows is None else rows
+        blocks = [self._block(i, j0, j1) for i in rows]
+        if self.has_stderr:
+            blocks = [b[:, 0] for b in blocks]
+        return np.array(blocks).reshape(len(blocks), j1 - j0)
+
+
+class CsvReader(_Reader):
+    """
+    indexed reader for dual-pol_specscan.py's comma separated file, pixels are rows there so
+    reading one angle means one column of every line, memmap() is the fast way to go through angles
+    angles [deg] (front polarizer), back_angles [deg], wavelengths [nm], background [counts], created (str)
+    grid - bool - a grid scan, every front angle against every back angle
+    taken - bool array - False for the (all zero) columns of points a scan that ended early never took,
+            from its settled positions (all True for files from before they were saved)
+    """
+
+    def _build_index(self):
+        buf = np.frombuffer(self._mm, dtype=np.uint8)
+        starts, ends = _lines(buf)
+        comment = buf[starts] == ord("#")
+        header = [bytes(self._mm[s:e]).decode()[1:].strip() for s, e in zip(starts[comment], ends[comment])]
+        text = "\n".join(header)
+        created = header[0].split(":", 1)[1].strip()
+        # str(pol_pos_d) is wrapped over several header lines
+        front = text.split("front polarizer positions [deg]:", 1)[1]
+        angles = np.array(front[front.index("[") + 1 : front.index("]")].split(), dtype=float)
+        grid = "back polarizer positions [deg]" in text
+        if grid:
+            back = text.split("back polarizer positions [deg]", 1)[1]
+            back = np.array(back[back.index("[") + 1 : back.index("]")].split(), dtype=float)
+            angles, back_angles = np.repeat(angles, len(back)), np.tile(back, len(angles))
+        else:
+            offset = float(header[1].split(":", 1)[1])
+            back_angles = angles + offset
+        taken = np.ones(len(angles), dtype=bool)
+        if "nan if not taken:" in text:
+            # np.array2string of the (front, back) pairs, a pair is nan where the point wasn't taken
+            settled = text.split("nan if not taken:", 1)[1]
+            settled = settled[settled.index("[[") : settled.index("]]")].replace("[", " ").replace("]", " ")
+            taken = ~np.isnan(np.array(settled.split(), dtype=float).reshape(-1, 2)).any(axis=1)
+        data = np.flatnonzero(~comment & (ends > starts))
+        first = _parse(self._mm[starts[data[0]] : ends[data[0]]].replace(b",", b" "))
+        # just the first two fields of every line, wavelength and background
+        rest = np.array([bytes(self._mm[starts[k] : ends[k]]).split(b",", 2)[:2] for k in data]).astype(float)
+        return {
+            "created": np.array(created),
+            "angles": angles[: len(first) - 2],
+            "back_angles": back_angles[: len(first) - 2],
+            "grid": np.array(grid),
+            "taken": taken[: len(first) - 2],
+            "wavelengths": rest[:, 0],
+            "background": rest[:, 1],
+            "line_starts": starts[data],
+            "line_ends": ends[data],
+        }
+
+    def _setup(self, index):
+        self.created = str(index["created"])
+        self.angles = index["angles"]
+        self.back_angles = index["back_angles"]
+        self.grid = bool(index["grid"])
+        self.taken = index["taken"]
+        self.wavelengths = index["wavelengths"]
+        self.background = index["background"]
+        self._starts = index["line_starts"]
+        self._ends = index["line_ends"]
+
+    def _rows(self, j0=0, j1=None):
+        "pixels j0:j1 x (2 + angles) numbers"
+        j1 = len(self.wavelengths) if j1 is None else j1
+        chunk = self._mm[self._starts[j0] : self._ends[j1 - 1] + 1]
+        return _parse(chunk.replace(b",", b" "), 2 + len(self.angles))
+
+    def read(self, i):
+        "intensities of angle i"
+        return self._rows()[:, 2 + i]
+
+    def pixels(self, lo, hi, rows=None):
+        "angles (or rows) x pixels intensities between lo and hi [nm], only those lines are parsed"
+        j0 = int(np.searchsorted(self.wavelengths, lo))
+        j1 = int(np.searchsorted(self.wavelengths, hi, side="right"))
+        block = self._rows(j0, j1)[:, 2:].T
+        return block if rows is None else block[list(rows)]
+
+    def memmap(self, path=None, dtype="float32", chunk=256):
+        "as _Reader.memmap, filled chunk pixels (lines) at a time since that is how this file is laid out"
+        if path is None:
+            path = self.path + ".npy"
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.path):
+            return np.load(path, mmap_mode="r")
+        n_pixels = len(self.wavelengths)
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(len(self), n_pixels))
+        for j0 in range(0, n_pixels, chunk):
+            j1 = min(j0 + chunk, n_pixels)
+            out[:, j0:j1] = self._rows(j0, j1)[:, 2:].T
+        out.flush()
+        del out
+        return np.load(path, mmap_mode="r")
+
+
+def open(path, cache=True):
+    "TsvReader for a .tsv, CsvReader for anything else (dual-pol_specscan.py's .txt/.csv)"
+    if path.endswith(".tsv"):
+        return TsvReader(path, cache)
+    return CsvReader(path, cache)
@@ -0,0 +1,103 @@
+# Readiness checks for the motor controllers
+# waits on the homed/enabled/motor_connected flags the controllers report instead of sleeping a flat minute,
+# and remembers per serial number whether a stage was homed and where it was left, so reconnecting
+# to it later in the same session can skip re-homing when the controller still holds its home
+import time
+
+import angles
+
+# APT (thorlabs_apt_device) status dict keys that mean "ready"
+APT_READY = ("homed", "channel_enabled", "motor_connected")
+# pylablib KinesisMotor.get_status() entries that mean "ready"
+PLL_READY = ("homed", "enabled")
+
+# serial number -> {"homed": bool, "position": float [deg], "time": float}
+_known = {}
+
+
+def print_progress(elapsed, missing):
+    "default progress callback, prints what is still being waited on about once a second"
+    if int(elapsed) != int(elapsed - 0.1):
+        print(f"waiting for {', '.join(missing)} ({elapsed:.0f} s)")
+
+
+def wait_for_flags(read_flags, flags, timeout=60.0, progress=print_progress, poll=0.1):
+    """
+    polls read_flags() until every name in flags is in what it returns (a set/list/dict of set flags)
+    read_flags - funct returning the flags currently set
+    flags - names that all have to be set
+    timeout - float - longest time [sec] to wait, raises TimeoutError after
+    progress - funct(elapsed [sec], missing flags) called every poll, None for quiet
+    OUTPUT: elapsed time [sec]
+    """
+    start = time.monotonic()
+    while True:
+        current = read_flags()
+        missing = [flag for flag in flags if flag not in current]
+        elapsed = time.monotonic() - start
+        if not missing:
+            return elapsed
+        if elapsed > timeout:
+            raise TimeoutError(f"controller never reported {', '.join(missing)} within {timeout} sec")
+        if progress is not None:
+            progress(elapsed, missing)
+        time.sleep(poll)
+
+
+def apt_flags(motor):
+    "set flags of an APT device status dict"
+    return {k for k, v in motor.status.items() if v is True}
+
+
+def pll_flags(motor):
+    "set flags of a pylablib KinesisMotor"
+    return set(motor.get_status())
+
+
+def wait_until_ready(motor, flags=APT_READY, timeout=60.0, progress=print_progress):
+    "waits for an APT device (TDC001) to report every flag in flags"
+    return wait_for_flags(lambda: apt_flags(motor), flags, timeout, progress)
+
+
+def wait_until_ready_pll(motor, flags=PLL_READY, timeout=60.0, progress=print_progress):
+    "waits for a pylablib KinesisMotor to report every flag in flags"
+    return wait_for_flags(lambda: pll_flags(motor), flags, timeout, progress)
+
+
+def remember(serial, homed, position):
+    "records the homed state and position [deg] of the stage on controller serial"
+    if serial is not None:
+        _known[serial] = {"homed": bool(homed), "position": float(position), "time": time.time()}
+
+
+def recall(serial):
+    "last remembered state of serial, or None"
+    return _known.get(serial)
+
+
+def forget(serial):
+    _known.pop(serial, None)
+
+
+def can_skip_homing(serial, homed, position, tol=0.2):
+    """
+    True if re-homing the stage on serial can be skipped: it was homed earlier in this session,
+    the controller still says it is homed (so it was not power cycled) and it is still where it was left
+    homed - bool - what the controller reports right now
+    position - float - where the controller says the stage is right now [deg]
+    """
+    known = recall(serial)
+    if known is None or not known["homed"] or not homed:
+        return False
+    return abs(known["position"] - position) <= tol
+
+
+def can_skip_homing_apt(serial, motor, tol=0.2, stage=angles.PRM1Z8):
+    "can_skip_homing for an APT device, stage is the angles.Stage of the stage on it"
+    status = motor.status
+    return can_skip_homing(serial, status["homed"], stage.to_d(status["position"]), tol)
+
+
+def can_skip_homing_pll(serial, motor, tol=0.2):
+    "can_skip_homing for a pylablib KinesisMotor (scale='stage')"
+    return can_skip_homing(serial, "homed" in motor.get_status(), motor.get_position(), tol)
@@ -0,0 +1,84 @@
+# Regions of interest
+# cuts every spectrum down to one or more wavelength windows (around the SHG line, say) as it comes in,
+# optionally summing neighbouring pixels into bins, and integrates each window so the scan carries a
+# per-window intensity with every point. Everything is worked out once from the wavelength axis as
+# pixel indices, so reducing a spectrum is one fancy index and a reshape.
+import numpy as np
+
+
+def parse_windows(text):
+    "'395-415,430-440' -> [(395.0, 415.0), (430.0, 440.0)] wavelength windows [nm]"
+    windows = []
+    for part in text.split(","):
+        lo, hi = part.split("-")
+        windows.append((min(float(lo), float(hi)), max(float(lo), float(hi))))
+    return windows
+
+
+class Roi:
+    """
+    wavelengths - the full wavelength axis [nm] of the spectrometer
+    windows - list of (lo, hi) [nm], each becomes a region of interest
+    binning - int - pixels summed into one bin, pixels left over at the end of a window are dropped
+    background - full length background counts, subtracted before integrating, over background_inttime [msec]
+    keep_full - bool - the sinks get the full spectrum, otherwise only the binned windows
+    series - backgrounds.BackgroundSeries refreshed during the scan, when set a point's background is
+             interpolated to its timestamp instead of the fixed one
+    """
+
+    def __init__(self, wavelengths, windows, binning=1, background=None, background_inttime=None, keep_full=False):
+        wavelengths = np.asarray(wavelengths)
+        self.windows = list(windows)
+        self.binning = int(binning)
+        self.keep_full = keep_full
+        pieces = []
+        for lo, hi in self.windows:
+            i0 = np.searchsorted(wavelengths, lo)
+            i1 = np.searchsorted(wavelengths, hi, side="right")
+            n = (i1 - i0) // self.binning * self.binning
+            if n <= 0:
+                raise ValueError(f"window {lo}-{hi} nm holds fewer than {self.binning} pixels")
+            pieces.append(np.arange(i0, i0 + n))
+        self.index = np.concatenate(pieces)
+        # where each window starts in the reduced pixels, for np.add.reduceat
+        self.starts = np.cumsum([0] + [len(p) for p in pieces[:-1]])
+        self.wavelengths = wavelengths[self.index].reshape(-1, self.binning).mean(axis=1)
+        self.background = None if background is None else np.asarray(background, dtype=float)
+        self.background_inttime = background_inttime
+        self.series = None
+        self.columns = tuple(f"roi_{n}" for n in range(len(self.windows)))
+
+    def reduce(self, counts):
+        "binned window pixels of counts (N, or rows x N)"
+        counts = np.asarray(counts)
+        picked = counts[..., self.index]
+        return picked.reshape(*picked.shape[:-1], -1, self.binning).sum(axis=-1)
+
+    def reduce_stderr(self, stderr):
+        "standard errors of the reduced bins, from per-pixel standard errors"
+        return np.sqrt(self.reduce(np.square(stderr)))
+
+    def integrate(self, counts):
+        "integrated counts in every window of counts (N, or rows x N)"
+        return np.add.reduceat(np.asarray(counts, dtype=float)[..., self.index], self.starts, axis=-1)
+
+    def ingest(self, intensity, info):
+        """
+        for scan.ScanWriter(reduce=...): adds roi_0, roi_1... (background subtracted integrated counts)
+        to info and, unless keep_full, swaps the spectrum (and its stderr) for the reduced one
+        """
+        signal = self.integrate(intensity)
+        background = self.background
+        if self.series is not None and "timestamp" in info:
+            background = self.series.at(info["timestamp"])
+        if background is not None:
+            scale = 1.0
+            if self.background_inttime and "integration_time_ms" in info:
+                scale = info["integration_time_ms"] / self.background_inttime
+            signal = signal - scale * self.integrate(background)
+        info = dict(info, **dict(zip(self.columns, signal.tolist())))
+        if self.keep_full:
+            return intensity, info
+        if "stderr" in info:
+            info["stderr"] = self.reduce_stderr(info["stderr"])
+        return self.reduce(intensity), info
@@ -0,0 +1,272 @@
+# Scan engine shared by the scan scripts
+# moves the polarizer, grabs a spectrum and hands it to a background writer thread
+# so the next move starts while the last spectrum is still being checked and written
+import queue
+import threading
+import time
+
+import numpy as np
+
+import averaging
+import timing
+import utility
+
+
+class TsvSink:
+    """
+    writes the .tsv layout main.py has always produced:
+    creation time, polarizer angles, wavelengths, background, then one intensity block per angle
+    when the angles are not known up front (fly scans) the angles section is left empty and point_info carries them
+    averaged points (a stderr= array in their info) get a second column with the standard error of every pixel
+    """
+
+    def __init__(self, f, point_info=False, background_inttime=None):
+        """
+        point_info=True puts a '# point i: angle=... key=value' comment line (numpy skips it) before every block
+        background_inttime - [msec] the background was taken over, written on a comment line under the creation time
+        """
+        self.f = f
+        self.point_info = point_info
+        self.background_inttime = background_inttime
+        # points that arrive out of order wait here until everything before them is written
+        self._pending = {}
+        self._next = 0
+
+    def open(self, pol_pos_d, wavelengths, background):
+        self.f.write("File was created at:" + time.asctime() + "\n")
+        if self.background_inttime is not None:
+            self.f.write(f"# background integration time [ms]: {float(self.background_inttime)!r}\n")
+        self.f.write("Polarizer angles [deg]:\n")
+        np.savetxt(self.f, pol_pos_d)
+        self.f.write("Wavelengths (nm)\n")
+        np.savetxt(self.f, wavelengths)
+        self.f.write("Background (counts)\n")
+        np.savetxt(self.f, background)
+
+    def write_point(self, index, angle, intensity, **info):
+        "blocks go in in canonical (index) order, whatever order the scan visits the points in"
+        self._pending[index] = (angle, intensity, info)
+        while self._next in self._pending:
+            self._write_block(self._next, *self._pending.pop(self._next))
+            self._next += 1
+
+    def _write_block(self, index, angle, intensity, info):
+        stderr = info.get("stderr")
+        if self.point_info:
+            fields = " ".join(
+                f"{k}={float(v)!r}" for k, v in dict(angle=angle, **info).items() if np.ndim(v) == 0
+            )
+            self.f.write(f"# point {index}: {fields}\n")
+        if stderr is None:
+            np.savetxt(self.f, intensity)
+        else:
+            np.savetxt(self.f, np.column_stack([intensity, stderr]), delimiter="\t")
+
+    def close(self):
+        # a scan that ended early can leave gaps, write what is left in order anyway
+        for index in sorted(self._pending):
+            self._write_block(index, *self._pending.pop(index))
+        self.f.flush()
+
+
+class ScanFileSink:
+    """
+    writes into a scanfile.ScanFile, per-point info (timestamp etc) goes into the matching columns and datasets (stderr)
+    the file is preallocated, points past its last row (a fly scan that gave more spectra than expected) are
+    counted in dropped and left out rather than ending the scan, counts clipped to fit an integer dtype are
+    reported when it closes
+    """
+
+    def __init__(self, scan_file):
+        self.scan_file = scan_file
+        self.dropped = 0
+
+    def open(self, pol_pos_d, wavelengths, background):
+        pass  # all of this went in when the scan file was created
+
+    def write_point(self, index, angle, intensity, **info):
+        if index >= self.scan_file.n_rows:
+            self.dropped += 1
+            return
+        names = set(self.scan_file.columns) | set(self.scan_file.datasets)
+        values = {k: v for k, v in info.items() if k in names}
+        self.scan_file.write(index, intensity, angle=angle, **values)
+
+    def close(self):
+        if self.dropped:
+            print(self.dropped, "spectra past the", self.scan_file.n_rows, "rows of the scan file were not kept")
+        if self.scan_file.clipped:
+            print(self.scan_file.clipped, "counts out of range of", self.scan_file.dtype, "were stored clipped")
+        self.scan_file.close()
+
+
+class ScanWriter:
+    """
+    background writer thread fed through a bounded queue
+    checks every spectrum against the wavelength axis and passes it on to the sinks
+    reduce - funct(intensity, info) -> (intensity, info) applied to every spectrum on the way, e.g. roi.Roi.ingest
+    if anything goes wrong on the writer thread the error is raised on the next submit or on close
+    """
+
+    _STOP = object()
+
+    def __init__(self, sinks, wavelengths, maxsize=8, reduce=None):
+        self.sinks = list(sinks)
+        self.wavelengths = np.asarray(wavelengths)
+        self.reduce = reduce
+        self.error = None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="scan-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            if self.error is not None:
+                # keep draining so the scan loop never blocks on a dead writer
+                continue
+            index, angle, spectrum, info = item
+            try:
+                t0 = timing.clock()
+                # check that wavelengths havent changed
+                if np.allclose(spectrum[0], self.wavelengths) == False:
+                    raise Exception(
+                        "spectrograph is has collected different spectral range, ending collection"
+                    )
+                timing.record("validate", t0, index)
+                t0 = timing.clock()
+                intensity = spectrum[1]
+                if self.reduce is not None:
+                    intensity, info = self.reduce(intensity, info)
+                for sink in self.sinks:
+                    sink.write_point(index, angle, intensity, **info)
+                timing.record("write", t0, index)
+            except BaseException as err:
+                self.error = err
+
+    def check(self):
+        "re-raises an error from the writer thread, if there was one"
+        if self.error is not None:
+            raise Exception("writing scan data failed, ending collection") from self.error
+
+    def submit(self, index, angle, spectrum, **info):
+        """
+        queues a spectrum (2xN, wavelengths and intensities) for checking and writing, blocks only if the queue is full
+        keywords (timestamp etc) are passed on to the sinks with the spectrum
+        """
+        self.check()
+        self._queue.put((index, angle, spectrum, info))
+
+    def close(self):
+        "waits for everything queued to be written, closes the sinks and re-raises any writer error"
+        self._queue.put(self._STOP)
+        self._thread.join()
+        try:
+            for sink in self.sinks:
+                sink.close()
+        finally:
+            self.check()
+
+
+def move_and_settle(motor, target, wait, tol=0.2, policy="abort", retries=2):
+    """
+    moves the polarizer to target [deg] and returns once it has settled there, raises if it never does
+    policy, retries - correcting a stage that isn't where it was sent (utility.settle_or_correct)
+    OUTPUT: the angle [deg] the stage actually settled at
+    """
+    # check connection every time
+    if not utility.is_mtr_connected(motor.connection):
+        raise Exception("Polarizer connection lost, ending collection")
+    motor.move_to(target)
+    # check that polarizer angle isn't drifting, returns as soon as the stage has settled
+    try:
+        return float(utility.settle_or_correct(motor, target, tol, wait, policy, retries))
+    except TimeoutError:
+        raise Exception(
+            "polarizer has drifted from desired values, ending collection"
+        )
+
+
+def acquire(spectrum, frames=1, stats=None, exposure=None):
+    """
+    takes the spectrum of one point
+    frames - int - spectra averaged (averaging.acquire), their per-pixel standard error goes in info as stderr
+    stats - averaging.RunningStats to reuse between points
+    exposure - exposure.AutoExposure, retakes the point when it clipped or was too dim and sets the next integration time
+    OUTPUT: (2xN spectrum, info for the writer with integration_time_ms (and stderr), stats)
+    """
+    t0 = timing.clock()
+    while True:
+        info = {"integration_time_ms": spectrum.inttime}
+        if frames > 1:
+            spectrometer_output, info["stderr"], stats = averaging.acquire(spectrum, frames, stats)
+        else:
+            spectrometer_output = spectrum.getspec()
+        if exposure is None or exposure.update(spectrometer_output[1]):
+            timing.record("acquire", t0)
+            return spectrometer_output, info, stats
+        print("retaking at", spectrum.inttime, "ms")
+
+
+def run_scan(
+    motor,
+    spectrum,
+    pol_pos_d,
+    writer,
+    wait,
+    tol=0.2,
+    order=None,
+    positions=None,
+    frames=1,
+    exposure=None,
+    stop=None,
+    between=None,
+    policy="abort",
+    retries=2,
+):
+    """
+    step scan over pol_pos_d [deg], the next move is commanded as soon as the spectrum is in memory
+    motor - utility.AptMotor (anything with .connection and .wait_until_settled)
+    spectrum - oceanOpticSpectrosco.ocean
+    writer - ScanWriter the spectra are handed to
+    wait - float - longest time [sec] to wait for the polarizer to settle
+    order, positions - visiting order and the positions [deg] to command, from planner.plan_order,
+                       points still go to the writer under their index in pol_pos_d
+    frames - int - spectra averaged at every point (averaging.acquire), the per-pixel standard error
+                   goes to the writer as stderr= when there is more than one
+    exposure - exposure.AutoExposure to adjust the integration time from point to point,
+               every spectrum goes to the writer with its integration_time_ms
+    stop - funct checked after every point, the scan ends early (and cleanly) once it returns True,
+           e.g. fit.FitSink.converged
+    between - funct called after every point before the next move, e.g. a background refresh
+    policy, retries - what to do when the stage doesn't settle where it was sent (utility.settle_or_correct),
+                      every spectrum goes to the writer with the actual_angle [deg] the stage settled at
+    the writer is always closed, so a failure on either side ends the scan with the data so far written
+    """
+    if order is None:
+        order = range(len(pol_pos_d))
+        positions = pol_pos_d
+    stats = None
+    try:
+        for i, target in zip(order, positions):
+            timing.point(i)
+            print("moving to", pol_pos_d[i], "deg")
+            # commanded positions may be unwrapped (planner wrap=True), the settled angle goes in the frame of pol_pos_d
+            actual = move_and_settle(motor, target, wait, tol, policy, retries) - (target - pol_pos_d[i])
+            print("collecting")
+            spectrometer_output, info, stats = acquire(spectrum, frames, stats, exposure)
+            writer.submit(i, pol_pos_d[i], spectrometer_output, timestamp=time.time(), actual_angle=actual, **info)
+            if stop is not None and stop():
+                print("stopping early, the fit has converged")
+                break
+            if between is not None:
+                between()
+    except BaseException:
+        try:
+            writer.close()
+        except Exception:
+            pass  # the error that stopped the scan is the one worth reporting
+        raise
+    writer.close()
@@ -0,0 +1,411 @@
+# Binary scan container
+# one preallocated angles x pixels cube per file, written one spectrum at a time
+# without ever rewriting what is already on disk
+#
+# layout:
+#   8 bytes   magic
+#   8 bytes   header length (little endian uint64)
+#   header    json, describes every section below by offset
+#   sections  wavelengths, background, per-row columns (angle, timestamp, ...), written flags
+#   data      uncompressed: a memory-mapped rows x pixels cube per dataset
+#             compressed: a rows x 2 (offset, nbytes) chunk table per dataset, chunks appended at the end
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+MAGIC = b"PDSCAN\x00\x01"
+ALIGN = 64
+DTYPES = ("float64", "float32", "uint16", "uint32")
+COMPRESSIONS = (None, "zlib")
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _to_dtype(values, dtype):
+    """
+    casts a spectrum to the storage dtype, integer counts are rounded and clipped instead of wrapping
+    OUTPUT: (the cast spectrum, how many of its values had to be clipped)
+    """
+    dtype = np.dtype(dtype)
+    values = np.asarray(values)
+    if dtype.kind == "u":
+        info = np.iinfo(dtype)
+        rounded = np.rint(values)
+        clipped = int(np.count_nonzero((rounded < info.min) | (rounded > info.max) | np.isnan(rounded)))
+        return np.clip(rounded, info.min, info.max).astype(dtype), clipped
+    return values.astype(dtype), 0
+
+
+class ScanFile:
+    """
+    preallocated, memory-mapped scan container
+    use ScanFile.create to make a new file and ScanFile.open to read (or keep writing) an existing one
+    clipped - counts outside the range of an integer dtype written since it was opened (they are stored clipped)
+    """
+
+    def __init__(self, path, header, mode):
+        self.path = path
+        self.header = header
+        self.mode = mode
+        self.n_rows = header["n_rows"]
+        self.n_pixels = header["n_pixels"]
+        self.dtype = np.dtype(header["dtype"])
+        # storage type of every dataset, files from before it was in the header store them all as dtype
+        self.dtypes = {
+            name: np.dtype(header.get("dataset_dtypes", {}).get(name, self.dtype)) for name in header["datasets"]
+        }
+        self.clipped = 0
+        self.compression = header["compression"]
+        self.metadata = header["metadata"]
+        sections = header["sections"]
+        mm_mode = "r" if mode == "r" else "r+"
+
+        def section(name, dtype, shape):
+            offset = sections[name]
+            return np.memmap(path, dtype=dtype, mode=mm_mode, offset=offset, shape=shape)
+
+        self.wavelengths = section("wavelengths", "<f8", (self.n_pixels,))
+        self.background = section("background", "<f8", (self.n_pixels,))
+        self.written = section("written", "u1", (self.n_rows,))
+        self.columns = {
+            name: section("column:" + name, "<f8", (self.n_rows,))
+            for name in header["columns"]
+        }
+        self.datasets = {}
+        for name in header["datasets"]:
+            if self.compression is None:
+                self.datasets[name] = section(
+                    "dataset:" + name, self.dtypes[name], (self.n_rows, self.n_pixels)
+                )
+            else:
+                self.datasets[name] = section("dataset:" + name, "<u8", (self.n_rows, 2))
+        self._f = open(path, "rb" if mode == "r" else "r+b")
+        self._next = int(np.count_nonzero(self.written))
+
+    @classmethod
+    def create(
+        cls,
+        path,
+        wavelengths,
+        n_rows=None,
+        background=None,
+        angles=None,
+        dtype="float32",
+        compression=None,
+        columns=("angle", "timestamp"),
+        datasets=("counts",),
+        metadata=None,
+        overwrite=False,
+    ):
+        """
+        creates and preallocates a scan file, returns it open for writing
+        wavelengths - wavelength axis [nm], sets the number of pixels
+        n_rows - number of spectra the file holds, taken from angles if not given
+        background - background spectrum [counts], zeros if not given
+        angles - planned angles [deg], pre-fills the 'angle' column
+        dtype - storage type of the spectra, one of float64, float32, uint16, uint32, with an integer type the
+                other datasets (stderr, which isn't whole counts) are stored as float32
+        compression - None or 'zlib' (lossless, per spectrum)
+        columns - names of the per-spectrum float columns
+        datasets - names of the rows x pixels cubes, 'counts' is the spectra themselves
+        metadata - dict of anything json can hold, integration time etc
+        """
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        if n_rows is None:
+            if angles is None:
+                raise Exception("either n_rows or angles has to be given")
+            n_rows = len(angles)
+        if str(np.dtype(dtype)) not in DTYPES:
+            raise Exception(f"dtype must be one of {DTYPES}, not {dtype}")
+        if compression not in COMPRESSIONS:
+            raise Exception(f"compression must be one of {COMPRESSIONS}, not {compression}")
+        columns = list(columns)
+        if angles is not None and "angle" not in columns:
+            columns.insert(0, "angle")
+        n_pixels = len(wavelengths)
+        integer = np.dtype(dtype).kind == "u"
+        dataset_dtypes = {n: "float32" if integer and n != "counts" else str(np.dtype(dtype)) for n in datasets}
+
+        # work out where every section lives
+        sizes = [("wavelengths", 8 * n_pixels), ("background", 8 * n_pixels), ("written", n_rows)]
+        sizes += [("column:" + name, 8 * n_rows) for name in columns]
+        for name in datasets:
+            if compression is None:
+                sizes.append(("dataset:" + name, np.dtype(dataset_dtypes[name]).itemsize * n_rows * n_pixels))
+            else:
+                sizes.append(("dataset:" + name, 16 * n_rows))
+        header = {
+            "version": 1,
+            "created": time.asctime(),
+            "n_rows": int(n_rows),
+            "n_pixels": int(n_pixels),
+            "dtype": str(np.dtype(dtype)),
+            "compression": compression,
+            "columns": columns,
+            "datasets": list(datasets),
+            "dataset_dtypes": dataset_dtypes,
+            "metadata": metadata or {},
+            "sections": {},
+        }
+        # the header holds the offsets, so size it with placeholders first and leave room for the digits
+        for name, _ in sizes:
+            header["sections"][name] = 0
+        header_len = _align(len(json.dumps(header).encode()) + 32 * len(sizes) + 16)
+        offset = _align(16 + header_len)
+        for name, size in sizes:
+            header["sections"][name] = offset
+            offset = _align(offset + size)
+        raw = json.dumps(header).encode().ljust(header_len)
+
+        with open(path, "wb" if overwrite else "xb") as f:
+            f.write(MAGIC)
+            f.write(np.uint64(header_len).tobytes())
+            f.write(raw)
+            f.truncate(offset)
+
+        sf = cls(path, header, "r+")
+        sf.wavelengths[:] = wavelengths
+        if background is not None:
+            sf.background[:] = background
+        for column in sf.columns.values():
+            column[:] = np.nan
+        if angles is not None:
+            sf.columns["angle"][:] = angles
+        sf.flush()
+        return sf
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        "opens an existing scan file, mode 'r' to read or 'r+' to keep writing into it"
+        with open(path, "rb") as f:
+            if f.read(8) != MAGIC:
+                raise Exception(f"{path} is not a scan file")
+            header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+            header = json.loads(f.read(header_len).decode())
+        return cls(path, header, mode)
+
+    def write(self, index, counts, **values):
+        """
+        writes one spectrum (and the per-row column values given as keywords, e.g. angle=, timestamp=) into row index
+        datasets other than counts are given as keywords too, e.g. stderr=
+        values out of range of an integer dtype are clipped and counted in clipped
+        """
+        if self.mode == "r":
+            raise Exception("scan file was opened read only")
+        values["counts"] = counts
+        for name, cube in self.datasets.items():
+            if name not in values:
+                continue
+            row, clipped = _to_dtype(values.pop(name), self.dtypes[name])
+            self.clipped += clipped
+            if row.shape != (self.n_pixels,):
+                raise Exception(
+                    f"spectrum has {row.size} pixels, scan file expects {self.n_pixels}"
+                )
+            if self.compression is None:
+                cube[index] = row
+            else:
+                chunk = zlib.compress(row.tobytes())
+                self._f.seek(0, os.SEEK_END)
+                cube[index] = (self._f.tell(), len(chunk))
+                self._f.write(chunk)
+        for name, value in values.items():
+            self.columns[name][index] = value
+        if self.compression is not None:
+            self._f.flush()
+        # flag the row last, a row is only ever seen as written once all of it is on disk
+        self.written[index] = 1
+        self._next = max(self._next, index + 1)
+
+    def append(self, counts, **values):
+        "writes the spectrum into the next free row and returns its index"
+        index = self._next
+        if index >= self.n_rows:
+            raise Exception(f"scan file is full ({self.n_rows} rows)")
+        self.write(index, counts, **values)
+        return index
+
+    def read(self, index, dataset="counts"):
+        "returns one spectrum as an array of the dataset's storage dtype"
+        cube = self.datasets[dataset]
+        if self.compression is None:
+            return np.array(cube[index])
+        offset, nbytes = (int(x) for x in cube[index])
+        if nbytes == 0:
+            return np.zeros(self.n_pixels, dtype=self.dtypes[dataset])
+        self._f.seek(offset)
+        return np.frombuffer(zlib.decompress(self._f.read(nbytes)), dtype=self.dtypes[dataset]).copy()
+
+    def __getitem__(self, index):
+        return self.read(index)
+
+    def __len__(self):
+        return self.n_rows
+
+    def cube(self, dataset="counts"):
+        "whole rows x pixels array, a memmap view when the file is uncompressed"
+        if self.compression is None:
+            return self.datasets[dataset]
+        return np.stack([self.read(i, dataset) for i in range(self.n_rows)])
+
+    def column(self, name):
+        return np.array(self.columns[name])
+
+    def flush(self):
+        if self.mode == "r":
+            return
+        for array in (self.wavelengths, self.background, self.written):
+            array.flush()
+        for array in self.columns.values():
+            array.flush()
+        for array in self.datasets.values():
+            array.flush()
+        self._f.flush()
+
+    def close(self):
+        self.flush()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _numbers(lines):
+    "parses lines of numbers (skipping blank and '#' lines), one column gives a 1D array, more give 2D"
+    rows = [line.split() for line in lines if line.strip() and not line.startswith("#")]
+    values = np.array(rows, dtype=float)
+    return values[:, 0] if values.ndim == 2 and values.shape[1] == 1 else values
+
+
+def _point_info(line):
+    "the key=value pairs of a '# point i: ...' line as a dict"
+    return {k: float(v) for k, v in (field.split("=") for field in line.split(":", 1)[1].split())}
+
+
+def convert_tsv(src, dst, angles=None, **kwargs):
+    """
+    converts a .tsv written by main.py into a scan file
+    older files never wrote the angles under their header, pass angles= for those
+    angles (and timestamps etc) on '# point' lines are used when there are any,
+    blocks with a second (standard error) column fill a 'stderr' dataset
+    remaining keywords go to ScanFile.create
+    """
+    with open(src) as f:
+        lines = f.read().splitlines()
+    created = lines[0].split(":", 1)[1].strip()
+    i_ang = lines.index("Polarizer angles [deg]:")
+    i_wvl = lines.index("Wavelengths (nm)")
+    i_bkg = lines.index("Background (counts)")
+    file_angles = np.atleast_1d(_numbers(lines[i_ang + 1 : i_wvl]))
+    wavelengths = _numbers(lines[i_wvl + 1 : i_bkg])
+    n_pixels = len(wavelengths)
+    background = _numbers(lines[i_bkg + 1 : i_bkg + 1 + n_pixels])
+    body = lines[i_bkg + 1 + n_pixels :]
+    points = [_point_info(line) for line in body if line.startswith("# point")]
+    spectra = _numbers(body)
+    if spectra.ndim == 1:
+        spectra = spectra[:, None]
+    n_blocks = len(spectra) // n_pixels
+    spectra = spectra[: n_blocks * n_pixels].reshape(n_blocks, n_pixels, -1)
+    if angles is None:
+        if points:
+            angles = np.array([p["angle"] for p in points])
+        elif len(file_angles):
+            angles = file_angles
+        else:
+            angles = np.full(n_blocks, np.nan)
+    columns = ["angle"] + sorted({k for p in points for k in p} - {"angle"})
+    if "timestamp" not in columns:
+        columns.append("timestamp")
+    datasets = ("counts", "stderr") if spectra.shape[2] > 1 else ("counts",)
+    metadata = dict(kwargs.pop("metadata", {}), source=os.path.basename(src), created=created)
+    sf = ScanFile.create(
+        dst, wavelengths, n_rows=len(angles), background=background, angles=angles,
+        columns=columns, datasets=datasets, metadata=metadata, **kwargs
+    )
+    for i in range(n_blocks):
+        extra = {k: v for k, v in points[i].items() if k != "angle"} if points else {}
+        if spectra.shape[2] > 1:
+            extra["stderr"] = spectra[i, :, 1]
+        sf.write(i, spectra[i, :, 0], **extra)
+    sf.close()
+    return dst
+
+
+def _bracketed(text):
+    "numbers of the first [...] (str of a numpy array, maybe nested and wrapped over lines) in text"
+    start = text.index("[")
+    close = "]]" if text.startswith("[[", start) else "]"
+    body = text[start : text.index(close, start) + len(close)]
+    return np.array(body.replace("[", " ").replace("]", " ").split(), dtype=float)
+
+
+def convert_csv(src, dst, **kwargs):
+    """
+    converts a .csv/.txt written by dual-pol_specscan.py into a scan file
+    the back polarizer angle is stored in the 'back_angle' column, a grid scan (back polarizer positions header)
+    gives a row for every front x back pair, the settled angles go in actual_angle, actual_back_angle if recorded
+    remaining keywords go to ScanFile.create
+    """
+    header = []
+    with open(src, encoding="utf-8") as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            header.append(line[1:].strip())
+    text = "\n".join(header)
+    created = header[0].split(":", 1)[1].strip()
+    offset = float(header[1].split(":", 1)[1])
+    # str(pol_pos_d) is wrapped over several header lines
+    angles = _bracketed(text.split("front polarizer positions [deg]:", 1)[1])
+    if "back polarizer positions [deg]" in text:
+        # columns go through every back position for each front one, as reader.CsvReader reads them
+        back = _bracketed(text.split("back polarizer positions [deg]", 1)[1])
+        angles, back_angles = np.repeat(angles, len(back)), np.tile(back, len(angles))
+    else:
+        back_angles = angles + offset
+    columns = ["angle", "back_angle", "timestamp"]
+    settled = None
+    marker = "settled (front, back) positions [deg] of every column, nan if not taken:"
+    if marker in text:
+        settled = _bracketed(text.split(marker, 1)[1].lstrip()).reshape(-1, 2)
+        columns += ["actual_angle", "actual_back_angle"]
+    data = np.loadtxt(src, delimiter=",", ndmin=2)
+    n_rows = data.shape[1] - 2
+    if n_rows != len(angles):
+        raise Exception(f"{src} has {n_rows} spectra for {len(angles)} angle pairs in its header")
+    metadata = dict(
+        kwargs.pop("metadata", {}), source=os.path.basename(src), created=created, offset=offset
+    )
+    sf = ScanFile.create(
+        dst, data[:, 0], n_rows=n_rows, background=data[:, 1], angles=angles,
+        columns=columns, metadata=metadata, **kwargs
+    )
+    for i in range(n_rows):
+        extra = {} if settled is None else {"actual_angle": settled[i, 0], "actual_back_angle": settled[i, 1]}
+        sf.write(i, data[:, 2 + i], back_angle=back_angles[i], **extra)
+    sf.close()
+    return dst
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="convert .tsv/.csv scan data to a scan file")
+    parser.add_argument("src", help="file written by main.py (.tsv) or dual-pol_specscan.py")
+    parser.add_argument("dst", help="scan file to create")
+    parser.add_argument("--dtype", default="float32", choices=DTYPES)
+    parser.add_argument("--compression", default=None, choices=["zlib"])
+    args = parser.parse_args()
+    if args.src.endswith(".tsv"):
+        convert_tsv(args.src, args.dst, dtype=args.dtype, compression=args.compression)
+    else:
+        convert_csv(args.src, args.dst, dtype=args.dtype, compression=args.compression)
@@ -0,0 +1,489 @@
+# Simulated hardware for running and timing the scan scripts without anything plugged in
+# SimTDC001 - stands in for tdc001.TDC001 (thorlabs_apt_device), wrap it with utility.AptMotor
+# SimKinesisMotor - stands in for pylablib.devices.Thorlabs.KinesisMotor
+# SimOcean - stands in for oceanOpticSpectrosco.ocean
+#
+# motion follows a trapezoidal velocity profile built from the velocity/acceleration params,
+# spectra take their integration time to come back and carry shot and read noise,
+# and faults can be injected with inject() to exercise the error handling
+import collections
+import random
+import threading
+import time
+
+import numpy as np
+
+import angles
+import timing
+
+# PRM1Z8 defaults [deg/s], [deg/s^2]
+PRM1Z8_VELOCITY = 10.0
+PRM1Z8_ACCELERATION = 10.0
+
+
+class Axis:
+    "one rotation axis moving on a trapezoidal profile, positions in deg"
+
+    def __init__(self, velocity=PRM1Z8_VELOCITY, acceleration=PRM1Z8_ACCELERATION):
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self._lock = threading.Lock()
+        self._start = 0.0
+        self._target = 0.0
+        self._t0 = time.monotonic()
+        self._duration = 0.0
+
+    def _profile(self, distance):
+        "returns (duration [s], peak velocity [deg/s]) of a move of distance [deg]"
+        d = abs(distance)
+        if d == 0.0:
+            return 0.0, 0.0
+        t_acc = self.velocity / self.acceleration
+        if self.acceleration * t_acc**2 >= d:
+            # never reaches full speed, triangle profile
+            t_acc = np.sqrt(d / self.acceleration)
+            return 2 * t_acc, self.acceleration * t_acc
+        return 2 * t_acc + (d - self.acceleration * t_acc**2) / self.velocity, self.velocity
+
+    def move_time(self, distance):
+        return self._profile(distance)[0]
+
+    def position(self, now=None):
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            t = now - self._t0
+            distance = self._target - self._start
+            duration, peak = self._profile(distance)
+            if t >= duration:
+                return self._target
+            t_acc = peak / self.acceleration
+            if t < t_acc:
+                s = 0.5 * self.acceleration * t**2
+            elif t < duration - t_acc:
+                s = 0.5 * self.acceleration * t_acc**2 + peak * (t - t_acc)
+            else:
+                s = abs(distance) - 0.5 * self.acceleration * (duration - t) ** 2
+            return self._start + np.sign(distance) * s
+
+    def velocity_now(self):
+        "signed velocity [deg/s] right now, from the position a moment ago"
+        now = time.monotonic()
+        dt = 1e-3
+        return (self.position(now) - self.position(now - dt)) / dt
+
+    def moving(self):
+        return time.monotonic() - self._t0 < self._duration
+
+    def move_to(self, target):
+        now = time.monotonic()
+        start = self.position(now)
+        with self._lock:
+            self._start = start
+            self._target = float(target)
+            self._t0 = now
+            self._duration = self._profile(self._target - start)[0]
+
+    def stop(self):
+        here = self.position()
+        with self._lock:
+            self._start = self._target = here
+            self._duration = 0.0
+
+    def wait(self, timeout=None):
+        remaining = self._duration - (time.monotonic() - self._t0)
+        if timeout is not None and remaining > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("simulated move did not finish in time")
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+class Faults:
+    """
+    injectable faults, every device has one as .faults
+    inject(name, count=1, probability=1.0) arms a fault for the next count opportunities
+    """
+
+    def __init__(self, seed=None):
+        self._armed = {}
+        self._random = random.Random(seed)
+
+    def inject(self, name, count=1, probability=1.0):
+        self._armed[name] = [count, probability]
+
+    def clear(self):
+        self._armed.clear()
+
+    def fire(self, name):
+        "returns True (and uses one up) if fault name is armed and its dice roll says so"
+        armed = self._armed.get(name)
+        if not armed or armed[0] <= 0:
+            return False
+        if self._random.random() >= armed[1]:
+            return False
+        armed[0] -= 1
+        return True
+
+
+# controllers keep their axis and homed state between connections, like real ones do until power cycled
+_controllers = {}
+
+
+def power_cycle(serial=None):
+    "forgets the state of one simulated controller (or all of them), as if it had been switched off and on"
+    if serial is None:
+        _controllers.clear()
+    else:
+        _controllers.pop(serial, None)
+
+
+class SimTDC001:
+    """
+    drop in for tdc001.TDC001, keeps the same method names and status dict keys as thorlabs_apt_device
+    faults: "disconnect" (motor_connected drops), "stale_status" (position stops updating for one move),
+    "overshoot" (move ends 0.5 deg past target), "connect" (constructor raises)
+    """
+
+    def __init__(self, serial_port=None, home=True, faults=None, **kwargs):
+        self.serial_port = serial_port
+        self.faults = faults or Faults()
+        if self.faults.fire("connect"):
+            raise Exception("simulated TDC001 failed to connect")
+        state = _controllers.setdefault(serial_port, {"axis": Axis(), "homed": False})
+        self._state = state
+        self.axis = state["axis"]
+        self.enabled = False
+        self.motor_connected = True
+        self._homing_until = 0.0
+        self._stale = None
+        self._error_callbacks = []
+        self.home_velocity = PRM1Z8_VELOCITY
+        if home:
+            self.home()
+
+    @property
+    def homed(self):
+        return self._state["homed"]
+
+    @homed.setter
+    def homed(self, value):
+        self._state["homed"] = value
+
+    @property
+    def status(self):
+        now = time.monotonic()
+        homing = now < self._homing_until
+        if not homing and self._homing_until:
+            self.homed = True
+        position = self.axis.position(now) if self._stale is None else self._stale
+        velocity = self.axis.velocity_now()
+        return {
+            "position": angles.from_d(position),
+            "enc_count": angles.from_d(position),
+            "velocity": angles.from_dps(abs(velocity)),
+            "forward_limit_switch": False,
+            "reverse_limit_switch": False,
+            "moving_forward": self.axis.moving() and velocity > 0,
+            "moving_reverse": self.axis.moving() and velocity < 0,
+            "jogging_forward": False,
+            "jogging_reverse": False,
+            "motor_connected": self.motor_connected,
+            "homing": homing,
+            "homed": self.homed,
+            "tracking": False,
+            "interlock": False,
+            "settled": not self.axis.moving(),
+            "motion_error": False,
+            "motor_current_limit_reached": False,
+            "channel_enabled": self.enabled,
+            "enabled": self.enabled,
+        }
+
+    def set_enabled(self, state=True, bay=0, channel=0):
+        self.enabled = state
+
+    def set_home_params(self, velocity, offset_distance, direction="reverse", **kwargs):
+        self.home_velocity = angles.to_dps(velocity)
+
+    def set_lim_params_PRM1Z8(self, bay=0, channel=0):
+        pass
+
+    def set_dc_pid_params_PRM1Z8(self, bay=0, channel=0):
+        pass
+
+    def set_home_params_PRM1Z8(self):
+        self.set_home_params(velocity=0x00068D62, offset_distance=0x00001DFF, direction="reverse")
+
+    def set_velocity_params(self, acceleration, max_velocity, bay=0, channel=0):
+        self.axis.acceleration = angles.to_dpss(acceleration)
+        self.axis.velocity = angles.to_dps(max_velocity)
+
+    def home(self, bay=0, channel=0):
+        # homes from wherever it is, at the homing velocity, then sits at 0
+        duration = abs(self.axis.position()) / max(self.home_velocity, 1e-9) + 0.5
+        self.axis.stop()
+        self.axis.move_to(0.0)
+        self.axis._duration = duration
+        self.homed = False
+        self._homing_until = time.monotonic() + duration
+
+    def move_absolute(self, position=None, now=None, bay=0, channel=0):
+        self._check_motor()
+        target = angles.to_d(position)
+        self._stale = None
+        if self.faults.fire("stale_status"):
+            self._stale = self.axis.position()
+        if self.faults.fire("overshoot"):
+            target += 0.5
+        self.axis.move_to(target)
+
+    def request_status(self, bay=0, channel=0):
+        "a fresh status report, which ends a stale_status fault"
+        self._stale = None
+
+    def move_relative(self, distance=None, now=None, bay=0, channel=0):
+        self.move_absolute(angles.from_d(self.axis._target) + distance)
+
+    def stop(self, immediate=False, bay=0, channel=0):
+        self.axis.stop()
+
+    def _check_motor(self):
+        if self.faults.fire("disconnect"):
+            self.motor_connected = False
+            for callback in self._error_callbacks:
+                callback("sim", 0, "motor disconnected")
+
+    def register_error_callback(self, callback):
+        self._error_callbacks.append(callback)
+
+    def close(self):
+        self.axis.stop()
+
+
+class SimKinesisMotor:
+    """
+    drop in for pylablib.devices.Thorlabs.KinesisMotor with scale="stage", positions in deg
+    faults: "disconnect" (get_status loses "enabled"), "overshoot", "connect"
+    """
+
+    def __init__(self, conn=None, scale="stage", faults=None, **kwargs):
+        self.conn = conn
+        self.faults = faults or Faults()
+        if self.faults.fire("connect"):
+            raise Exception("simulated KDC101 failed to connect")
+        state = _controllers.setdefault(conn, {"axis": Axis(), "homed": False})
+        self._state = state
+        self.axis = state["axis"]
+        self.enabled = True
+        self._homing_until = 0.0
+
+    @property
+    def homed(self):
+        return self._state["homed"]
+
+    @homed.setter
+    def homed(self, value):
+        self._state["homed"] = value
+
+    def get_status(self):
+        sts = []
+        if self.enabled:
+            sts.append("enabled")
+        if self.is_homed():
+            sts.append("homed")
+        if time.monotonic() < self._homing_until:
+            sts.append("homing")
+        if self.axis.moving():
+            sts.append("moving_fw" if self.axis.velocity_now() >= 0 else "moving_bk")
+        return sts
+
+    def is_homed(self):
+        if self._homing_until and time.monotonic() >= self._homing_until:
+            self.homed = True
+        return self.homed
+
+    def home(self, sync=True, force=False, timeout=None):
+        if self.is_homed() and not force:
+            return
+        duration = abs(self.axis.position()) / PRM1Z8_VELOCITY + 0.5
+        self.axis.move_to(0.0)
+        self.axis._duration = duration
+        self.homed = False
+        self._homing_until = time.monotonic() + duration
+        if sync:
+            self.wait_for_home(timeout=timeout)
+
+    def wait_for_home(self, timeout=None):
+        self.axis.wait(timeout)
+        time.sleep(max(0.0, self._homing_until - time.monotonic()))
+        self.is_homed()
+
+    def setup_velocity(self, min_velocity=None, acceleration=None, max_velocity=None, **kwargs):
+        if acceleration is not None:
+            self.axis.acceleration = acceleration
+        if max_velocity is not None:
+            self.axis.velocity = max_velocity
+
+    def get_velocity_parameters(self, **kwargs):
+        return (0.0, self.axis.acceleration, self.axis.velocity)
+
+    def move_to(self, position, **kwargs):
+        if self.faults.fire("disconnect"):
+            self.enabled = False
+        if self.faults.fire("overshoot"):
+            position += 0.5
+        self.axis.move_to(position)
+
+    def move_by(self, distance=1, **kwargs):
+        self.move_to(self.axis._target + distance)
+
+    def get_position(self, **kwargs):
+        return self.axis.position()
+
+    def is_moving(self, **kwargs):
+        return self.axis.moving()
+
+    def wait_move(self, timeout=None, **kwargs):
+        self.axis.wait(timeout)
+
+    def stop(self, immediate=False, sync=True, **kwargs):
+        self.axis.stop()
+
+    def close(self):
+        self.axis.stop()
+
+
+class SimOcean:
+    """
+    drop in for oceanOpticSpectrosco.ocean
+    getspec blocks for the integration time and returns [wavelengths, counts] of an SHG line
+    whose height follows cos^2(2*theta), theta taken from angle_source() [deg] if it is given
+    faults: "timeout" (getspec raises), "wavelength_shift" (returns a shifted wavelength axis once)
+    with enable_buffer it free runs into an on-board buffer like the spectrometers that have one
+    """
+
+    max_intensity = 65535.0
+    inttime_limits = (1.0, 65000.0)  # [msec], same as ocean.inttime_limits
+    trigger_modes = ("normal", "software")  # it has no trigger input, the external modes are refused
+
+    def __init__(
+        self,
+        sernum="SIM0001",
+        angle_source=None,
+        pixels=2048,
+        center=400.0,
+        width=2.0,
+        peak_rate=20000.0,
+        dark_rate=500.0,
+        read_noise=8.0,
+        readout_time=0.004,
+        faults=None,
+        seed=None,
+    ):
+        self.sernum = sernum
+        self.angle_source = angle_source
+        self.wavelengths = np.linspace(center - 50.0, center + 50.0, pixels)
+        self.line = np.exp(-0.5 * ((self.wavelengths - center) / width) ** 2)
+        self.peak_rate = peak_rate  # counts/s at the top of a lobe
+        self.dark_rate = dark_rate  # counts/s everywhere
+        self.read_noise = read_noise
+        self.readout_time = readout_time
+        self.inttime = 100.0  # [msec], same as ocean.inttime
+        self.scans_to_average = 1  # same as ocean.scans_to_average
+        self.faults = faults or Faults()
+        self.trigger = None  # same as ocean.trigger
+        self.buffered = False  # spectra go through the buffer, see enable_buffer
+        self._rng = np.random.default_rng(seed)
+        self._buffer = collections.deque()
+        self._buffering = threading.Event()
+        self._buffer_thread = None
+
+    def setinttime(self, num):
+        "integration time in msec, same as ocean.setinttime"
+        self.inttime = num
+
+    def set_scans_to_average(self, num):
+        "averages num spectra on the 'device' per getspec, same as ocean.set_scans_to_average"
+        self.scans_to_average = int(num)
+        return True
+
+    def signal(self, angle):
+        "noise free counts/s per pixel at polarizer angle [deg]"
+        response = np.cos(np.deg2rad(2.0 * angle)) ** 2
+        return self.dark_rate + self.peak_rate * response * self.line
+
+    def getspec(self):
+        t0 = timing.clock()
+        if self.faults.fire("timeout"):
+            raise Exception("simulated spectrometer timed out")
+        m = self.scans_to_average
+        time.sleep(m * self.inttime / 1000.0 + self.readout_time)
+        angle = self.angle_source() if self.angle_source is not None else 0.0
+        spectrum = self._spectrum(self.signal(angle), m)
+        timing.record("readout", t0)
+        return spectrum
+
+    def _spectrum(self, rate, m=1):
+        "[wavelengths, counts] of m frames averaged at rate counts/s per pixel"
+        expected = rate * self.inttime / 1000.0
+        # the sum of m poisson frames is poisson, read noise adds in quadrature
+        counts = self._rng.poisson(m * expected) + self._rng.normal(0.0, self.read_noise * np.sqrt(m), expected.shape)
+        counts = np.clip(counts / m, 0.0, self.max_intensity)
+        wavelengths = self.wavelengths
+        if self.faults.fire("wavelength_shift"):
+            wavelengths = wavelengths + 0.5
+        return np.array([wavelengths, counts])
+
+    def set_trigger_mode(self, mode):
+        "same as ocean.set_trigger_mode, False for anything but the internal modes"
+        if mode not in self.trigger_modes:
+            print("trigger mode", mode, "not available on", self.sernum)
+            return False
+        self.trigger = mode
+        return True
+
+    def enable_buffer(self, capacity=1000):
+        """
+        starts free running into a buffer of capacity spectra (the oldest are dropped), read out in bulk with
+        read_buffered, unlike ocean (seabreeze has no bulk read, its enable_buffer always says no)
+        """
+        self.disable_buffer()
+        self._buffer = collections.deque(maxlen=int(capacity))
+        self._buffering.set()
+        self._buffer_thread = threading.Thread(target=self._free_run, name="sim-spectrometer", daemon=True)
+        self._buffer_thread.start()
+        self.buffered = True
+        return True
+
+    def disable_buffer(self):
+        if self._buffer_thread is not None:
+            self._buffering.clear()
+            self._buffer_thread.join()
+            self._buffer_thread = None
+        self._buffer.clear()
+        self.buffered = False
+
+    def buffer_count(self):
+        return len(self._buffer)
+
+    def read_buffered(self, n):
+        "the n oldest spectra in the buffer, in one go"
+        t0 = timing.clock()
+        spectra = [self._buffer.popleft() for _ in range(n)]
+        timing.record("readout", t0)
+        return spectra
+
+    def _free_run(self):
+        # back to back integrations on a fixed clock, readout overlaps the next integration as on the device
+        angle = self.angle_source() if self.angle_source is not None else 0.0
+        deadline = time.monotonic()
+        while self._buffering.is_set():
+            deadline += self.inttime / 1000.0
+            time.sleep(max(deadline - time.monotonic(), 0.0))
+            end = self.angle_source() if self.angle_source is not None else 0.0
+            # the rate averaged over the window, near enough for the angle swept in one integration
+            self._buffer.append(self._spectrum(0.5 * (self.signal(angle) + self.signal(end))))
+            angle = end
+
+    def close(self):
+        self.disable_buffer()
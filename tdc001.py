@@ -0,0 +1,79 @@
+# TDC001 controller class for utility.AptMotor, thorlabs_apt_device's TDC001 plus the PRM1Z8 stage parameters
+# its own module so thorlabs_apt_device is only imported when a real TDC001 is used (see drivers.py)
+import thorlabs_apt_device as apt
+from thorlabs_apt_device import protocol
+
+
+# Since aptdevice_motor doesn't include functions related to limit switch, need to define them
+class TDC001(apt.TDC001):
+    def set_lim_params_PRM1Z8(self, bay=0, channel=0):
+        """
+        Set parameters for limit switch.
+        :param bay: Index (0-based) of controller bay to send the command.
+        :param channel: Index (0-based) of controller bay channel to send the command.
+        """
+
+        self._log.debug("Setting limit parameters appropriate for PRM1Z8.")
+        self._loop.call_soon_threadsafe(
+            self._write,
+            protocol.mot_set_limswitchparams(
+                source=apt.EndPoint.HOST,
+                dest=self.bays[bay],
+                chan_ident=self.channels[channel],
+                cw_hardlimit=0x04,
+                ccw_hardlimit=0x01,
+                cw_softlimit=0x0780,
+                ccw_softlimit=0x0780,
+                soft_limit_mode=0x01,
+            ),
+        )
+        # Update status with new home parameters
+        self._loop.call_soon_threadsafe(
+            self._write,
+            protocol.mot_req_limswitchparams(
+                source=apt.EndPoint.HOST,
+                dest=self.bays[bay],
+                chan_ident=self.channels[channel],
+            ),
+        )
+
+    def set_dc_pid_params_PRM1Z8(self, bay=0, channel=0):
+        self._log.debug("Setting DC PID parameters appropriate for PRM1Z8.")
+
+        self._loop.call_soon_threadsafe(
+            self._write,
+            protocol.mot_set_dcpidparams(
+                source=apt.EndPoint.HOST,
+                dest=self.bays[bay],
+                chan_ident=self.channels[channel],
+                proportional=0x0352,
+                integral=0x96,
+                differential=0x0AA0,
+                integral_limit=0x32,
+            ),
+        )
+
+        self._loop.call_soon_threadsafe(
+            self._write,
+            protocol.mot_req_dcpidparams(
+                source=apt.EndPoint.HOST,
+                dest=self.bays[bay],
+                chan_ident=self.channels[channel],
+            ),
+        )
+
+    def set_home_params_PRM1Z8(self):
+        self.set_home_params(
+            velocity=0x00068D62, offset_distance=0x00001DFF, direction="reverse"
+        )
+
+    def request_status(self, bay=0, channel=0):
+        "asks for a status update now rather than waiting for the next periodic one"
+        self._loop.call_soon_threadsafe(
+            self._write,
+            protocol.mot_req_dcstatusupdate(
+                source=apt.EndPoint.HOST,
+                dest=self.bays[bay],
+                chan_ident=self.channels[channel],
+            ),
+        )
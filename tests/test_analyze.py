@@ -0,0 +1,32 @@
+# analyze.py fits what a dual-pol scan actually took, and won't fit a grid scan against one angle
+import numpy as np
+
+import analyze
+from test_scanfile import write_dual_pol
+
+
+def test_untaken_points_are_left_out(tmp_path):
+    front = np.arange(0.0, 100.0, 10.0)
+    settled = np.column_stack([front, front + 5.0])
+    settled[6:] = np.nan  # the scan broke after 6 points, the rest of the columns are zeros
+    src = tmp_path / "broken.txt"
+    data = write_dual_pol(str(src), front, offset=5.0, settled=settled)
+    data[:, 8:] = 0.0
+    header = "".join(line for line in src.read_text().splitlines(True) if line.startswith("#"))
+    with open(src, "w") as f:
+        f.write(header)
+        np.savetxt(f, data, delimiter=",")
+    scans = analyze.run(str(tmp_path), workers=1)
+    (rows,) = [s["rows"] for s in scans.values()]
+    assert rows[0]["angles"] == 6
+    roi = np.loadtxt(tmp_path / "analysis" / "broken.txt.roi.tsv")
+    assert np.allclose(roi[:, 0], front[:6])
+
+
+def test_grid_scan_is_skipped(tmp_path):
+    front, back = [0.0, 45.0, 90.0], [10.0, 20.0, 30.0]
+    write_dual_pol(str(tmp_path / "grid.txt"), front, back)
+    scans = analyze.run(str(tmp_path), workers=1)
+    (scan,) = scans.values()
+    assert "grid scan" in scan["error"]
+    assert not (tmp_path / "analysis" / "grid.txt.fit.tsv").exists()
@@ -0,0 +1,12 @@
+# the scripts start fast and leave the vendor stacks to the scans that use that hardware (benchmark.py --imports)
+import pytest
+
+import benchmark
+
+
+@pytest.mark.parametrize("module", ["main", "reader", "analyze"])
+def test_import_within_budget_without_vendor_stacks(module):
+    # every import is timed in a fresh interpreter, nothing this one imported counts
+    best, budget, vendor = benchmark.check_imports({module: benchmark.IMPORT_BUDGETS[module]})[module]
+    assert vendor == []
+    assert best <= budget, f"importing {module} took {best * 1e3:.0f} ms, its budget is {budget * 1e3:.0f} ms"
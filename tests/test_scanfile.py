@@ -0,0 +1,74 @@
+# dual-pol_specscan.py's text output converts to a scan file with every spectrum and angle pair in place
+import time
+
+import numpy as np
+
+import reader
+import scanfile
+
+
+def write_dual_pol(path, front, back=None, offset=0.0, settled=None, seed=0):
+    "a file laid out the way dual-pol_specscan.py saves one, back given for a grid scan"
+    rng = np.random.default_rng(seed)
+    n = len(front) * (1 if back is None else len(back))
+    wavelengths = np.linspace(350.0, 450.0, 32)
+    data = np.column_stack([wavelengths, np.full(32, 10.0), rng.normal(100.0, 5.0, (32, n))])
+    cmt = (
+        "file was created at: " + time.asctime() + "\n"
+        + "back polarizer was offset by: " + str(offset) + "\n"
+        + "front polarizer positions [deg]:\n" + str(np.asarray(front, dtype=float))
+    )
+    if back is not None:
+        cmt += "\nback polarizer positions [deg] (columns go through every back position for each front one):\n"
+        cmt += str(np.asarray(back, dtype=float))
+    if settled is not None:
+        cmt += "\nsettled (front, back) positions [deg] of every column, nan if not taken:\n"
+        cmt += np.array2string(settled, threshold=settled.size + 1)
+    np.savetxt(path, data, delimiter=",", header=cmt, encoding="utf-8")
+    return data
+
+
+def test_grid_round_trip(tmp_path):
+    front, back = [0.0, 45.0, 90.0], [10.0, 20.0, 30.0]
+    settled = np.array([(a + 0.01, b - 0.01) for a in front for b in back])
+    src = str(tmp_path / "grid.txt")
+    data = write_dual_pol(src, front, back, settled=settled)
+    dst = scanfile.convert_csv(src, str(tmp_path / "grid.scan"), dtype="float64")
+    with scanfile.ScanFile.open(dst) as sf, reader.open(src) as r:
+        assert len(sf) == 9
+        assert np.allclose(sf.column("angle"), np.repeat(front, 3))
+        assert np.allclose(sf.column("back_angle"), np.tile(back, 3))
+        assert np.allclose(sf.column("angle"), r.angles)
+        assert np.allclose(sf.column("back_angle"), r.back_angles)
+        assert np.allclose(sf.column("actual_angle"), settled[:, 0])
+        assert np.allclose(sf.column("actual_back_angle"), settled[:, 1])
+        for i in range(9):
+            assert np.allclose(sf.read(i), data[:, 2 + i])
+
+
+def test_offset_round_trip(tmp_path):
+    front = np.arange(0.0, 100.0, 10.0)
+    src = str(tmp_path / "offset.txt")
+    data = write_dual_pol(src, front, offset=5.0)
+    dst = scanfile.convert_csv(src, str(tmp_path / "offset.scan"), dtype="float64")
+    with scanfile.ScanFile.open(dst) as sf:
+        assert np.allclose(sf.column("angle"), front)
+        assert np.allclose(sf.column("back_angle"), front + 5.0)
+        assert np.allclose(sf.cube(), data[:, 2:].T)
+
+
+def test_integer_counts_clip_is_counted_and_stderr_stays_float(tmp_path):
+    wavelengths = np.linspace(350.0, 450.0, 4)
+    for compression in scanfile.COMPRESSIONS:
+        path = str(tmp_path / f"uint16-{compression}.scan")
+        with scanfile.ScanFile.create(
+            path, wavelengths, n_rows=2, dtype="uint16", compression=compression, datasets=("counts", "stderr")
+        ) as sf:
+            sf.write(0, [1.4, 70000.0, -3.0, 10.0], stderr=[0.25, 0.5, 0.75, 1.0])
+            sf.write(1, [1.0, 2.0, 3.0, 4.0], stderr=[0.1, 0.2, 0.3, 0.4])
+            assert sf.clipped == 2
+        with scanfile.ScanFile.open(path) as sf:
+            assert sf.read(0).dtype == np.uint16
+            assert np.array_equal(sf.read(0), [1, 65535, 0, 10])
+            assert sf.read(0, "stderr").dtype == np.float32
+            assert np.allclose(sf.cube("stderr"), [[0.25, 0.5, 0.75, 1.0], [0.1, 0.2, 0.3, 0.4]])
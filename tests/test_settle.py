@@ -0,0 +1,64 @@
+# settle_or_correct keeps a point whose fresh status has the stage on target, whatever the settle wait said
+import pytest
+
+import utility
+
+
+class StaleAxis:
+    "an axis whose settle wait always times out (stale status packets) although it sits at position"
+
+    def __init__(self, position):
+        self._position = position
+        self.moves = 0
+        self.requests = 0
+
+    def move_to(self, target):
+        self.moves += 1
+
+    def position(self):
+        return self._position
+
+    def request_status(self):
+        self.requests += 1
+
+    def wait_until_settled(self, target, tol=0.2, timeout=10.0):
+        raise TimeoutError("no fresh status")
+
+
+@pytest.mark.parametrize("policy", ["retry", "accept"])
+@pytest.mark.parametrize("retries", [0, 2])
+def test_stale_status_on_target_is_kept(policy, retries):
+    axis = StaleAxis(30.05)
+    assert utility.settle_or_correct(axis, 30.0, tol=0.2, policy=policy, retries=retries) == 30.05
+    assert axis.moves == 0
+    assert axis.requests == 1
+
+
+def test_stale_status_off_target_still_raises():
+    axis = StaleAxis(31.0)
+    with pytest.raises(TimeoutError):
+        utility.settle_or_correct(axis, 30.0, tol=0.2, policy="retry", retries=2)
+    assert axis.moves == 2
+
+
+def test_abort_raises_straight_away():
+    with pytest.raises(TimeoutError):
+        utility.settle_or_correct(StaleAxis(30.0), 30.0, policy="abort")
+
+
+class StuckKinesis:
+    "a pylablib KinesisMotor that never stops, and whose wait_move raises pylablib's own kind of error"
+
+    def get_position(self):
+        return 12.0
+
+    def is_moving(self):
+        return True
+
+    def wait_move(self, timeout=None):
+        raise RuntimeError("ThorlabsTimeoutError")
+
+
+def test_kinesis_timeout_is_a_timeout_error():
+    with pytest.raises(TimeoutError):
+        utility.wait_until_settled_pll(StuckKinesis(), 12.0, timeout=0.1)
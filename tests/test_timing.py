@@ -0,0 +1,33 @@
+# spans recorded from several threads at once all land, however often the arrays grow underneath them
+import sys
+import threading
+
+import numpy as np
+
+import timing
+
+
+def test_concurrent_record_keeps_every_span():
+    recorder = timing.Recorder(capacity=4)
+    n_threads, n_spans = 4, 5000
+
+    def work(k):
+        for i in range(n_spans):
+            recorder.record(f"phase{k}", timing.clock(), point=i)
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(n_threads)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible, so a resize lands mid-record
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+    phase, point, start, duration = recorder.spans()
+    assert len(phase) == n_threads * n_spans
+    for k in range(n_threads):
+        mine = point[phase == recorder.phases.index(f"phase{k}")]
+        assert np.array_equal(np.sort(mine), np.arange(n_spans))
+    assert recorder.summary()["points"] == n_spans
@@ -0,0 +1,84 @@
+# settled angles of wrapped moves are recorded in the frame of the scan's own angles
+import numpy as np
+
+import adaptive
+import angles
+import planner
+import scan
+import simulate
+
+
+class ListSink:
+    def __init__(self):
+        self.points = {}
+
+    def open(self, pol_pos_d, wavelengths, background):
+        pass
+
+    def write_point(self, index, angle, intensity, **info):
+        self.points[index] = dict(info, angle=angle)
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self):
+        self.status = {"position": 0}
+
+
+class Motor:
+    "just what the scan loops read, the moves themselves are stubbed in move_and_settle"
+
+    stage = angles.PRM1Z8
+    velocity = 10.0
+    acceleration = 10.0
+
+    def __init__(self):
+        self.connection = Connection()
+
+
+def settle_near(monkeypatch, motor, offset=0.05):
+    "every move settles offset [deg] past its (unwrapped) target"
+
+    def move_and_settle(motor_, target, wait, tol=0.2, policy="abort", retries=2):
+        motor.connection.status["position"] = motor.stage.from_d(target + offset)
+        return target + offset
+
+    monkeypatch.setattr(scan, "move_and_settle", move_and_settle)
+
+
+def spectrometer():
+    return simulate.SimOcean(pixels=64, readout_time=0.0, seed=0)
+
+
+def test_step_scan_actual_angle_wrapped(monkeypatch):
+    motor = Motor()
+    settle_near(monkeypatch, motor)
+    spectrum = spectrometer()
+    spectrum.setinttime(1.0)
+    pol_pos_d = np.array([0.0, 300.0])
+    order, positions = planner.plan_order(pol_pos_d, 0.0, wrap=True)
+    assert min(positions) < 0.0  # 300 is reached going backwards, at -60
+    sink = ListSink()
+    writer = scan.ScanWriter([sink], spectrum.wavelengths)
+    scan.run_scan(motor, spectrum, pol_pos_d, writer, wait=1.0, order=order, positions=positions)
+    for i, angle in enumerate(pol_pos_d):
+        assert np.isclose(sink.points[i]["actual_angle"], angle + 0.05)
+
+
+def test_adaptive_scan_actual_angle_wrapped(monkeypatch):
+    motor = Motor()
+    settle_near(monkeypatch, motor)
+    spectrum = spectrometer()
+    spectrum.setinttime(1.0)
+    sampler = adaptive.AdaptiveSampler(0.0, 360.0, 60.0, harmonics=2, budget=12)
+    sink = ListSink()
+    writer = scan.ScanWriter([sink], spectrum.wavelengths)
+    background = np.zeros(len(spectrum.wavelengths))
+    n = adaptive.adaptive_scan(motor, spectrum, sampler, writer, 1.0, background, wrap=True)
+    assert n == len(sink.points) > 0
+    for point in sink.points.values():
+        assert np.isclose(point["actual_angle"], point["angle"] + 0.05)
+    assert np.allclose(np.asarray(sampler.angles), [p["angle"] + 0.05 for p in sink.points.values()])
+    assert min(sampler.angles) >= 0.0
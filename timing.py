@@ -0,0 +1,168 @@
+# Per-phase timing of a scan
+# the scan code marks where its time goes (connect, homing, move, settle, acquire, readout, validate, write...)
+# with a monotonic-clock span per phase per point. The spans go into preallocated numpy arrays, so recording one
+# is a lock and four stores, and while nothing is recording (the default) record() returns straight away.
+#
+#   t0 = timing.clock()
+#   ...the work...
+#   timing.record("move", t0)            point is the current one (timing.point(i)) unless given
+#
+#   recorder = timing.enable()           before the scan, then recorder.save("scan.tsv.timing") for the report
+import json
+import threading
+import time
+
+import numpy as np
+
+# the phases in report order, a name that isn't here is added on first use
+PHASES = (
+    "connect",
+    "homing",
+    "background",
+    "move",
+    "settle",
+    "acquire",
+    "readout",
+    "set_inttime",
+    "validate",
+    "write",
+)
+
+clock = time.perf_counter
+_recorder = None
+
+
+class Recorder:
+    """
+    spans [s] per phase per point in growable preallocated arrays
+    capacity - spans to allocate room for up front, doubled if a scan needs more
+    """
+
+    def __init__(self, capacity=65536):
+        self.phases = list(PHASES)
+        self._phase_index = {name: i for i, name in enumerate(self.phases)}
+        self.phase = np.zeros(capacity, dtype=np.int16)
+        self.point = np.zeros(capacity, dtype=np.int32)
+        self.start = np.zeros(capacity, dtype=np.float64)
+        self.duration = np.zeros(capacity, dtype=np.float64)
+        self.current_point = -1  # -1 for spans outside any point (connect, homing...)
+        self.t0 = clock()
+        # the scan thread and the writer thread both record, a span goes in (and the arrays grow) under the lock
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def record(self, phase, t0, point=None, t1=None):
+        "span of phase from t0 to t1 (now) [clock()], for point (the current one by default)"
+        t1 = clock() if t1 is None else t1
+        point = self.current_point if point is None else point
+        with self._lock:
+            slot = self._size
+            if slot >= len(self.start):
+                self._grow(slot)
+            i = self._phase_index.get(phase)
+            if i is None:
+                i = self._phase_index[phase] = len(self.phases)
+                self.phases.append(phase)
+            self.phase[slot] = i
+            self.point[slot] = point
+            self.start[slot] = t0 - self.t0
+            self.duration[slot] = t1 - t0
+            self._size = slot + 1
+
+    def _grow(self, slot):
+        "doubles the arrays until slot fits, called with the lock held"
+        n = len(self.start)
+        while n <= slot:
+            n *= 2
+        for name in ("phase", "point", "start", "duration"):
+            old = getattr(self, name)
+            new = np.zeros(n, dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+
+    def spans(self):
+        "(phase index, point, start [s], duration [s]) arrays of everything recorded, copies"
+        with self._lock:
+            n = self._size
+            return self.phase[:n].copy(), self.point[:n].copy(), self.start[:n].copy(), self.duration[:n].copy()
+
+    def summary(self, bins=20):
+        """
+        {"points", "elapsed_s", "points_per_minute", "phases": {phase: count, total, mean, percentiles, max, histogram}}
+        histograms are of duration [ms] over bins log-spaced bins
+        """
+        phase, point, start, duration = self.spans()
+        elapsed = clock() - self.t0
+        points = len(np.unique(point[point >= 0]))
+        phases = {}
+        for i, name in enumerate(list(self.phases)):
+            d = duration[phase == i] * 1e3
+            if len(d) == 0:
+                continue
+            lo, hi = max(d.min(), 1e-3), max(d.max(), 1e-3)
+            counts, edges = np.histogram(d, bins=np.geomspace(lo, hi * 1.000001, bins + 1))
+            p50, p90, p99 = np.percentile(d, [50, 90, 99])
+            phases[name] = {
+                "count": int(len(d)),
+                "total_s": float(d.sum() / 1e3),
+                "mean_ms": float(d.mean()),
+                "p50_ms": float(p50),
+                "p90_ms": float(p90),
+                "p99_ms": float(p99),
+                "max_ms": float(d.max()),
+                "histogram_ms": {"edges": edges.tolist(), "counts": counts.tolist()},
+            }
+        return {
+            "points": points,
+            "elapsed_s": elapsed,
+            "points_per_minute": points / elapsed * 60.0 if elapsed > 0 else 0.0,
+            "phases": phases,
+        }
+
+    def save(self, path):
+        "writes the summary to path.json and every span to path.csv (point, phase, start_s, duration_ms)"
+        summary = self.summary()
+        with open(path + ".json", "w") as f:
+            json.dump(summary, f, indent=2)
+        phase, point, start, duration = self.spans()
+        with open(path + ".csv", "w") as f:
+            f.write("point,phase,start_s,duration_ms\n")
+            for k in np.argsort(start, kind="stable"):
+                f.write(f"{point[k]},{self.phases[phase[k]]},{start[k]:.6f},{duration[k] * 1e3:.3f}\n")
+        return summary
+
+
+def enable(capacity=65536):
+    "starts recording into a new Recorder and returns it"
+    global _recorder
+    _recorder = Recorder(capacity)
+    return _recorder
+
+
+def disable():
+    "stops recording, returns the Recorder that was recording (or None)"
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def record(phase, t0, point=None):
+    "span of phase from t0 [clock()] to now, nothing happens unless enable()d"
+    if _recorder is not None:
+        _recorder.record(phase, t0, point)
+
+
+def point(index):
+    "the scan moved on to point index, spans recorded without a point belong to it"
+    if _recorder is not None:
+        _recorder.current_point = index
+
+
+def print_summary(summary):
+    print(f"{summary['points']} points in {summary['elapsed_s']:.1f} s, {summary['points_per_minute']:.1f} points/min")
+    print(f"  {'phase':<14}{'count':>7}{'total [s]':>11}{'p50 [ms]':>10}{'p90 [ms]':>10}{'p99 [ms]':>10}{'max [ms]':>10}")
+    for name, v in summary["phases"].items():
+        print(
+            f"  {name:<14}{v['count']:>7}{v['total_s']:>11.2f}{v['p50_ms']:>10.1f}"
+            f"{v['p90_ms']:>10.1f}{v['p99_ms']:>10.1f}{v['max_ms']:>10.1f}"
+        )
@@ -1,91 +1,65 @@
 import atexit
+import importlib
 import time
 
 import numpy as np
-import thorlabs_apt_device as apt
-from thorlabs_apt_device import protocol
-from pylablib.devices import Thorlabs as tl
 
 import angles
-import oceanOpticSpectrosco as spectro
+import drivers
+import readiness
+import timing
 
+# the vendor stacks are imported when a backend needs them (drivers.py), so the simulated backends
+# (simulate.py) and the tools that never touch hardware don't load them
+_LAZY = {
+    "apt": "thorlabs_apt_device",
+    "tl": "pylablib.devices.Thorlabs",
+    "spectro": "oceanOpticSpectrosco",
+}
 
-# Since aptdevice_motor doesn't include functions related to limit switch, need to define them
-class TDC001(apt.TDC001):
-    def set_lim_params_PRM1Z8(self, bay=0, channel=0):
-        """
-        Set parameters for limit switch.
-        :param bay: Index (0-based) of controller bay to send the command.
-        :param channel: Index (0-based) of controller bay channel to send the command.
-        """
-
-        self._log.debug("Setting limit parameters appropriate for PRM1Z8.")
-        self._loop.call_soon_threadsafe(
-            self._write,
-            protocol.mot_set_limswitchparams(
-                source=apt.EndPoint.HOST,
-                dest=self.bays[bay],
-                chan_ident=self.channels[channel],
-                cw_hardlimit=0x04,
-                ccw_hardlimit=0x01,
-                cw_softlimit=0x0780,
-                ccw_softlimit=0x0780,
-                soft_limit_mode=0x01,
-            ),
-        )
-        # Update status with new home parameters
-        self._loop.call_soon_threadsafe(
-            self._write,
-            protocol.mot_req_limswitchparams(
-                source=apt.EndPoint.HOST,
-                dest=self.bays[bay],
-                chan_ident=self.channels[channel],
-            ),
-        )
-
-    def set_dc_pid_params_PRM1Z8(self, bay=0, channel=0):
-        self._log.debug("Setting DC PID parameters appropriate for PRM1Z8.")
-
-        self._loop.call_soon_threadsafe(
-            self._write,
-            protocol.mot_set_dcpidparams(
-                source=apt.EndPoint.HOST,
-                dest=self.bays[bay],
-                chan_ident=self.channels[channel],
-                proportional=0x0352,
-                integral=0x96,
-                differential=0x0AA0,
-                integral_limit=0x32,
-            ),
-        )
-
-        self._loop.call_soon_threadsafe(
-            self._write,
-            protocol.mot_req_dcpidparams(
-                source=apt.EndPoint.HOST,
-                dest=self.bays[bay],
-                chan_ident=self.channels[channel],
-            ),
-        )
 
-    def set_home_params_PRM1Z8(self):
-        self.set_home_params(
-            velocity=0x00068D62, offset_distance=0x00001DFF, direction="reverse"
-        )
+def __getattr__(name):
+    "utility.apt, utility.tl, utility.spectro and utility.TDC001 still work, imported on first use"
+    if name in _LAZY:
+        return importlib.import_module(_LAZY[name])
+    if name == "TDC001":
+        return drivers.load("motor", "tdc001")
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 
 
 class AptMotor:
-    connection: TDC001
-
-    def __init__(self, port: str) -> None:
+    connection: "tdc001.TDC001"
+
+    def __init__(
+        self,
+        port: str,
+        connection_class=None,
+        velocity: float = 10.0,
+        acceleration: float = 10.0,
+        serial: str = None,
+        timeout: float = 60.0,
+        progress=readiness.print_progress,
+        stage: angles.Stage = angles.PRM1Z8,
+    ) -> None:
+        """
+        connection_class is the device class to use, tdc001.TDC001 by default (simulate.SimTDC001 for no hardware), velocity [deg/s] and acceleration [deg/s^2] for moves
+        stage holds the count/degree conversions for the stage on this controller (angles.Stage)
+        serial is the controller serial number, if this session already homed it and it has not moved, homing is skipped
+        timeout [sec] is the longest to wait for the controller to get ready, progress gets called while waiting (see readiness.py)
+        """
+        if connection_class is None:
+            connection_class = drivers.load("motor", "tdc001")
+        self.serial = serial
+        self.stage = stage
+        t0 = timing.clock()
         try:
             # We want to establish good connection is present before waiting for homing
-            self.connection = TDC001(serial_port=port, home=False)
+            self.connection = connection_class(serial_port=port, home=False)
             self.connection.set_enabled(state=True)
         except:
             raise Exception("an error occured while trying to connect to the motor")
 
-        atexit.register(self.connection.close)
+        atexit.register(self.close)
 
         # The TCube does not load parameters from stages, so the params for the PRM1Z8
         # need to be set
@@ -93,62 +67,136 @@ class AptMotor:
         self.connection.set_lim_params_PRM1Z8()
         self.connection.set_dc_pid_params_PRM1Z8()
 
-        # The status will not be updated until the homing is complete
-        # Check whether homing is complete every second
-        time.sleep(1.0)
-        print("homing...")
-        self.connection.home()
-        # self.connection.move_absolute(angles.from_d(10.0))
-        # self.connection.move_absolute(angles.from_d(-10.0))
-        for i in range(40):
-            time.sleep(1.0)
-            print(self.connection.status)
-            """
-            if self.connection.status["homed"]:
-                print("stage is now homed")
-                break
-            """
-
-        # Give controller a moment to initialize before asking it if the motor is connected
-        time.sleep(1.0)
+        # wait for status updates to start coming in (the channel we just enabled shows up as enabled)
+        readiness.wait_until_ready(
+            self.connection, flags=("channel_enabled",), timeout=timeout, progress=progress
+        )
+        timing.record("connect", t0)
+        if readiness.can_skip_homing_apt(serial, self.connection, stage=stage):
+            print("stage is still homed from earlier, skipping homing")
+        else:
+            print("homing...")
+            t0 = timing.clock()
+            self.connection.home()
+            readiness.wait_until_ready(
+                self.connection, flags=("homed",), timeout=timeout, progress=progress
+            )
+            timing.record("homing", t0)
+            print("stage is now homed")
 
-        # Set acceleration to 10000 counts/s/s, maximum velocity to 2000 counts/s/s
-        self.connection.set_velocity_params(10000, 2000)
+        # Set acceleration and maximum velocity
+        self.set_velocity(velocity, acceleration)
 
         if not is_mtr_connected(self.connection):
             print("estabishing connection with motor, one moment please")
-            # move 5 degrees, sleep, and then move back
-            self.connection.move_absolute(angles.from_d(5.0))
-            time.sleep(5.0)
+            # move 5 degrees, wait for it, and then move back
+            self.connection.move_absolute(stage.from_d(5.0))
+            self.wait_until_settled(5.0, timeout=5.0, raise_timeout=False)
             print(
                 "check: ",
                 self.connection.status["position"],
                 self.connection.status["motor_connected"],
             )
-            self.connection.move_absolute(angles.from_d(0.0))
-            time.sleep(5.0)
+            self.connection.move_absolute(stage.from_d(0.0))
+            self.wait_until_settled(0.0, timeout=5.0, raise_timeout=False)
             print("check: ", self.connection.status["position"])
 
         # now double check motor connection, if true yay keep going, else send it back to adam for fixin
         if not is_mtr_connected(self.connection):
             raise Exception("motor connection not established, debugging required")
         self.connection.register_error_callback(error_callback)
+        self.remember()
         print("motor connection established!")
 
+    def set_velocity(self, velocity, acceleration=None):
+        "sets the maximum velocity [deg/s] and acceleration [deg/s^2] of moves, the controller wants them in APT units"
+        if acceleration is None:
+            acceleration = self.acceleration
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.connection.set_velocity_params(
+            self.stage.from_dpss(acceleration), self.stage.from_dps(velocity)
+        )
 
-class KinesisMotor:
-    connection: tl.KinesisMotor
+    def remember(self):
+        "records the homed state and position with readiness so a reconnect can skip homing"
+        status = self.connection.status
+        readiness.remember(self.serial, status["homed"], self.stage.to_d(status["position"]))
 
-    def __init__(self) -> None:
-        print("connecting to back motor, one minute please")
+    def close(self):
+        if getattr(self, "_closed", False):
+            return
+        self._closed = True
         try:
-            bck = tl.KinesisMotor("27263055", scale="stage")
-            bck.home()
+            self.remember()
+        finally:
+            self.connection.close()
+
+    def move_to(self, target):
+        "starts a move to target [deg], returns straight away"
+        t0 = timing.clock()
+        self.connection.move_absolute(self.stage.from_d(target))
+        timing.record("move", t0)
+
+    def position(self):
+        "where the controller says the stage is [deg]"
+        return self.stage.to_d(self.connection.status["position"])
+
+    def is_connected(self):
+        return is_mtr_connected(self.connection)
+
+    def request_status(self, wait=0.1):
+        "asks the controller for a status update now and gives it wait [sec] to arrive, returns the position [deg]"
+        request = getattr(self.connection, "request_status", None)
+        if request is not None:
+            request()
+            time.sleep(wait)
+        return self.position()
+
+    def wait_until_settled(self, target, tol=0.2, timeout=10.0, settle=0.25, raise_timeout=True):
+        "blocks until the motor has sat within tol [deg] of target [deg] for settle [sec], returns the position [deg]"
+        t0 = timing.clock()
+        try:
+            return wait_until_settled(self.connection, target, tol, timeout, settle, stage=self.stage)
+        except TimeoutError:
+            if raise_timeout:
+                raise
+            return self.stage.to_d(self.connection.status["position"])
+        finally:
+            # the drift check, from the move being commanded to the stage sitting still on target
+            timing.record("settle", t0)
+
+
+class KinesisMotor:
+    connection: "pylablib.devices.Thorlabs.KinesisMotor"
+
+    def __init__(
+        self,
+        serial: str = "27263055",
+        connection_class=None,
+        timeout: float = 60.0,
+        progress=readiness.print_progress,
+    ) -> None:
+        """
+        connection_class is the device class to use, pylablib's KinesisMotor by default (simulate.SimKinesisMotor for no hardware)
+        timeout [sec] is the longest to wait for homing, progress gets called while waiting (see readiness.py)
+        """
+        if connection_class is None:
+            connection_class = drivers.load("kinesis", "kdc101")
+        self.serial = serial
+        print("connecting to back motor")
+        bck = None
+        try:
+            bck = connection_class(serial, scale="stage")
+            if readiness.can_skip_homing_pll(serial, bck):
+                print("back motor is still homed from earlier, skipping homing")
+            else:
+                bck.home(sync=False)
+                readiness.wait_until_ready_pll(bck, timeout=timeout, progress=progress)
         except:
-            bck.close()
+            if bck is not None:
+                bck.close()
             raise Exception("an error occured while trying to connect to KDC101")
-        else:
-            time.sleep(60.0)
         # check connection status of back motor
         bck_connection = is_pll_connected(bck)
         if bck_connection:
@@ -158,13 +206,38 @@ class KinesisMotor:
             raise Exception(
                 "could not establish connection with back motor, debugging required"
             )
+        self.connection = bck
+        readiness.remember(serial, True, bck.get_position())
+
+    def close(self):
+        try:
+            readiness.remember(
+                self.serial, "homed" in self.connection.get_status(), self.connection.get_position()
+            )
+        finally:
+            self.connection.close()
+
+    def move_to(self, target):
+        "starts a move to target [deg], returns straight away"
+        self.connection.move_to(target)
+
+    def position(self):
+        "where the controller says the stage is [deg]"
+        return self.connection.get_position()
+
+    def is_connected(self):
+        return is_pll_connected(self.connection)
+
+    def wait_until_settled(self, target, tol=0.2, timeout=10.0, settle=0.25):
+        "blocks until the motor has sat within tol [deg] of target [deg] for settle [sec], returns the position [deg]"
+        return wait_until_settled_pll(self.connection, target, tol, timeout, settle)
 
 
 class Spectrograph:
     def __init__(self) -> None:
         print("connecting to spectrograph")
         try:
-            spectrum = spectro.ocean(inputs["specSN"])
+            spectrum = drivers.load("spectrometer", "ocean")(inputs["specSN"])
         except:
             frnt.close()
             bck.close()
@@ -194,6 +267,133 @@ def is_pll_connected(motor):
     return connect
 
 
+def is_mtr_moving(motor):
+    "returns True while any of the APT motion flags in motor.status are set"
+    sts = motor.status
+    return (
+        sts["moving_forward"]
+        or sts["moving_reverse"]
+        or sts["jogging_forward"]
+        or sts["jogging_reverse"]
+        or sts["homing"]
+    )
+
+
+def wait_until_settled(
+    motor, target, tol=0.2, timeout=10.0, settle=0.25, poll=0.02, stage=angles.PRM1Z8
+):
+    """
+    watches the live status of an APT device instead of sleeping a fixed dwell
+    returns as soon as the stage has been stopped and within tol of target for settle seconds
+    inputs:
+    motor - APT device object (anything with a thorlabs_apt_device style status dict)
+    target - float - desired position [deg]
+    tol - float - allowed error [deg]
+    timeout - float - longest time [sec] to wait before giving up
+    settle - float - time [sec] the stage has to stay inside tolerance
+    poll - float - time [sec] between status reads
+    stage - angles.Stage of the stage on this controller
+    OUTPUT: position [deg] the stage settled at, raises TimeoutError if it never settles
+    """
+    start = time.monotonic()
+    inside_since = None
+    while True:
+        now = time.monotonic()
+        position = stage.to_d(motor.status["position"])
+        if abs(position - target) <= tol and not is_mtr_moving(motor):
+            if inside_since is None:
+                inside_since = now
+            elif now - inside_since >= settle:
+                return position
+        else:
+            inside_since = None
+        if now - start > timeout:
+            raise TimeoutError(
+                f"motor did not settle at {target} deg within {timeout} sec, last position {position} deg"
+            )
+        time.sleep(poll)
+
+
+def wait_until_settled_pll(motor, target, tol=0.2, timeout=10.0, settle=0.25, poll=0.02):
+    """
+    same as wait_until_settled but for a pylablib KinesisMotor (scale='stage' so positions are in deg)
+    polls is_moving() against its own deadline rather than calling wait_move, whose timeout is pylablib's
+    own error, so running out of time is always a TimeoutError the position policies can act on
+    """
+    start = time.monotonic()
+    inside_since = None
+    while True:
+        now = time.monotonic()
+        position = motor.get_position()
+        if abs(position - target) <= tol and not motor.is_moving():
+            if inside_since is None:
+                inside_since = now
+            elif now - inside_since >= settle:
+                return position
+        else:
+            inside_since = None
+        if now - start > timeout:
+            raise TimeoutError(
+                f"motor did not settle at {target} deg within {timeout} sec, last position {position} deg"
+            )
+        time.sleep(poll)
+
+
+# what settle_or_correct does when the stage isn't where it was sent
+POSITION_POLICIES = ("retry", "accept", "abort")
+
+
+def settle_or_correct(axis, target, tol=0.2, timeout=10.0, policy="abort", retries=2):
+    """
+    waits for axis to settle at target [deg] (the move there already commanded) and, if it doesn't, goes by policy:
+    "abort" - raises TimeoutError straight away
+    "retry" - asks for a fresh status (the last one may have been stale) and, if the stage really is off,
+              commands the move again, up to retries times, then raises TimeoutError
+    "accept" - as retry, but once the retries are used up keeps wherever the stage ended up
+    axis - AptMotor, KinesisMotor, anything with move_to, wait_until_settled, position (and request_status)
+    OUTPUT: position [deg] the stage actually settled at
+    """
+    if policy not in POSITION_POLICIES:
+        raise ValueError(f"position policy has to be one of {POSITION_POLICIES}, not {policy}")
+    for attempt in range(retries + 1):
+        try:
+            return axis.wait_until_settled(target, tol=tol, timeout=timeout)
+        except TimeoutError:
+            if policy == "abort":
+                raise
+        request = getattr(axis, "request_status", None)
+        if request is not None:
+            request()
+        position = axis.position()
+        if abs(position - target) <= tol:
+            return position  # the status was stale, the fresh one has it where it was sent
+        if attempt < retries:
+            print(f"polarizer at {position:.3f} deg instead of {target} deg, correcting ({attempt + 1}/{retries})")
+            axis.move_to(target)
+    position = axis.position()
+    if policy == "accept":
+        print(f"polarizer settled at {position:.3f} deg instead of {target} deg, keeping the point there")
+        return position
+    raise TimeoutError(f"polarizer still at {position} deg, not {target} deg, after {retries} corrections")
+
+
+class _AptAxis:
+    "the axis settle_or_correct wants, over a bare thorlabs_apt_device motor (as pol_step uses)"
+
+    def __init__(self, device, stage=angles.PRM1Z8):
+        self.device = device
+        self.stage = stage
+
+    def move_to(self, target):
+        self.device.move_absolute(self.stage.from_d(target))
+
+    def position(self):
+        return self.stage.to_d(self.device.status["position"])
+
+    def wait_until_settled(self, target, tol=0.2, timeout=10.0):
+        return wait_until_settled(self.device, target, tol, timeout, stage=self.stage)
+
+
 # in case the motor throws an error
 def error_callback(source, code, note):
     print(f"Device {source} reported error code{code}: {note}")
@@ -201,10 +401,12 @@ def error_callback(source, code, note):
 
 def list_com_devices():
     "literally what the funct say, just a wrapper for an apt funct"
+    import thorlabs_apt_device as apt
+
     print(apt.devices.aptdevice.list_devices())
 
 
-def pol_step(port, initial, step, final, wait):
+def pol_step(port, initial, step, final, wait, policy="abort", retries=2):
     """
     connects to motor, moves to initial position, takes however many steps it takes to reach the final position waiting every time
     NOTE: when motor is initialized there is a 50-50 chance it will home to 0 (the marker on the thing) assume it does
@@ -214,7 +416,8 @@ def pol_step(port, initial, step, final, wait):
     initial - float - initial pol position [deg]
     step - float - step size the pol will take [deg]
     final - float - final pol position [deg]
-    wait - float - time [sec] waited before the pol moves again
+    wait - float - longest time [sec] to wait for the pol to settle before giving up
+    policy, retries - what to do when the pol doesn't settle where it was sent (see settle_or_correct)
     NOTE: if 0.<step<80. then wait > 10 sec, if 80<step<=180 then wait > 20sec
     NO OUTPUTS
     """
@@ -231,24 +434,32 @@ def pol_step(port, initial, step, final, wait):
     elif 80.0 < step <= 180.0:
         assert wait > 20.0, "wait gotta be longer champ"
     # connect to the motor
-    print("estabishing connection with motor, one minute please")
+    import thorlabs_apt_device as apt
+
+    print("estabishing connection with motor")
+    mtr = None
     try:
         mtr = apt.devices.tdc001.TDC001(serial_port=port)
+        # it homes on connecting, wait for the controller to say it is done
+        readiness.wait_until_ready(mtr, flags=("homed",), timeout=60.0)
     except:
-        mtr.close()
+        if mtr is not None:
+            mtr.close()
         raise Exception("an error occured while trying to connect to the motor")
-    else:
-        time.sleep(60.0)
     # check for the motor connected status, if it starts off as True just continue code, or move and re-home and double check
     mtr_connection = is_mtr_connected(
         mtr
     )  # status if the motor is connected (bool), must always be true
     if mtr_connection == False:
-        # move 5 degrees, sleep, and then move back
+        # move 5 degrees, wait for it, and then move back
+        start = angles.to_d(mtr.status["position"])
         mtr.move_relative(angles.from_d(5.0))
-        time.sleep(wait)
-        mtr.move_absolute(angles.from_d(0.0))
-        time.sleep(wait)
+        try:
+            wait_until_settled(mtr, start + 5.0, timeout=wait)
+            mtr.move_absolute(angles.from_d(0.0))
+            wait_until_settled(mtr, 0.0, timeout=wait)
+        except TimeoutError:
+            pass  # the check below says whether the motor is there
     # now double check motor connection, if true yay keep going, else send it back to adam for fixin
     mtr_connection = is_mtr_connected(mtr)
     if mtr_connection:
@@ -261,12 +472,12 @@ def pol_step(port, initial, step, final, wait):
     # desired polarizer positions [deg]
     pol_pos_d = np.arange(initial, final + step, step, dtype=float)
     # desired polarizer pos [cts]
-    pol_pos_cts = np.array([angles.from_d(pol_pos_d[i]) for i in range(len(pol_pos_d))])
+    pol_pos_cts = angles.from_d(pol_pos_d)
     # move pol to initial pos, if needed
     if np.isclose(pol_pos_d[0], angles.to_d(mtr.status["position"]), atol=0.2) == False:
         print("moving polarizer to initial position")
         mtr.move_absolute(pol_pos_cts[0])
-        time.sleep(wait)
+        wait_until_settled(mtr, pol_pos_d[0], timeout=wait)
     print("starting polarizer walk")
     # if checks are failed, have a vari that if we had to break the loop it will just end the program after the loop
     did_break = False
@@ -276,11 +487,12 @@ def pol_step(port, initial, step, final, wait):
         if mtr_connection:
             mtr.move_absolute(pol_pos_cts[i])
             print("moving to", pol_pos_d[i], "deg")
-            time.sleep(wait)
-            # check polarizer pos isnt drifting
-            drift = np.isclose(
-                pol_pos_d[i], angles.to_d(mtr.status["position"]), atol=0.2
-            )
+            # check polarizer pos isnt drifting, wait is now only the longest we are willing to wait
+            try:
+                settle_or_correct(_AptAxis(mtr), pol_pos_d[i], tol=0.2, timeout=wait, policy=policy, retries=retries)
+                drift = True
+            except TimeoutError:
+                drift = False
             if drift == False:
                 print("polarizer has drifted from desired values, ending collection")
                 did_break = True